@@ -1,31 +1,64 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Form, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from datetime import timedelta
+from typing import List, Optional
+from datetime import datetime, timedelta
 
 from app.core.database import get_db
-from app.core.security import verify_password, create_access_token, get_password_hash
+from app.core.auth_cache import Principal, principal_cache
+from app.core.password_hashing import HashingBusyError, hash_password, password_hasher, verify_and_update_password
+from app.core.security import create_access_token, decode_access_token
+from app.models.auth_session import AuthSession
 from app.models.user import User
-from app.schemas.user import Token, UserCreate, UserResponse
+from app.schemas.user import AuthSessionResponse, RefreshRequest, Token, UserCreate, UserResponse
+from app.services.sessions import SessionError, create_session, revoke_session, revoke_user_sessions, rotate_session
+from app.services.staff_cache import invalidate_staff_profiles
 from app.core.config import settings
 
 router = APIRouter()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
-def authenticate_user(db: Session, username: str, password: str):
+def password_busy(error: HashingBusyError) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(error),
+        headers={"Retry-After": "1"},
+    )
+
+async def hash_user_password(password: str) -> str:
+    """Hash on the dedicated password executor; 503 when it is saturated"""
+    try:
+        return await hash_password(password)
+    except HashingBusyError as e:
+        raise password_busy(e)
+
+async def authenticate_user(db: Session, username: str, password: str):
     """Authenticate a user by username and password"""
     # Try to find user by name field (username)
     user = db.query(User).filter(User.name == username).first()
-    if not user or not verify_password(password, user.password_hash):
+    if not user:
         return None
+    password_hash = user.password_hash
+    # Give the connection back to the pool while bcrypt runs
+    db.rollback()
+    try:
+        valid, new_hash = await verify_and_update_password(password, password_hash)
+    except HashingBusyError as e:
+        raise password_busy(e)
+    if not valid:
+        return None
+    # Stored with other bcrypt rounds than configured: upgrade transparently
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
     return user
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Get the current authenticated user from token"""
-    from app.core.security import decode_access_token
-    import logging
-    logger = logging.getLogger(__name__)
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    """Get the current authenticated user from token (cached per token)"""
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -33,38 +66,27 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    logger.info(f"Received token: {token[:20]}...")
     payload = decode_access_token(token)
-    logger.info(f"Decoded payload: {payload}")
-    
     if payload is None:
-        logger.error("Payload is None")
-        raise credentials_exception
-    
-    user_id_str = payload.get("sub")
-    logger.info(f"User ID from token: {user_id_str}, type: {type(user_id_str)}")
-    
-    if user_id_str is None:
-        logger.error("User ID is None")
         raise credentials_exception
     
     try:
-        user_id = int(user_id_str)
+        user_id = int(payload.get("sub"))
     except (ValueError, TypeError):
-        logger.error(f"Cannot convert user_id to int: {user_id_str}")
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
-    logger.info(f"Found user: {user}")
-    
-    if user is None:
-        logger.error("User not found in database")
+    user = db.query(User.id, User.role, User.name, User.is_active).filter(User.id == user_id).first()
+    # End the read so the request does not hold a pooled connection while it awaits
+    db.rollback()
+    if user is None or user.is_active == 0:
         raise credentials_exception
     
-    return user
+    principal = Principal(id=user.id, role=user.role, name=user.name)
+    principal_cache.put(token, principal, payload.get("exp"))
+    return principal
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     """Register a new user"""
     # Check if user already exists
     existing_user = db.query(User).filter(User.email == user_data.email).first()
@@ -73,9 +95,10 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
+    db.rollback()
     
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await hash_user_password(user_data.password)
     new_user = User(
         email=user_data.email,
         name=user_data.name,
@@ -86,13 +109,33 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    invalidate_staff_profiles()
     
     return new_user
 
+def token_response(user, refresh_token: str) -> dict:
+    """New access token for the user, returned together with the refresh token"""
+    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": str(user.id), "email": user.email, "role": user.role},
+        expires_delta=access_token_expires
+    )
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": int(access_token_expires.total_seconds())
+    }
+
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    """Login and get access token"""
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    device_id: Optional[str] = Form(None),
+    device_name: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """Login and get access and refresh tokens; terminals pass device_id for a long-lived session"""
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -100,15 +143,74 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": str(user.id), "email": user.email, "role": user.role},
-        expires_delta=access_token_expires
-    )
+    _, refresh_token = create_session(db, user.id, device_id, device_name)
+    db.commit()
+    return token_response(user, refresh_token)
+
+@router.post("/refresh", response_model=Token)
+def refresh(request: RefreshRequest, db: Session = Depends(get_db)):
+    """Exchange a refresh token for a new access token and a new refresh token"""
+    try:
+        user_id, refresh_token = rotate_session(db, request.refresh_token, request.device_id)
+    except SessionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=str(e),
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     
-    return {"access_token": access_token, "token_type": "bearer"}
+    user = db.query(User.id, User.email, User.role, User.is_active).filter(User.id == user_id).first()
+    if user is None or user.is_active == 0:
+        revoke_session(db, refresh_token)
+        db.commit()
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User is not active")
+    db.commit()
+    return token_response(user, refresh_token)
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout(request: RefreshRequest, db: Session = Depends(get_db)):
+    """Revoke a refresh token (the access token expires on its own)"""
+    revoke_session(db, request.refresh_token)
+    db.commit()
+    return None
+
+@router.get("/sessions", response_model=List[AuthSessionResponse])
+def get_sessions(current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Active sessions of the current user"""
+    return db.query(AuthSession).filter(
+        AuthSession.user_id == current_user.id,
+        AuthSession.revoked_at == None,
+        AuthSession.expires_at > datetime.utcnow()
+    ).order_by(AuthSession.last_used_at.desc()).all()
+
+@router.delete("/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_session(
+    session_id: int,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Revoke one of the current user's sessions (e.g. a lost terminal)"""
+    if not revoke_user_sessions(db, current_user.id, session_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found")
+    db.commit()
+    return None
 
 @router.get("/me", response_model=UserResponse)
-def get_current_user_info(current_user: User = Depends(get_current_user)):
+def get_current_user_info(current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get current user information"""
-    return current_user
+    user = db.query(User).filter(User.id == current_user.id).first()
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return user
+
+@router.get("/hash-metrics")
+def get_hash_metrics(current_user: Principal = Depends(get_current_user)):
+    """Password hashing latency and load (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    return {
+        "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+        "workers": password_hasher.workers,
+        "in_flight": password_hasher.in_flight,
+        **password_hasher.metrics.snapshot()
+    }
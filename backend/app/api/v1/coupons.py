@@ -1,11 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List
 from datetime import datetime
+import uuid
 from app.core.database import get_db
 from app.api.v1.auth import get_current_user
 from app.models.coupon import Coupon, DiscountType
 from app.models.user import User
+from app.services.coupons import (
+    CouponError,
+    DEFAULT_CODE_ALPHABET,
+    redeem_coupon,
+    generate_coupon_codes,
+    bulk_create_coupons,
+    iter_batch_codes_csv
+)
+from app.services.discounts import CartLine, apply_coupons, cart_lines_for, requested_coupon_codes
 from pydantic import BaseModel, Field
 
 router = APIRouter()
@@ -25,6 +36,7 @@ class CouponCreate(BaseModel):
     is_active: bool = True
     applicable_categories: str | None = None
     free_item_id: int | None = None
+    is_stackable: bool = False
 
 
 class CouponUpdate(BaseModel):
@@ -39,6 +51,30 @@ class CouponUpdate(BaseModel):
     is_active: bool | None = None
     applicable_categories: str | None = None
     free_item_id: int | None = None
+    is_stackable: bool | None = None
+
+
+class CouponBatchCreate(BaseModel):
+    count: int = Field(..., gt=0, le=1_000_000)
+    length: int = Field(8, ge=4, le=32)
+    alphabet: str = Field(DEFAULT_CODE_ALPHABET, min_length=2, pattern=r'^[A-Za-z0-9]+$')
+    prefix: str = Field("", max_length=16, pattern=r'^[A-Za-z0-9_-]*$')
+    description: str | None = None
+    discount_type: DiscountType
+    discount_value: float
+    min_order_amount: float = 0.0
+    max_discount_amount: float | None = None
+    usage_limit: int | None = 1  # kody jednorazowe
+    valid_from: datetime | None = None
+    valid_until: datetime | None = None
+    applicable_categories: str | None = None
+    free_item_id: int | None = None
+    is_stackable: bool = False
+
+
+class CouponBatchResponse(BaseModel):
+    batch_id: str
+    created: int
 
 
 class CouponResponse(BaseModel):
@@ -56,6 +92,8 @@ class CouponResponse(BaseModel):
     is_active: bool
     applicable_categories: str | None
     free_item_id: int | None
+    is_stackable: bool | None = False
+    batch_id: str | None = None
     created_at: datetime
 
     class Config:
@@ -65,7 +103,8 @@ class CouponResponse(BaseModel):
 class CouponValidationRequest(BaseModel):
     code: str
     order_total: float
-    items: List[dict]
+    items: List[dict] = []
+    additional_codes: List[str] = []  # kolejne kupony łączone z pierwszym
 
 
 class CouponValidationResponse(BaseModel):
@@ -73,6 +112,8 @@ class CouponValidationResponse(BaseModel):
     discount_amount: float = 0.0
     final_total: float = 0.0
     message: str | None = None
+    applied: dict = {}  # kod -> zniżka
+    lines: List[dict] = []  # rozbicie zniżki na pozycje
 
 
 # API Endpoints
@@ -103,7 +144,8 @@ async def create_coupon(
         valid_until=coupon.valid_until,
         is_active=coupon.is_active,
         applicable_categories=coupon.applicable_categories,
-        free_item_id=coupon.free_item_id
+        free_item_id=coupon.free_item_id,
+        is_stackable=coupon.is_stackable
     )
     
     db.add(db_coupon)
@@ -112,6 +154,74 @@ async def create_coupon(
     return db_coupon
 
 
+@router.post("/bulk", response_model=CouponBatchResponse, status_code=status.HTTP_201_CREATED)
+def create_coupon_batch(
+    batch: CouponBatchCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Generuje partię unikalnych kodów (np. jednorazowe kody dla kampanii).
+
+    Zwykłe `def`: generowanie i zapis do 500k kodów działa w puli wątków,
+    a nie blokuje pętli zdarzeń (pozostałe żądania i websockety).
+    """
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Brak uprawnień")
+
+    prefix = batch.prefix.upper()
+    alphabet = "".join(dict.fromkeys(batch.alphabet.upper()))
+    existing = db.query(Coupon.code).filter(Coupon.code.startswith(prefix, autoescape=True))
+
+    try:
+        codes = generate_coupon_codes(
+            batch.count,
+            length=batch.length,
+            alphabet=alphabet,
+            prefix=prefix,
+            exclude=(code for (code,) in existing)
+        )
+    except CouponError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    batch_id = uuid.uuid4().hex[:12]
+    created = bulk_create_coupons(
+        db,
+        codes,
+        batch_id=batch_id,
+        description=batch.description,
+        discount_type=batch.discount_type,
+        discount_value=batch.discount_value,
+        min_order_amount=batch.min_order_amount,
+        max_discount_amount=batch.max_discount_amount,
+        usage_limit=batch.usage_limit,
+        valid_from=batch.valid_from or datetime.utcnow(),
+        valid_until=batch.valid_until,
+        is_active=True,
+        applicable_categories=batch.applicable_categories,
+        free_item_id=batch.free_item_id,
+        is_stackable=batch.is_stackable
+    )
+    db.commit()
+    return CouponBatchResponse(batch_id=batch_id, created=created)
+
+
+@router.get("/batches/{batch_id}/export")
+def export_coupon_batch(
+    batch_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Eksportuje kody z partii jako strumień CSV"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Brak uprawnień")
+
+    return StreamingResponse(
+        iter_batch_codes_csv(db, batch_id),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="coupons_{batch_id}.csv"'}
+    )
+
+
 @router.get("/", response_model=List[CouponResponse])
 async def get_coupons(
     skip: int = 0,
@@ -192,80 +302,45 @@ async def validate_coupon(
     validation: CouponValidationRequest,
     db: Session = Depends(get_db)
 ):
-    """Waliduje kupon i oblicza zniżkę"""
-    coupon = db.query(Coupon).filter(Coupon.code == validation.code.upper()).first()
-    
-    if not coupon:
-        return CouponValidationResponse(
-            valid=False,
-            message="Kod kuponu nie istnieje"
-        )
-    
-    # Sprawdź czy aktywny
-    if not coupon.is_active:
-        return CouponValidationResponse(
-            valid=False,
-            message="Kupon jest nieaktywny"
-        )
-    
-    # Sprawdź datę ważności
-    now = datetime.utcnow()
-    if coupon.valid_from and coupon.valid_from > now:
-        return CouponValidationResponse(
-            valid=False,
-            message="Kupon jeszcze nie jest aktywny"
-        )
-    
-    if coupon.valid_until and coupon.valid_until < now:
-        return CouponValidationResponse(
-            valid=False,
-            message="Kupon wygasł"
-        )
-    
-    # Sprawdź limit użyć
-    if coupon.usage_limit and coupon.usage_count >= coupon.usage_limit:
-        return CouponValidationResponse(
-            valid=False,
-            message="Limit użyć kuponu został wyczerpany"
-        )
-    
-    # Sprawdź minimalną kwotę zamówienia
-    if validation.order_total < coupon.min_order_amount:
-        return CouponValidationResponse(
-            valid=False,
-            message=f"Minimalna kwota zamówienia: {coupon.min_order_amount} zł"
-        )
-    
-    # Oblicz zniżkę
-    discount_amount = 0.0
-    
-    if coupon.discount_type == DiscountType.PERCENTAGE:
-        discount_amount = validation.order_total * (coupon.discount_value / 100)
-        if coupon.max_discount_amount:
-            discount_amount = min(discount_amount, coupon.max_discount_amount)
-    elif coupon.discount_type == DiscountType.FIXED:
-        discount_amount = min(coupon.discount_value, validation.order_total)
-    
-    final_total = max(0, validation.order_total - discount_amount)
-    
+    """Waliduje kupon i oblicza zniżkę dla pozycji koszyka"""
+    if validation.items:
+        lines = cart_lines_for(db, validation.items)
+    else:
+        # Bez pozycji rabat liczony jest od całej kwoty zamówienia
+        lines = [CartLine(item_id=None, name=None, quantity=1, unit_price=validation.order_total)]
+
+    try:
+        _, result = apply_coupons(db, requested_coupon_codes(validation.code, validation.additional_codes), lines)
+    except CouponError as e:
+        return CouponValidationResponse(valid=False, message=str(e))
+
     return CouponValidationResponse(
         valid=True,
-        discount_amount=round(discount_amount, 2),
-        final_total=round(final_total, 2),
-        message="Kupon został zastosowany"
+        discount_amount=result.discount_amount,
+        final_total=result.total,
+        message="Kupon został zastosowany",
+        applied=result.applied,
+        lines=[vars(line) for line in result.lines]
     )
 
 
 @router.post("/{coupon_id}/use")
 async def use_coupon(
     coupon_id: int,
+    order_id: int | None = None,
+    amount: float = 0.0,
     db: Session = Depends(get_db)
 ):
-    """Zwiększa licznik użycia kuponu"""
+    """Atomowo zwiększa licznik użycia kuponu (idempotentnie dla zamówienia)"""
     coupon = db.query(Coupon).filter(Coupon.id == coupon_id).first()
     if not coupon:
         raise HTTPException(status_code=404, detail="Kupon nie znaleziony")
     
-    coupon.usage_count += 1
+    try:
+        redeem_coupon(db, coupon.id, amount, order_id=order_id)
+    except CouponError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
     db.commit()
+    db.refresh(coupon)
     return {"message": "Kupon użyty", "usage_count": coupon.usage_count}
@@ -0,0 +1,79 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List
+from datetime import datetime
+from app.core.database import get_db
+from app.api.v1.auth import get_current_user
+from app.models.user import User
+from app.services.customer_index import autocomplete_customers
+from app.services.customers import find_customer
+from pydantic import BaseModel
+
+router = APIRouter()
+
+
+# Pydantic schemas
+class CustomerLoyaltySummary(BaseModel):
+    points: int | None
+    tier: str | None
+    total_visits: int | None
+    referral_code: str | None
+
+    class Config:
+        from_attributes = True
+
+
+class CustomerPreferenceSummary(BaseModel):
+    favorite_items: str | None
+    order_frequency: int | None
+    total_spent: float | None
+    last_order_date: datetime | None
+    preferred_order_type: str | None
+    notes: str | None
+
+    class Config:
+        from_attributes = True
+
+
+class CustomerSuggestion(BaseModel):
+    phone: str
+    name: str | None
+    tier: str | None
+    points: int | None
+    last_order: datetime | None
+
+
+class CustomerResponse(BaseModel):
+    id: int
+    phone: str
+    name: str | None
+    loyalty: CustomerLoyaltySummary | None
+    preference: CustomerPreferenceSummary | None
+
+    class Config:
+        from_attributes = True
+
+
+# API Endpoints
+@router.get("/autocomplete", response_model=List[CustomerSuggestion])
+async def autocomplete(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Podpowiedzi klientów po początku numeru telefonu (indeks w pamięci)"""
+    return [suggestion._asdict() for suggestion in autocomplete_customers(db, prefix, limit)]
+
+
+@router.get("/{phone}", response_model=CustomerResponse)
+async def get_customer(
+    phone: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Klient po numerze telefonu (dowolny zapis) z kontem lojalnościowym i preferencjami"""
+    customer = find_customer(db, phone)
+    if not customer:
+        raise HTTPException(status_code=404, detail="Klient nie znaleziony")
+    return customer
@@ -1,15 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import RedirectResponse, Response
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import List
 from datetime import datetime, timedelta
+from app.core.config import settings
 from app.core.database import get_db
 from app.api.v1.auth import get_current_user
-from app.models.marketing import MarketingCampaign, MarketingMessage, LoyaltyProgram, CampaignType, CampaignStatus, TriggerType
+from app.models.marketing import MarketingCampaign, LoyaltyProgram, LoyaltyTransaction, LoyaltyTransactionType, CampaignType, CampaignStatus, TriggerType, CampaignSendJob, SendJobStatus, CustomerSegment
 from app.models.recommendation import CustomerPreference
 from app.models.user import User
+from app.services.campaigns import CampaignSendError, start_campaign_send
+from app.services.customer_index import refresh_customer
+from app.services.customers import ensure_customer, normalize_phone
+from app.services.jobs import enqueue
+from app.services.loyalty import (
+    LoyaltyAccountNotFound, LoyaltyError, adjust_points, deduct_points, earn_points, generate_referral_code, points_discount
+)
+from app.services.segments import SEGMENTS
+from app.services.templates import TemplateError, campaign_template, fit_sms, sms_length, template_context, to_gsm7
+from app.services.tracking import TRACKING_PIXEL, tracking_buffer, verify_message_token
 from pydantic import BaseModel
-import random
-import string
 
 router = APIRouter()
 
@@ -29,6 +40,16 @@ class CampaignCreate(BaseModel):
     coupon_code: str | None = None
 
 
+class CampaignPreviewRequest(BaseModel):
+    campaign_type: CampaignType = CampaignType.SMS
+    message_template: str
+    coupon_code: str | None = None
+    customer_name: str | None = None
+    points: int | None = None
+    tier: str | None = None
+    favorite_items: str | None = None
+
+
 class CampaignResponse(BaseModel):
     id: int
     name: str
@@ -43,6 +64,21 @@ class CampaignResponse(BaseModel):
         from_attributes = True
 
 
+class CampaignSendJobResponse(BaseModel):
+    id: int
+    campaign_id: int
+    status: SendJobStatus
+    total: int
+    processed: int
+    error_message: str | None
+    created_at: datetime | None
+    started_at: datetime | None
+    finished_at: datetime | None
+
+    class Config:
+        from_attributes = True
+
+
 class LoyaltyProgramResponse(BaseModel):
     id: int
     customer_phone: str
@@ -57,22 +93,16 @@ class LoyaltyProgramResponse(BaseModel):
         from_attributes = True
 
 
-# Helper functions
-def generate_referral_code(length=8):
-    """Generuje unikalny kod polecający"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-
-
-async def send_sms(phone: str, message: str):
-    """Wysyłanie SMS (integracja z Twilio, MessageBird, etc.)"""
-    print(f"[SMS] Wysyłanie do {phone}: {message}")
-    return True
-
+class LoyaltyTransactionResponse(BaseModel):
+    id: int
+    kind: LoyaltyTransactionType
+    points: int
+    order_id: int | None
+    description: str | None
+    created_at: datetime
 
-async def send_email(email: str, subject: str, message: str):
-    """Wysyłanie emaili (integracja z SendGrid, Mailgun, etc.)"""
-    print(f"[EMAIL] Wysyłanie do {email}: {subject}")
-    return True
+    class Config:
+        from_attributes = True
 
 
 # API Endpoints
@@ -86,6 +116,13 @@ async def create_campaign(
     if current_user.role != 'admin':
         raise HTTPException(status_code=403, detail="Brak uprawnień")
 
+    if campaign.target_segment not in (None, "all", *SEGMENTS):
+        raise HTTPException(status_code=400, detail=f"Nieznany segment: {campaign.target_segment}")
+    try:
+        campaign_template(campaign.message_template, campaign.coupon_code)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     db_campaign = MarketingCampaign(**campaign.dict())
     db.add(db_campaign)
     db.commit()
@@ -93,6 +130,42 @@ async def create_campaign(
     return db_campaign
 
 
+@router.post("/campaigns/preview")
+async def preview_campaign_message(
+    preview: CampaignPreviewRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Podgląd wiadomości dla przykładowego klienta wraz z długością SMS"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Brak uprawnień")
+
+    try:
+        template = campaign_template(preview.message_template, preview.coupon_code)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    content = template.render(*template_context(
+        name=preview.customer_name,
+        points=preview.points,
+        tier=preview.tier,
+        coupon=preview.coupon_code,
+        favorite_items=preview.favorite_items
+    ))
+    if preview.campaign_type != CampaignType.SMS:
+        return {"content": content}
+
+    if settings.SMS_TRANSLITERATE:
+        content = to_gsm7(content)
+    length = sms_length(content)
+    return {
+        "content": fit_sms(content, settings.SMS_MAX_SEGMENTS),
+        "encoding": length.encoding,
+        "length": length.units,
+        "segments": length.segments,
+        "truncated": length.segments > settings.SMS_MAX_SEGMENTS
+    }
+
+
 @router.get("/campaigns", response_model=List[CampaignResponse])
 async def get_campaigns(
     db: Session = Depends(get_db),
@@ -105,14 +178,13 @@ async def get_campaigns(
     return db.query(MarketingCampaign).all()
 
 
-@router.post("/campaigns/{campaign_id}/send")
+@router.post("/campaigns/{campaign_id}/send", status_code=status.HTTP_202_ACCEPTED)
 async def send_campaign(
     campaign_id: int,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Wysyła kampanię do wybranej grupy klientów"""
+    """Kolejkuje wysyłkę kampanii dla workera i od razu zwraca identyfikator zadania"""
     if current_user.role != 'admin':
         raise HTTPException(status_code=403, detail="Brak uprawnień")
 
@@ -120,40 +192,84 @@ async def send_campaign(
     if not campaign:
         raise HTTPException(status_code=404, detail="Kampania nie znaleziona")
 
-    # Pobierz klientów według segmentu
-    customers = db.query(CustomerPreference).filter(
-        CustomerPreference.order_frequency >= campaign.min_order_count,
-        CustomerPreference.total_spent >= campaign.min_total_spent
-    ).all()
+    try:
+        job = start_campaign_send(db, campaign)
+    except CampaignSendError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    sent_count = 0
-    for customer in customers:
-        # Personalizuj wiadomość
-        message = campaign.message_template.replace("{name}", customer.customer_name or "Kliencie")
-        if campaign.coupon_code:
-            message += f"\n\nTwój kod rabatowy: {campaign.coupon_code}"
-
-        # Utwórz rekord wiadomości
-        msg = MarketingMessage(
-            campaign_id=campaign.id,
-            customer_phone=customer.customer_phone,
-            message_type=campaign.campaign_type,
-            subject=campaign.subject,
-            message_content=message
-        )
-        db.add(msg)
-        
-        # Wyślij w tle
-        if campaign.campaign_type == CampaignType.SMS:
-            background_tasks.add_task(send_sms, customer.customer_phone, message)
-        
-        sent_count += 1
-
-    campaign.sent_count = sent_count
-    campaign.status = CampaignStatus.ACTIVE
+    return {"message": "Wysyłka kampanii rozpoczęta", "job_id": job.id}
+
+
+@router.get("/campaigns/sends/{job_id}", response_model=CampaignSendJobResponse)
+async def get_campaign_send_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Postęp wysyłki kampanii"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Brak uprawnień")
+
+    job = db.query(CampaignSendJob).filter(CampaignSendJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Zadanie nie znalezione")
+    return job
+
+
+@router.get("/segments")
+async def get_segments(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Liczebność segmentów RFM z ostatniego przeliczenia"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Brak uprawnień")
+
+    counts = dict(
+        db.query(CustomerSegment.segment, func.count()).group_by(CustomerSegment.segment).all()
+    )
+    computed_at = db.query(func.max(CustomerSegment.computed_at)).scalar()
+    return {
+        "segments": {segment: counts.get(segment, 0) for segment in SEGMENTS},
+        "computed_at": computed_at
+    }
+
+
+@router.post("/segments/recompute", status_code=status.HTTP_202_ACCEPTED)
+async def recompute_customer_segments(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Kolejkuje przeliczenie segmentów RFM (wykonuje worker)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Brak uprawnień")
+
+    job = enqueue(db, "marketing.segments")
     db.commit()
+    return {"message": "Przeliczanie segmentów zlecone", "job_id": job.id}
+
+
+@router.get("/track/open/{token}")
+async def track_open(token: str):
+    """Piksel śledzący otwarcia (zdarzenia zapisywane paczkami w tle)"""
+    message_id = verify_message_token(token)
+    if message_id is not None:
+        tracking_buffer.record_open(message_id)
+    return Response(
+        content=TRACKING_PIXEL,
+        media_type="image/gif",
+        headers={"Cache-Control": "no-store, max-age=0"}
+    )
 
-    return {"message": f"Kampania wysłana do {sent_count} klientów"}
+
+@router.get("/track/click/{token}")
+async def track_click(token: str, url: str):
+    """Śledzony link: rejestruje kliknięcie i przekierowuje pod podpisany adres"""
+    message_id = verify_message_token(token, url)
+    if message_id is None:
+        raise HTTPException(status_code=404, detail="Nieprawidłowy link")
+    tracking_buffer.record_click(message_id)
+    return RedirectResponse(url, status_code=status.HTTP_302_FOUND)
 
 
 # Loyalty Program endpoints
@@ -164,6 +280,10 @@ async def enroll_in_loyalty_program(
     db: Session = Depends(get_db)
 ):
     """Zapisuje klienta do programu lojalnościowego"""
+    phone = normalize_phone(phone)
+    if phone is None:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy numer telefonu")
+
     existing = db.query(LoyaltyProgram).filter(LoyaltyProgram.customer_phone == phone).first()
     if existing:
         return {"message": "Klient już jest w programie", "loyalty": existing}
@@ -171,12 +291,14 @@ async def enroll_in_loyalty_program(
     referral_code = generate_referral_code()
     loyalty = LoyaltyProgram(
         customer_phone=phone,
+        customer_id=ensure_customer(db, phone, name),
         customer_name=name,
         referral_code=referral_code
     )
     
     db.add(loyalty)
     db.commit()
+    refresh_customer(db, phone)
     db.refresh(loyalty)
     
     return {"message": "Zapisano do programu lojalnościowego", "loyalty": loyalty}
@@ -188,7 +310,7 @@ async def get_loyalty_info(
     db: Session = Depends(get_db)
 ):
     """Pobiera informacje o programie lojalnościowym klienta"""
-    loyalty = db.query(LoyaltyProgram).filter(LoyaltyProgram.customer_phone == phone).first()
+    loyalty = db.query(LoyaltyProgram).filter(LoyaltyProgram.customer_phone == normalize_phone(phone)).first()
     return loyalty
 
 
@@ -197,35 +319,24 @@ async def add_loyalty_points(
     phone: str,
     points: int,
     order_total: float,
+    order_id: int | None = None,
+    idempotency_key: str | None = None,
     db: Session = Depends(get_db)
 ):
-    """Dodaje punkty lojalnościowe za zamówienie"""
-    loyalty = db.query(LoyaltyProgram).filter(LoyaltyProgram.customer_phone == phone).first()
-    
-    if not loyalty:
-        # Auto-enroll jeśli nie ma konta
-        loyalty = LoyaltyProgram(
-            customer_phone=phone,
-            referral_code=generate_referral_code()
-        )
-        db.add(loyalty)
-
-    loyalty.points += points
-    loyalty.total_visits += 1
-    loyalty.total_spent += order_total
-    loyalty.last_visit = datetime.utcnow()
-
-    # Aktualizuj tier na podstawie wydanych pieniędzy
-    if loyalty.total_spent >= 5000:
-        loyalty.tier = "platinum"
-    elif loyalty.total_spent >= 2000:
-        loyalty.tier = "gold"
-    elif loyalty.total_spent >= 500:
-        loyalty.tier = "silver"
-
+    """Dodaje punkty lojalnościowe za zamówienie (konto zakładane automatycznie)"""
+    if points < 0:
+        raise HTTPException(status_code=400, detail="Liczba punktów nie może być ujemna")
+    if idempotency_key is None and order_id is not None:
+        idempotency_key = f"order:{order_id}:earn"
+
+    try:
+        earn_points(db, phone, points, order_total, order_id=order_id, idempotency_key=idempotency_key)
+    except LoyaltyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     db.commit()
-    db.refresh(loyalty)
-    
+    refresh_customer(db, phone)
+
+    loyalty = db.query(LoyaltyProgram).filter(LoyaltyProgram.customer_phone == normalize_phone(phone)).first()
     return {"message": f"Dodano {points} punktów", "loyalty": loyalty}
 
 
@@ -233,29 +344,76 @@ async def add_loyalty_points(
 async def redeem_loyalty_points(
     phone: str,
     points: int,
+    order_id: int | None = None,
+    idempotency_key: str | None = None,
     db: Session = Depends(get_db)
 ):
     """Wykorzystaj punkty lojalnościowe"""
-    loyalty = db.query(LoyaltyProgram).filter(LoyaltyProgram.customer_phone == phone).first()
-    
-    if not loyalty:
-        raise HTTPException(status_code=404, detail="Konto lojalnościowe nie znalezione")
-    
-    if loyalty.points < points:
-        raise HTTPException(status_code=400, detail="Niewystarczająca ilość punktów")
-
-    loyalty.points -= points
-    discount_amount = points * 0.10  # 1 punkt = 0.10 zł zniżki
-    
+    if points <= 0:
+        raise HTTPException(status_code=400, detail="Liczba punktów musi być dodatnia")
+
+    try:
+        remaining = deduct_points(db, phone, points, order_id=order_id, idempotency_key=idempotency_key)
+    except LoyaltyAccountNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except LoyaltyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     db.commit()
-    
+    refresh_customer(db, phone)
+
     return {
         "message": f"Wykorzystano {points} punktów",
-        "discount_amount": discount_amount,
-        "remaining_points": loyalty.points
+        "discount_amount": points_discount(points),
+        "remaining_points": remaining
     }
 
 
+@router.post("/loyalty/{phone}/adjust")
+async def adjust_loyalty_points(
+    phone: str,
+    points: int,
+    description: str | None = None,
+    idempotency_key: str | None = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Ręczna korekta salda punktów (tylko admin)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Brak uprawnień")
+    if points == 0:
+        raise HTTPException(status_code=400, detail="Korekta nie może być zerowa")
+
+    try:
+        balance = adjust_points(
+            db, phone, points,
+            description=description or f"Korekta: {current_user.name}",
+            idempotency_key=idempotency_key
+        )
+    except LoyaltyAccountNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except LoyaltyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    refresh_customer(db, phone)
+
+    return {"message": f"Skorygowano saldo o {points} punktów", "points": balance}
+
+
+@router.get("/loyalty/{phone}/transactions", response_model=List[LoyaltyTransactionResponse])
+async def get_loyalty_transactions(
+    phone: str,
+    limit: int = 50,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Historia operacji na punktach klienta, od najnowszych"""
+    return db.query(LoyaltyTransaction).join(
+        LoyaltyProgram, LoyaltyProgram.id == LoyaltyTransaction.loyalty_id
+    ).filter(
+        LoyaltyProgram.customer_phone == normalize_phone(phone)
+    ).order_by(LoyaltyTransaction.id.desc()).limit(min(limit, 500)).all()
+
+
 @router.get("/analytics/inactive-customers")
 async def get_inactive_customers(
     days: int = 30,
@@ -287,33 +445,11 @@ async def get_inactive_customers(
     }
 
 
-@router.post("/auto-triggers/check")
+@router.post("/auto-triggers/check", status_code=status.HTTP_202_ACCEPTED)
 async def check_marketing_triggers(
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
-    """Sprawdza i uruchamia automatyczne triggery marketingowe"""
-    
-    # 1. Birthday campaigns
-    today = datetime.utcnow().date()
-    birthday_customers = db.query(LoyaltyProgram).filter(
-        LoyaltyProgram.birthday != None
-    ).all()
-    
-    for customer in birthday_customers:
-        if customer.birthday and customer.birthday.date() == today:
-            message = f"🎉 Wszystkiego najlepszego {customer.customer_name}! Masz 20% zniżki na dzisiejsze zamówienie. Kod: BIRTHDAY20"
-            background_tasks.add_task(send_sms, customer.customer_phone, message)
-    
-    # 2. Inactive customer re-engagement
-    threshold_date = datetime.utcnow() - timedelta(days=30)
-    inactive = db.query(CustomerPreference).filter(
-        CustomerPreference.last_order_date < threshold_date,
-        CustomerPreference.order_frequency >= 3
-    ).limit(10).all()
-    
-    for customer in inactive:
-        message = f"Tęsknimy za Tobą! Specjalna oferta: 15% zniżki. Kod: COMEBACK15"
-        background_tasks.add_task(send_sms, customer.customer_phone, message)
-    
-    return {"message": "Triggery sprawdzone i uruchomione"}
+    """Kolejkuje sprawdzenie automatycznych triggerów marketingowych (wykonuje worker)"""
+    job = enqueue(db, "marketing.triggers")
+    db.commit()
+    return {"message": "Sprawdzanie triggerów zlecone", "job_id": job.id}
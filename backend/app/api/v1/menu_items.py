@@ -10,6 +10,7 @@ from app.models.menu_item import MenuItem
 from app.models.user import User
 from app.schemas.menu_item import MenuItemCreate, MenuItemUpdate, MenuItemResponse
 from app.api.v1.auth import get_current_user
+from app.services.menu_cache import invalidate_menu_cache
 
 router = APIRouter()
 
@@ -73,6 +74,7 @@ def create_menu_item(
     db.add(new_item)
     db.commit()
     db.refresh(new_item)
+    invalidate_menu_cache()
     
     return new_item
 
@@ -136,6 +138,7 @@ def update_menu_item(
     
     db.commit()
     db.refresh(item)
+    invalidate_menu_cache()
     
     return item
 
@@ -155,5 +158,6 @@ def delete_menu_item(
     
     db.delete(item)
     db.commit()
+    invalidate_menu_cache()
     
     return None
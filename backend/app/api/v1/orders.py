@@ -6,8 +6,23 @@ from datetime import datetime, timedelta
 from app.core.database import get_db
 from app.models.order import Order, OrderStatus, PaymentStatus
 from app.models.user import User
-from app.schemas.order import OrderCreate, OrderUpdate, OrderResponse
+from app.schemas.order import OrderCreate, OrderUpdate, OrderResponse, OrderQuoteRequest, OrderQuoteResponse
 from app.api.v1.auth import get_current_user
+from app.services.coupons import CouponError, redeem_coupon
+from app.services.customer_index import refresh_customer
+from app.services.customers import ensure_customer, normalize_phone
+from app.services.discounts import requested_coupon_codes
+from app.services.loyalty import LoyaltyError, deduct_points
+from app.services.menu_cache import get_menu_snapshot
+from app.services.pricing import (
+    PricingError,
+    menu_cart_lines,
+    order_items_snapshot,
+    quote_order,
+    resolve_order_lines
+)
+from app.services.settlement import set_payment_status
+from app.services.tracking import tracking_buffer
 from app.websocket.connection_manager import manager
 
 router = APIRouter()
@@ -59,6 +74,34 @@ def get_order_stats(
         "average_order_value": total_revenue / total_orders if total_orders > 0 else 0
     }
 
+@router.post("/quote", response_model=OrderQuoteResponse)
+def create_quote(
+    request: OrderQuoteRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Price an order at current menu prices without creating it"""
+    customer_phone = normalize_phone(request.customer_phone)
+    if request.customer_phone and customer_phone is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid customer phone number")
+    
+    try:
+        quote = quote_order(
+            db,
+            menu_cart_lines(request.items, get_menu_snapshot(db)),
+            order_type=request.order_type,
+            coupon_codes=requested_coupon_codes(request.coupon_code, request.coupon_codes),
+            customer_phone=customer_phone,
+            loyalty_points=request.loyalty_points,
+            tip_amount=request.tip_amount,
+            tip_percent=request.tip_percent,
+            split_count=request.split_count
+        )
+    except PricingError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    return OrderQuoteResponse.model_validate(quote)
+
 @router.get("/{order_id}", response_model=OrderResponse)
 def get_order(order_id: int, db: Session = Depends(get_db)):
     """Get a specific order"""
@@ -75,40 +118,70 @@ async def create_order(
     current_user: User = Depends(get_current_user)
 ):
     """Create a new order"""
-    # Calculate total price
-    total_price = sum(item.price * item.quantity for item in order.items)
-    
-    # Calculate delivery fee if applicable
-    delivery_fee = 0.0
-    if order.order_type == "delivery":
-        from app.models.settings import DeliverySettings
-        delivery_settings = db.query(DeliverySettings).first()
-        if delivery_settings and delivery_settings.delivery_enabled:
-            if total_price < delivery_settings.free_delivery_threshold:
-                delivery_fee = delivery_settings.delivery_fee
-            total_price += delivery_fee
-    
-    # Convert items to dict for JSON storage
-    items_data = [item.model_dump() for item in order.items]
+    customer_phone = normalize_phone(order.customer_phone)
+    if order.customer_phone and customer_phone is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid customer phone number")
+    
+    try:
+        # Names and prices come from the menu, not from the (possibly stale) client
+        lines = resolve_order_lines(db, order.items)
+        quote = quote_order(
+            db,
+            lines,
+            order_type=order.order_type,
+            coupon_codes=requested_coupon_codes(order.coupon_code, order.coupon_codes),
+            customer_phone=customer_phone,
+            loyalty_points=order.loyalty_points,
+            tip_amount=order.tip_amount,
+            tip_percent=order.tip_percent,
+            split_count=order.split_count
+        )
+    except PricingError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
     new_order = Order(
         order_type=order.order_type,
         table_id=order.table_id,
         created_by=current_user.id,
-        items=items_data,
-        total_price=total_price,
+        items=order_items_snapshot(lines),
+        total_price=quote.total,
         notes=order.notes,
         customer_name=order.customer_name,
-        customer_phone=order.customer_phone,
+        customer_phone=customer_phone,
+        customer_id=ensure_customer(db, customer_phone, order.customer_name) if customer_phone else None,
         delivery_address=order.delivery_address,
-        delivery_fee=delivery_fee,
+        delivery_fee=quote.delivery_fee,
+        coupon_code=",".join(coupon.code for coupon in quote.coupons) or None,
+        discount_amount=quote.discount_amount,
+        tip_amount=quote.tip_amount or None,
+        split_count=order.split_count,
         status=OrderStatus.PENDING,
         payment_status=PaymentStatus.UNPAID
     )
     
     db.add(new_order)
+    db.flush()
+    
+    # Redeem coupons and loyalty points in the same transaction as the order
+    try:
+        for coupon in quote.coupons:
+            redeem_coupon(db, coupon.id, quote.coupon_discounts[coupon.code], order_id=new_order.id)
+        if quote.loyalty_points:
+            deduct_points(
+                db, customer_phone, quote.loyalty_points,
+                order_id=new_order.id, idempotency_key=f"order:{new_order.id}:redeem"
+            )
+    except (CouponError, LoyaltyError) as e:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    
     db.commit()
     db.refresh(new_order)
+    refresh_customer(db, new_order.customer_phone)
+    
+    # Orders carrying a campaign coupon count as campaign conversions
+    if quote.coupons:
+        tracking_buffer.record_conversion((coupon.code for coupon in quote.coupons), new_order.customer_phone)
     
     # Broadcast order creation via WebSocket
     await manager.broadcast(f"New order created: #{new_order.id}")
@@ -132,15 +205,20 @@ async def update_order(
         order.table_id = order_update.table_id
     
     if order_update.items is not None:
-        items_data = [item.model_dump() for item in order_update.items]
-        order.items = items_data
-        order.total_price = sum(item.price * item.quantity for item in order_update.items)
+        try:
+            lines = resolve_order_lines(db, order_update.items)
+        except PricingError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        order.items = order_items_snapshot(lines)
+        # Coupons and loyalty points were redeemed when the order was placed; keep that discount and the delivery fee
+        subtotal = sum(line.unit_price * line.quantity for line in lines)
+        order.total_price = round(max(0.0, subtotal - (order.discount_amount or 0)) + (order.delivery_fee or 0), 2)
     
     if order_update.status is not None:
         order.status = order_update.status
     
     if order_update.payment_status is not None:
-        order.payment_status = order_update.payment_status
+        set_payment_status(order, order_update.payment_status)
     
     if order_update.payment_method is not None:
         order.payment_method = order_update.payment_method
@@ -1,30 +1,60 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, File, Form, HTTPException, status, Request, UploadFile
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import List, Optional
+from datetime import date, datetime
+from pathlib import Path
+import json
+import math
+import os
+import shutil
 import stripe
-import paypalrestsdk
+import uuid
 
 from app.core.database import get_db
 from app.core.config import settings
 from app.models.payment import Payment
 from app.models.order import Order, PaymentStatus
+from app.models.reconciliation import DiscrepancyType, ReconciliationItem, ReconciliationRun
 from app.models.user import User
-from app.schemas.payment import PaymentCreate, PaymentResponse, StripePaymentIntent, PayPalPaymentCreate
+from app.schemas.payment import (
+    PaymentCreate,
+    PaymentResponse,
+    StripePaymentIntent,
+    PayPalPaymentCreate,
+    ReconciliationItemResponse,
+    ReconciliationRunResponse
+)
 from app.api.v1.auth import get_current_user
+from app.services.payment_providers import (
+    PaymentProviderError,
+    ProviderUnavailableError,
+    paypal_provider,
+    stripe_provider
+)
+from app.services.jobs import enqueue
+from app.services.settlement import set_payment_status
+from app.services.webhooks import notify_webhook_processor, record_event
 
 router = APIRouter()
 
-# Configure Stripe
-if settings.STRIPE_API_KEY:
-    stripe.api_key = settings.STRIPE_API_KEY
+def provider_error(error: PaymentProviderError) -> HTTPException:
+    """Map a provider failure: rejected call 400, unreachable 502, circuit open 503"""
+    if isinstance(error, ProviderUnavailableError):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(error),
+            headers={"Retry-After": str(math.ceil(error.retry_after))}
+        )
+    if error.retryable:
+        return HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(error))
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
 
-# Configure PayPal
-if settings.PAYPAL_CLIENT_ID and settings.PAYPAL_CLIENT_SECRET:
-    paypalrestsdk.configure({
-        "mode": settings.PAYPAL_MODE,
-        "client_id": settings.PAYPAL_CLIENT_ID,
-        "client_secret": settings.PAYPAL_CLIENT_SECRET
-    })
+def require_order(db: Session, order_id: int) -> None:
+    """404 unless the order exists; releases the DB connection before the provider call"""
+    order_exists = db.query(Order.id).filter(Order.id == order_id).first() is not None
+    db.rollback()
+    if not order_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
 
 @router.post("/", response_model=PaymentResponse, status_code=status.HTTP_201_CREATED)
 def create_payment(
@@ -52,13 +82,14 @@ def create_payment(
         amount=payment.amount,
         payment_method=payment.payment_method,
         transaction_id=payment.transaction_id,
-        status="completed"
+        status="completed",
+        timestamp=datetime.utcnow()
     )
     
     db.add(new_payment)
     
     # Update order payment status
-    order.payment_status = PaymentStatus.PAID
+    set_payment_status(order, PaymentStatus.PAID, new_payment.timestamp)
     order.payment_method = payment.payment_method
     
     db.commit()
@@ -67,44 +98,40 @@ def create_payment(
     return new_payment
 
 @router.post("/stripe/create-payment-intent")
-def create_stripe_payment_intent(
+async def create_stripe_payment_intent(
     payment_data: StripePaymentIntent,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Create a Stripe payment intent"""
-    if not settings.STRIPE_API_KEY:
+    provider = stripe_provider()
+    if provider is None:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Stripe is not configured"
         )
     
-    # Verify order exists
-    order = db.query(Order).filter(Order.id == payment_data.order_id).first()
-    if not order:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
+    require_order(db, payment_data.order_id)
     
+    # A repeated request (double tap, client retry) gets the same intent back
+    idempotency_key = payment_data.idempotency_key or (
+        f"order-{payment_data.order_id}-intent-{payment_data.amount}-{payment_data.currency}"
+    )
     try:
-        # Create Stripe payment intent
-        intent = stripe.PaymentIntent.create(
-            amount=payment_data.amount,
-            currency=payment_data.currency,
-            metadata={"order_id": payment_data.order_id}
-        )
-        
-        return {
-            "client_secret": intent.client_secret,
-            "payment_intent_id": intent.id
-        }
-    except stripe.error.StripeError as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=str(e)
+        intent = await provider.create_payment_intent(
+            payment_data.amount, payment_data.currency, payment_data.order_id, idempotency_key
         )
+    except PaymentProviderError as e:
+        raise provider_error(e)
+    
+    return {
+        "client_secret": intent.client_secret,
+        "payment_intent_id": intent.payment_intent_id
+    }
 
 @router.post("/stripe/webhook")
 async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
-    """Handle Stripe webhook events"""
+    """Handle Stripe webhook events (stored here, processed by app.services.webhooks)"""
     if not settings.STRIPE_WEBHOOK_SECRET:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     
@@ -112,7 +139,7 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
     sig_header = request.headers.get("stripe-signature")
     
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
     except ValueError:
@@ -120,85 +147,136 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
     
-    # Handle successful payment
-    if event["type"] == "payment_intent.succeeded":
-        payment_intent = event["data"]["object"]
-        order_id = int(payment_intent["metadata"]["order_id"])
-        
-        # Create payment record
-        order = db.query(Order).filter(Order.id == order_id).first()
-        if order:
-            payment = Payment(
-                order_id=order_id,
-                amount=payment_intent["amount"] / 100,  # Convert from cents
-                payment_method="stripe",
-                transaction_id=payment_intent["id"],
-                status="completed"
-            )
-            db.add(payment)
-            
-            order.payment_status = PaymentStatus.PAID
-            order.payment_method = "stripe"
-            
-            db.commit()
+    # Acknowledge right away; a replayed event id is ignored
+    if record_event(db, "stripe", json.loads(payload)):
+        db.commit()
+        notify_webhook_processor()
     
     return {"status": "success"}
 
 @router.post("/paypal/create-payment")
-def create_paypal_payment(
+async def create_paypal_payment(
     payment_data: PayPalPaymentCreate,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Create a PayPal payment"""
-    if not (settings.PAYPAL_CLIENT_ID and settings.PAYPAL_CLIENT_SECRET):
+    provider = paypal_provider()
+    if provider is None:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="PayPal is not configured"
         )
     
-    # Verify order exists
-    order = db.query(Order).filter(Order.id == payment_data.order_id).first()
-    if not order:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
+    require_order(db, payment_data.order_id)
     
+    idempotency_key = payment_data.idempotency_key or (
+        f"order-{payment_data.order_id}-paypal-{payment_data.amount}-{payment_data.currency}"
+    )
     try:
-        payment = paypalrestsdk.Payment({
-            "intent": "sale",
-            "payer": {
-                "payment_method": "paypal"
-            },
-            "transactions": [{
-                "amount": {
-                    "total": str(payment_data.amount),
-                    "currency": payment_data.currency
-                },
-                "description": f"Order #{payment_data.order_id}"
-            }],
-            "redirect_urls": {
-                "return_url": "http://localhost:3000/payment/success",
-                "cancel_url": "http://localhost:3000/payment/cancel"
-            }
-        })
-        
-        if payment.create():
-            # Get approval URL
-            for link in payment.links:
-                if link.rel == "approval_url":
-                    return {
-                        "payment_id": payment.id,
-                        "approval_url": link.href
-                    }
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=payment.error
-            )
-    except Exception as e:
+        payment = await provider.create_payment(
+            payment_data.amount, payment_data.currency, payment_data.order_id, idempotency_key
+        )
+    except PaymentProviderError as e:
+        raise provider_error(e)
+    
+    if not payment.approval_url:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=str(e)
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="PayPal did not return an approval URL"
         )
+    return {
+        "payment_id": payment.payment_id,
+        "approval_url": payment.approval_url
+    }
+
+@router.post("/reconciliations", response_model=ReconciliationRunResponse, status_code=status.HTTP_202_ACCEPTED)
+def create_reconciliation(
+    file: UploadFile = File(...),
+    provider: str = Form("stripe"),
+    date_from: Optional[date] = Form(None),
+    date_to: Optional[date] = Form(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Upload a provider settlement export (CSV, JSON or JSON Lines) and reconcile it in the background (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    if extension not in (".csv", ".json", ".jsonl"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Export must be a .csv, .json or .jsonl file")
+    
+    # Stored outside the public uploads directory, on a volume the worker mounts at the same path;
+    # the worker deletes the file when the run has finished
+    directory = Path(settings.RECONCILIATION_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    file_path = directory / f"{uuid.uuid4()}{extension}"
+    with open(file_path, "wb") as out:
+        shutil.copyfileobj(file.file, out)
+    
+    run = ReconciliationRun(
+        provider=provider,
+        source_name=file.filename,
+        file_path=str(file_path),
+        file_format="csv" if extension == ".csv" else "json",
+        date_from=date_from,
+        date_to=date_to,
+        created_by=current_user.id
+    )
+    db.add(run)
+    db.flush()
+    enqueue(db, "payments.reconcile", {"run_id": run.id}, max_attempts=3)
+    db.commit()
+    db.refresh(run)
+    
+    return run
+
+@router.get("/reconciliations", response_model=List[ReconciliationRunResponse])
+def get_reconciliations(
+    skip: int = 0,
+    limit: int = 50,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Reconciliation runs, newest first (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    
+    return db.query(ReconciliationRun).order_by(ReconciliationRun.id.desc()).offset(skip).limit(limit).all()
+
+@router.get("/reconciliations/{run_id}", response_model=ReconciliationRunResponse)
+def get_reconciliation(
+    run_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Status and totals of a reconciliation run (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    
+    run = db.query(ReconciliationRun).filter(ReconciliationRun.id == run_id).first()
+    if not run:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reconciliation not found")
+    return run
+
+@router.get("/reconciliations/{run_id}/items", response_model=List[ReconciliationItemResponse])
+def get_reconciliation_items(
+    run_id: int,
+    kind: Optional[DiscrepancyType] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Discrepancies found by a run (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    
+    query = db.query(ReconciliationItem).filter(ReconciliationItem.run_id == run_id)
+    if kind:
+        query = query.filter(ReconciliationItem.kind == kind)
+    return query.order_by(ReconciliationItem.id).offset(skip).limit(limit).all()
 
 @router.get("/{payment_id}", response_model=PaymentResponse)
 def get_payment(
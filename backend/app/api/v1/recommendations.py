@@ -6,6 +6,8 @@ from app.api.v1.auth import get_current_user
 from app.models.recommendation import ProductRecommendation, CustomerPreference
 from app.models.menu_item import MenuItem
 from app.models.user import User
+from app.services.customer_index import refresh_customer
+from app.services.customers import ensure_customer, normalize_phone
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -182,7 +184,7 @@ async def get_customer_preferences(
 ):
     """Pobiera preferencje klienta po numerze telefonu"""
     pref = db.query(CustomerPreference).filter(
-        CustomerPreference.customer_phone == phone
+        CustomerPreference.customer_phone == normalize_phone(phone)
     ).first()
     return pref
 
@@ -196,6 +198,10 @@ async def update_customer_preferences(
     db: Session = Depends(get_db)
 ):
     """Aktualizuje preferencje klienta po złożeniu zamówienia"""
+    phone = normalize_phone(phone)
+    if phone is None:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy numer telefonu")
+
     pref = db.query(CustomerPreference).filter(
         CustomerPreference.customer_phone == phone
     ).first()
@@ -203,6 +209,7 @@ async def update_customer_preferences(
     if not pref:
         pref = CustomerPreference(
             customer_phone=phone,
+            customer_id=ensure_customer(db, phone, name),
             customer_name=name,
             order_frequency=1,
             total_spent=order_total,
@@ -223,5 +230,6 @@ async def update_customer_preferences(
     pref.last_order_date = datetime.utcnow()
     
     db.commit()
+    refresh_customer(db, phone)
     db.refresh(pref)
     return {"message": "Preferencje zaktualizowane", "customer": pref}
@@ -0,0 +1,107 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import date, datetime
+
+from app.core.database import get_db
+from app.models.day_closure import DayClosure
+from app.models.user import User
+from app.schemas.report import DayClosureResponse, LaborSalesReport
+from app.api.v1.auth import get_current_user
+from app.services.labor_analytics import labor_vs_sales
+from app.services.settlement import SettlementError, close_day
+
+router = APIRouter()
+
+MAX_ANALYTICS_DAYS = 93
+
+def labor_figures(labor_hours: float, sales: float, hourly_wage: Optional[float]) -> dict:
+    labor_cost = round(labor_hours * hourly_wage, 2) if hourly_wage is not None else None
+    return {
+        "labor_hours": round(labor_hours, 2),
+        "sales": round(sales, 2),
+        "sales_per_labor_hour": round(sales / labor_hours, 2) if labor_hours > 0 else None,
+        "labor_cost": labor_cost,
+        "labor_cost_percent": round(labor_cost / sales * 100, 1) if labor_cost is not None and sales > 0 else None,
+    }
+
+@router.post("/close-day", response_model=DayClosureResponse, status_code=status.HTTP_201_CREATED)
+def close_business_day(
+    business_date: Optional[date] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Close the day and store its Z-report (admin only); defaults to today (UTC)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    
+    try:
+        return close_day(db, business_date or datetime.utcnow().date(), closed_by=current_user.id)
+    except SettlementError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+@router.get("/day-closures", response_model=List[DayClosureResponse])
+def get_day_closures(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    skip: int = 0,
+    limit: int = 31,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Stored Z-reports, newest first (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    
+    query = db.query(DayClosure)
+    if date_from:
+        query = query.filter(DayClosure.business_date >= date_from)
+    if date_to:
+        query = query.filter(DayClosure.business_date <= date_to)
+    return query.order_by(DayClosure.business_date.desc()).offset(skip).limit(limit).all()
+
+@router.get("/day-closures/{business_date}", response_model=DayClosureResponse)
+def get_day_closure(
+    business_date: date,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Z-report of one closed day (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    
+    closure = db.query(DayClosure).filter(DayClosure.business_date == business_date).first()
+    if not closure:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Day is not closed")
+    return closure
+
+@router.get("/labor-vs-sales", response_model=LaborSalesReport)
+def get_labor_vs_sales(
+    date_from: date,
+    date_to: date,
+    hourly_wage: Optional[float] = Query(None, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Labor hours against paid sales per UTC hour, both days inclusive (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    if date_to < date_from:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="date_to is before date_from")
+    if (date_to - date_from).days >= MAX_ANALYTICS_DAYS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Range is limited to {MAX_ANALYTICS_DAYS} days")
+    
+    slots = labor_vs_sales(db, date_from, date_to)
+    total_hours = sum(slot.labor_hours for slot in slots)
+    total_sales = sum(slot.sales for slot in slots)
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "hourly_wage": hourly_wage,
+        "orders": sum(slot.orders for slot in slots),
+        **labor_figures(total_hours, total_sales, hourly_wage),
+        "slots": [
+            {"slot_start": slot.slot_start, "orders": slot.orders, **labor_figures(slot.labor_hours, slot.sales, hourly_wage)}
+            for slot in slots
+        ]
+    }
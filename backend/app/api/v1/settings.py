@@ -7,6 +7,7 @@ from app.models.settings import DeliverySettings, RestaurantSettings
 from app.models.user import User, UserRole
 from app.schemas.settings import DeliverySettingsResponse, DeliverySettingsUpdate, RestaurantSettingResponse
 from app.api.v1.auth import get_current_user
+from app.services.pricing import invalidate_delivery_pricing
 
 router = APIRouter()
 
@@ -48,6 +49,7 @@ def update_delivery_settings(
     
     db.commit()
     db.refresh(settings)
+    invalidate_delivery_pricing()
     return settings
 
 @router.get("/restaurant", response_model=List[RestaurantSettingResponse])
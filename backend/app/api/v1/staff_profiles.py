@@ -1,21 +1,28 @@
 """Staff profiles API endpoints"""
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Request, status, File, UploadFile
 from sqlalchemy.orm import Session
 from typing import List
+import math
 import os
+import time
 import uuid
 from pathlib import Path
 
 from app.core.database import get_db
-from app.api.v1.auth import get_current_user, create_access_token
+from app.api.v1.auth import get_current_user, create_access_token, hash_user_password
 from app.models.user import User, UserRole
 from app.schemas.user import (
     StaffProfileResponse, 
+    UserResponse,
     UserUpdate, 
     PINLoginRequest,
     Token
 )
-from app.core.security import get_password_hash, verify_password
+from app.core.auth_cache import Principal, principal_cache
+from app.core.config import settings
+from app.services.pins import hash_pin, pin_attempts, terminal_key, user_key, verify_pin
+from app.services.sessions import revoke_user_sessions
+from app.services.staff_cache import get_staff_profiles, invalidate_staff_profiles
 
 router = APIRouter(prefix="/staff-profiles", tags=["staff-profiles"])
 
@@ -29,8 +36,7 @@ async def get_all_staff_profiles(
     current_user: User = Depends(get_current_user)
 ):
     """Get all staff profiles (for profile selection screen)"""
-    users = db.query(User).filter(User.is_active == 1).all()
-    return users
+    return get_staff_profiles(db)
 
 
 @router.get("/{user_id}", response_model=StaffProfileResponse)
@@ -46,7 +52,7 @@ async def get_staff_profile(
     return user
 
 
-@router.put("/{user_id}")
+@router.put("/{user_id}", response_model=UserResponse)
 async def update_staff_profile(
     user_id: int,
     user_update: UserUpdate,
@@ -57,21 +63,30 @@ async def update_staff_profile(
     if current_user.role != UserRole.ADMIN and current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
+    update_data = user_update.model_dump(exclude_unset=True)
+    
+    # Hash password if provided (before touching the database)
+    if "password" in update_data:
+        update_data["password_hash"] = await hash_user_password(update_data.pop("password"))
+    if "pin_code" in update_data:
+        pin_code = update_data.pop("pin_code")
+        update_data["pin_hash"] = hash_pin(user_id, pin_code) if pin_code else None
+    
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    update_data = user_update.model_dump(exclude_unset=True)
-    
-    # Hash password if provided
-    if "password" in update_data:
-        update_data["password_hash"] = get_password_hash(update_data.pop("password"))
+    # A new password or deactivation ends the user's refresh-token sessions
+    if "password_hash" in update_data or update_data.get("is_active") is False:
+        revoke_user_sessions(db, user_id)
     
     for field, value in update_data.items():
         setattr(user, field, value)
     
     db.commit()
     db.refresh(user)
+    principal_cache.invalidate_user(user_id)
+    invalidate_staff_profiles()
     return user
 
 
@@ -107,6 +122,7 @@ async def upload_avatar(
     # Update user avatar URL
     user.avatar_url = f"http://localhost:8000/uploads/avatars/{filename}"
     db.commit()
+    invalidate_staff_profiles()
     
     return {"avatar_url": user.avatar_url}
 
@@ -114,27 +130,42 @@ async def upload_avatar(
 @router.post("/pin-login", response_model=Token)
 async def pin_login(
     login_request: PINLoginRequest,
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """Login with user ID and PIN code"""
-    user = db.query(User).filter(
+    terminal = login_request.device_id or (request.client.host if request.client else "unknown")
+    keys = (user_key(login_request.user_id), terminal_key(terminal))
+    
+    retry_after = pin_attempts.retry_after(keys)
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed PIN attempts, try again later",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    
+    user = db.query(User.id, User.role, User.name, User.pin_hash).filter(
         User.id == login_request.user_id,
         User.is_active == 1
     ).first()
+    db.rollback()
     
-    if not user or not user.pin_code:
+    if not user or not verify_pin(user.id, login_request.pin_code, user.pin_hash):
+        pin_attempts.record_failure(keys)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
-    
-    if user.pin_code != login_request.pin_code:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid PIN code"
-        )
+    pin_attempts.reset(keys[0])
     
     access_token = create_access_token(data={"sub": str(user.id)})
+    # The terminal's next request usually comes right away; skip its users query
+    principal_cache.put(
+        access_token,
+        Principal(id=user.id, role=user.role, name=user.name),
+        time.time() + settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    )
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -156,7 +187,7 @@ async def set_pin_code(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user.pin_code = pin_code
+    user.pin_hash = hash_pin(user.id, pin_code)
     db.commit()
     
     return {"message": "PIN code set successfully"}
@@ -5,8 +5,10 @@ from typing import List
 from app.core.database import get_db
 from app.models.user import User
 from app.schemas.user import UserResponse, UserUpdate
-from app.api.v1.auth import get_current_user
-from app.core.security import get_password_hash
+from app.api.v1.auth import get_current_user, hash_user_password
+from app.core.auth_cache import principal_cache
+from app.services.sessions import revoke_user_sessions
+from app.services.staff_cache import invalidate_staff_profiles
 
 router = APIRouter()
 
@@ -41,7 +43,7 @@ def get_user(
     return user
 
 @router.put("/{user_id}", response_model=UserResponse)
-def update_user(
+async def update_user(
     user_id: int,
     user_update: UserUpdate,
     db: Session = Depends(get_db),
@@ -51,6 +53,11 @@ def update_user(
     if current_user.role != "admin" and current_user.id != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
     
+    # Hash before touching the database so no connection is held while bcrypt runs
+    password_hash = None
+    if user_update.password is not None:
+        password_hash = await hash_user_password(user_update.password)
+    
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -60,13 +67,16 @@ def update_user(
         user.name = user_update.name
     if user_update.email is not None:
         user.email = user_update.email
-    if user_update.password is not None:
-        user.password_hash = get_password_hash(user_update.password)
+    if password_hash is not None:
+        user.password_hash = password_hash
+        revoke_user_sessions(db, user_id)
     if user_update.role is not None and current_user.role == "admin":
         user.role = user_update.role
     
     db.commit()
     db.refresh(user)
+    principal_cache.invalidate_user(user_id)
+    invalidate_staff_profiles()
     
     return user
 
@@ -86,5 +96,7 @@ def delete_user(
     
     db.delete(user)
     db.commit()
+    principal_cache.invalidate_user(user_id)
+    invalidate_staff_profiles()
     
     return None
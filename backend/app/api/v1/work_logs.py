@@ -1,13 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from app.core.database import get_db
 from app.models.work_log import WorkLog
 from app.models.user import User, UserRole
-from app.schemas.work_log import WorkLogClockIn, WorkLogClockOut, WorkLogResponse
+from app.schemas.work_log import PayrollEntry, WorkLogClockIn, WorkLogClockOut, WorkLogResponse
 from app.api.v1.auth import get_current_user
+from app.services.work_time import payroll, work_stats
 
 router = APIRouter()
 
@@ -27,25 +29,21 @@ def clock_in(
     current_user: User = Depends(get_current_user)
 ):
     """Clock in for work"""
-    # Check if user is already clocked in
-    active_log = db.query(WorkLog).filter(
-        WorkLog.user_id == current_user.id,
-        WorkLog.clock_out == None
-    ).first()
-    
-    if active_log:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Already clocked in. Please clock out first."
-        )
-    
     new_log = WorkLog(
         user_id=current_user.id,
         notes=log_data.notes
     )
     
+    # The open-shift unique index rejects a second clock-in, even a concurrent one
     db.add(new_log)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Already clocked in. Please clock out first."
+        )
     db.refresh(new_log)
     
     return new_log
@@ -103,7 +101,7 @@ def get_work_logs(
     """Get work logs (admin can see all, staff only their own)"""
     start_date = datetime.utcnow() - timedelta(days=days)
     
-    query = db.query(WorkLog).filter(WorkLog.clock_in >= start_date)
+    query = db.query(WorkLog).options(joinedload(WorkLog.user)).filter(WorkLog.clock_in >= start_date)
     
     if current_user.role == UserRole.ADMIN:
         if user_id:
@@ -143,26 +141,23 @@ def get_work_stats(
 ):
     """Get work statistics (admin only)"""
     start_date = datetime.utcnow() - timedelta(days=days)
-    
-    query = db.query(WorkLog).filter(
-        WorkLog.clock_in >= start_date,
-        WorkLog.clock_out != None
-    )
-    
-    if user_id:
-        query = query.filter(WorkLog.user_id == user_id)
-    
-    logs = query.all()
-    
-    total_hours = 0
-    for log in logs:
-        if log.clock_out:
-            delta = log.clock_out - log.clock_in
-            total_hours += delta.total_seconds() / 3600
+    stats = work_stats(db, start_date, user_id)
     
     return {
-        "total_logs": len(logs),
-        "total_hours": round(total_hours, 2),
-        "average_hours_per_day": round(total_hours / days, 2) if days > 0 else 0,
+        **stats,
+        "average_hours_per_day": round(stats["total_hours"] / days, 2) if days > 0 else 0,
         "period_days": days
     }
+
+@router.get("/payroll", response_model=List[PayrollEntry])
+def get_payroll(
+    period_start: date,
+    period_end: date,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_admin)
+):
+    """Hours worked per employee in a payroll period, both days inclusive (admin only)"""
+    if period_end < period_start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="period_end is before period_start")
+    
+    return payroll(db, period_start, period_end)
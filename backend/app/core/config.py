@@ -9,6 +9,18 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "your-secret-key-change-in-production"
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 14  # sliding; renewed on every /auth/refresh
+    TERMINAL_SESSION_EXPIRE_DAYS: int = 90  # device-bound sessions of POS terminals
+    REFRESH_REUSE_GRACE_SECONDS: int = 30  # a just-rotated token still returns the current one
+    BCRYPT_ROUNDS: int = 12  # changing it rehashes passwords on the next login
+    PASSWORD_HASH_WORKERS: int = 2  # dedicated threads for bcrypt
+    PASSWORD_HASH_QUEUE_LIMIT: int = 32  # waiting hashes beyond this get 503
+    AUTH_CACHE_SIZE: int = 10000  # verified tokens kept per API process
+    AUTH_CACHE_TTL_SECONDS: float = 60.0  # bound on how long other processes see stale roles
+    PIN_PEPPER: str = "change-this-pin-pepper-in-production"  # HMAC key for staff PINs
+    PIN_MAX_ATTEMPTS: int = 5  # failed PINs before a user or terminal is locked out
+    PIN_LOCKOUT_SECONDS: float = 30.0  # first lockout; doubles with every further failure
+    PIN_LOCKOUT_MAX_SECONDS: float = 900.0  # also how long failures are remembered
     
     # Payment Integration
     STRIPE_API_KEY: Optional[str] = None
@@ -16,6 +28,56 @@ class Settings(BaseSettings):
     PAYPAL_CLIENT_ID: Optional[str] = None
     PAYPAL_CLIENT_SECRET: Optional[str] = None
     PAYPAL_MODE: str = "sandbox"
+    STRIPE_API_BASE: str = "https://api.stripe.com"
+    PAYPAL_API_BASE: Optional[str] = None  # derived from PAYPAL_MODE when unset
+    PAYMENT_TIMEOUT_SECONDS: float = 10.0  # read/write timeout of one provider call
+    PAYMENT_CONNECT_TIMEOUT_SECONDS: float = 3.0
+    PAYMENT_MAX_CONNECTIONS: int = 20  # pooled keep-alive connections per provider
+    PAYMENT_MAX_RETRIES: int = 2  # retries reuse the idempotency key
+    PAYMENT_CIRCUIT_FAILURES: int = 5  # consecutive failed calls before failing fast
+    PAYMENT_CIRCUIT_RESET_SECONDS: float = 30.0
+    WEBHOOK_BATCH_SIZE: int = 100  # inbox events processed per transaction
+    WEBHOOK_POLL_SECONDS: float = 5.0  # picks up events stored by other API processes
+    WEBHOOK_MAX_ATTEMPTS: int = 5  # a failing event is then left for inspection
+    WEBHOOK_WAIT_SECONDS: int = 86400  # an event waiting for an earlier one is retried this long for free
+    RECONCILIATION_DIR: str = "data/reconciliation"  # uploaded settlement exports until reconciled; shared with the worker
+    
+    # Outbound messaging (providers: console, smtp, sink)
+    SMS_PROVIDER: str = "console"
+    EMAIL_PROVIDER: str = "console"
+    SMS_RATE_PER_SECOND: float = 10.0
+    EMAIL_RATE_PER_SECOND: float = 20.0
+    DISPATCH_CONCURRENCY: int = 20
+    DISPATCH_MAX_RETRIES: int = 3
+    MESSAGE_CLAIM_SECONDS: int = 900  # lease on a batch of messages being sent
+    SMTP_HOST: str = "localhost"
+    SMTP_PORT: int = 1025
+    SMTP_FROM: str = "noreply@restaurant.local"
+    SMS_MAX_SEGMENTS: int = 3  # longer campaign SMS are trimmed
+    SMS_TRANSLITERATE: bool = False  # strip Polish diacritics to stay in GSM-7
+    
+    # Campaign tracking (open pixel / click links)
+    PUBLIC_API_URL: str = "http://localhost:8000"
+    TRACKING_FLUSH_SECONDS: float = 5.0
+    
+    # Background worker (python -m app.worker)
+    WORKER_CONCURRENCY: int = 4
+    WORKER_POLL_INTERVAL_SECONDS: float = 1.0
+    JOB_VISIBILITY_TIMEOUT_SECONDS: int = 900
+    MARKETING_TRIGGERS_HOUR: int = 9  # UTC hour of the daily trigger run
+    SEGMENTS_RECOMPUTE_HOUR: int = 3  # UTC hour of the nightly RFM segmentation
+    LOYALTY_MAINTENANCE_HOUR: int = 2  # UTC hour of points expiry and tier recompute
+    LABOR_ANALYTICS_HOUR: int = 4  # UTC hour of the nightly labor-vs-sales precompute
+    LABOR_ANALYTICS_RECOMPUTE_DAYS: int = 7  # past days refreshed nightly (late clock-out corrections)
+    JOB_PURGE_HOUR: int = 1  # UTC hour of the daily purge of finished jobs
+    JOB_RETENTION_DAYS: int = 14  # completed and failed jobs are kept this long
+    
+    # Customer phone numbers are stored in E.164; national numbers get this prefix
+    PHONE_COUNTRY_CODE: str = "48"
+    PHONE_NATIONAL_DIGITS: int = 9
+    
+    # Loyalty program
+    LOYALTY_POINTS_EXPIRE_DAYS: int = 365  # balance expires after this long without a visit
     
     class Config:
         env_file = ".env"
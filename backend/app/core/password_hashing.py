@@ -0,0 +1,114 @@
+"""Password hashing on a dedicated, bounded executor.
+
+bcrypt costs 100-300 ms of CPU per call. Running it in the general request
+threadpool lets a burst of logins starve every other endpoint, so hashes run
+on their own small pool. Requests await the result without holding a
+threadpool slot. When more than PASSWORD_HASH_QUEUE_LIMIT hashes are
+already waiting, new ones are refused immediately (the API answers 503).
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from app.core.config import settings
+from app.core.security import pwd_context
+
+T = TypeVar("T")
+
+LATENCY_SAMPLES = 1000  # per operation, for percentiles
+
+
+class HashingBusyError(Exception):
+    """Too many password hashes are already queued"""
+
+
+class HashMetrics:
+    """Latency of hashing operations: time in queue and time hashing"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._samples: Dict[str, Deque[Tuple[float, float]]] = {}
+        self.rejected = 0
+
+    def record(self, operation: str, queued: float, hashing: float) -> None:
+        with self._lock:
+            self._counts[operation] = self._counts.get(operation, 0) + 1
+            self._samples.setdefault(operation, deque(maxlen=LATENCY_SAMPLES)).append((queued, hashing))
+
+    def record_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = {operation: list(values) for operation, values in self._samples.items()}
+            counts = dict(self._counts)
+            rejected = self.rejected
+
+        def percentile(values, fraction):
+            ordered = sorted(values)
+            return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 1)
+
+        operations = {}
+        for operation, values in samples.items():
+            queued = [value[0] for value in values]
+            hashing = [value[1] for value in values]
+            operations[operation] = {
+                "count": counts[operation],
+                "hash_ms_p50": percentile(hashing, 0.5),
+                "hash_ms_p95": percentile(hashing, 0.95),
+                "hash_ms_max": round(max(hashing) * 1000, 1),
+                "queue_ms_p50": percentile(queued, 0.5),
+                "queue_ms_p95": percentile(queued, 0.95),
+            }
+        return {"operations": operations, "rejected": rejected}
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        # Slots for hashes running or waiting; no slot means the caller gets HashingBusyError
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._in_flight = 0
+        self.metrics = HashMetrics()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def run(self, operation: str, function: Callable[..., T], *args) -> T:
+        if not self._slots.acquire(blocking=False):
+            self.metrics.record_rejected()
+            raise HashingBusyError("Too many password operations in progress, retry shortly")
+        self._in_flight += 1
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.metrics.record(operation, started - submitted, time.perf_counter() - started)
+
+        try:
+            return await asyncio.wrap_future(self._executor.submit(timed))
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_LIMIT)
+
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.run("hash", pwd_context.hash, password)
+
+
+async def verify_and_update_password(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """(valid, new_hash); new_hash is set when the stored hash uses outdated bcrypt rounds"""
+    return await password_hasher.run("verify", pwd_context.verify_and_update, password, password_hash)
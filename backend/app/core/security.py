@@ -4,11 +4,11 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from app.core.config import settings
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing context; hashes with other rounds are upgraded on the next login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against a hash"""
+    """Verify a password against a hash (blocking; request handlers use app.core.password_hashing)"""
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
@@ -29,16 +29,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 
 def decode_access_token(token: str) -> Optional[dict]:
     """Decode and verify a JWT token"""
-    import logging
-    logger = logging.getLogger(__name__)
-    
     try:
-        logger.info(f"Decoding token with SECRET_KEY: {settings.SECRET_KEY[:10]}...")
-        logger.info(f"Algorithm: {settings.JWT_ALGORITHM}")
-        logger.info(f"Token: {token[:30]}...")
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
-        logger.info(f"Successfully decoded payload: {payload}")
-        return payload
-    except JWTError as e:
-        logger.error(f"JWT Error: {e}")
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
+    except JWTError:
         return None
@@ -2,11 +2,17 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import asyncio
 import os
 
 from app.core.config import settings
-from app.core.database import engine, Base
-from app.api.v1 import auth, users, menu_items, orders, tables, payments, settings as settings_router, work_logs, staff_profiles, coupons, recommendations, marketing
+from app.core.database import SessionLocal, engine, Base
+from app.api.v1 import auth, users, menu_items, orders, tables, payments, settings as settings_router, work_logs, staff_profiles, coupons, recommendations, marketing, customers, reports
+from app.services.customer_index import warm_customer_index
+from app.services.payment_providers import close_payment_providers
+from app.services.pins import upgrade_legacy_pins
+from app.services.tracking import flush_tracking_events, run_tracking_flusher
+from app.services.webhooks import run_webhook_processor
 from app.websocket.connection_manager import ConnectionManager
 
 # WebSocket connection manager
@@ -16,8 +22,17 @@ manager = ConnectionManager()
 async def lifespan(app: FastAPI):
     # Startup: Create database tables
     Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        upgrade_legacy_pins(db)
+    tracking_flusher = asyncio.create_task(run_tracking_flusher())
+    webhook_processor = asyncio.create_task(run_webhook_processor())
+    asyncio.get_running_loop().run_in_executor(None, warm_customer_index)
     yield
-    # Shutdown: cleanup if needed
+    # Shutdown: write out buffered campaign tracking events
+    tracking_flusher.cancel()
+    webhook_processor.cancel()
+    flush_tracking_events()
+    await close_payment_providers()
 
 app = FastAPI(
     title="Wok'N'Cats POS System API",
@@ -52,6 +67,8 @@ app.include_router(staff_profiles.router, prefix="/api/v1", tags=["Staff Profile
 app.include_router(coupons.router, prefix="/api/v1/coupons", tags=["Coupons"])
 app.include_router(recommendations.router, prefix="/api/v1/recommendations", tags=["Recommendations"])
 app.include_router(marketing.router, prefix="/api/v1/marketing", tags=["Marketing"])
+app.include_router(customers.router, prefix="/api/v1/customers", tags=["Customers"])
+app.include_router(reports.router, prefix="/api/v1/reports", tags=["Reports"])
 
 @app.get("/")
 async def root():
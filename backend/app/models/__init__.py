@@ -1,11 +1,20 @@
 # Import all models here for Alembic migrations
 from app.models.user import User
+from app.models.auth_session import AuthSession
 from app.models.menu_item import MenuItem
 from app.models.table import Table
 from app.models.order import Order
+from app.models.customer import Customer
 from app.models.payment import Payment
-from app.models.coupon import Coupon
+from app.models.work_log import WorkLog
+from app.models.settings import RestaurantSettings, DeliverySettings
+from app.models.coupon import Coupon, CouponRedemption
 from app.models.recommendation import ProductRecommendation, CustomerPreference
-from app.models.marketing import MarketingCampaign, MarketingMessage, LoyaltyProgram
+from app.models.marketing import MarketingCampaign, MarketingMessage, LoyaltyProgram, CampaignSendJob, MarketingTriggerSend, CustomerSegment, LoyaltyTransaction
+from app.models.job import Job
+from app.models.webhook_event import WebhookEvent
+from app.models.day_closure import DayClosure
+from app.models.reconciliation import ReconciliationRun, ReconciliationItem
+from app.models.labor_analytics import HourlyLaborSales
 
-__all__ = ["User", "MenuItem", "Table", "Order", "Payment", "Coupon", "ProductRecommendation", "CustomerPreference", "MarketingCampaign", "MarketingMessage", "LoyaltyProgram"]
+__all__ = ["User", "AuthSession", "MenuItem", "Table", "Order", "Customer", "Payment", "WorkLog", "RestaurantSettings", "DeliverySettings", "Coupon", "CouponRedemption", "ProductRecommendation", "CustomerPreference", "MarketingCampaign", "MarketingMessage", "LoyaltyProgram", "CampaignSendJob", "MarketingTriggerSend", "CustomerSegment", "LoyaltyTransaction", "Job", "WebhookEvent", "DayClosure", "ReconciliationRun", "ReconciliationItem", "HourlyLaborSales"]
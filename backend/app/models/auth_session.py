@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class AuthSession(Base):
+    """Refresh-token session; the token rotates on every refresh and only its SHA-256 is stored"""
+    __tablename__ = "auth_sessions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    token_hash = Column(String(64), unique=True, nullable=False)  # current refresh token
+    previous_token_hash = Column(String(64), nullable=True, index=True)  # detects reuse of a rotated token
+    device_id = Column(String, nullable=True)  # set for terminal sessions bound to one device
+    device_name = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False)  # sliding, moved on every refresh
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<AuthSession {self.id} user={self.user_id} device={self.device_id}>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, UniqueConstraint, Enum as SQLEnum
 from sqlalchemy.sql import func
 from app.core.database import Base
 import enum
@@ -20,15 +20,32 @@ class Coupon(Base):
     discount_value = Column(Float, nullable=False)  # procent lub kwota
     min_order_amount = Column(Float, default=0.0)  # minimalna kwota zamówienia
     max_discount_amount = Column(Float, nullable=True)  # maksymalna zniżka
-    usage_limit = Column(Integer, nullable=True)  # ile razy można użyć (NULL = nieograniczone)
+    usage_limit = Column(Integer, nullable=True)  # ile razy można użyć (NULL lub 0 = nieograniczone)
     usage_count = Column(Integer, default=0)  # ile razy użyto
     valid_from = Column(DateTime(timezone=True), server_default=func.now())
     valid_until = Column(DateTime(timezone=True), nullable=True)
     is_active = Column(Boolean, default=True)
     applicable_categories = Column(String, nullable=True)  # JSON lista kategorii
     free_item_id = Column(Integer, nullable=True)  # ID darmowego produktu
+    batch_id = Column(String, nullable=True, index=True)  # partia kodów wygenerowanych hurtowo
+    is_stackable = Column(Boolean, default=False)  # czy łączy się z innymi kuponami
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     def __repr__(self):
         return f"<Coupon {self.code}>"
+
+
+class CouponRedemption(Base):
+    """Rejestr użyć kuponów (każdy kupon maksymalnie raz na zamówienie)"""
+    __tablename__ = "coupon_redemptions"
+    __table_args__ = (UniqueConstraint("order_id", "coupon_id", name="uq_coupon_redemptions_order_coupon"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    coupon_id = Column(Integer, ForeignKey("coupons.id", ondelete="CASCADE"), nullable=False, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=True, index=True)
+    amount = Column(Float, default=0.0)  # udzielona zniżka
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<CouponRedemption coupon={self.coupon_id} order={self.order_id}>"
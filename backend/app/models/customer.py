@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class Customer(Base):
+    """Klient - jeden wiersz na numer telefonu w formacie E.164"""
+    __tablename__ = "customers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    phone = Column(String, unique=True, index=True, nullable=False)  # np. +48600100200
+    name = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    loyalty = relationship("LoyaltyProgram", uselist=False, viewonly=True)
+    preference = relationship("CustomerPreference", uselist=False, viewonly=True)
+
+    def __repr__(self):
+        return f"<Customer {self.phone}>"
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, Integer, Date, DateTime, Float, JSON, ForeignKey, event
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class DayClosure(Base):
+    """Z-report: totals of one business day, frozen when the day is closed"""
+    __tablename__ = "day_closures"
+
+    id = Column(Integer, primary_key=True, index=True)
+    business_date = Column(Date, unique=True, nullable=False, index=True)
+    period_start = Column(DateTime, nullable=False)  # end of the previous closure
+    period_end = Column(DateTime, nullable=False)  # moment of closing, at most the end of business_date
+    closed_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    order_count = Column(Integer, nullable=False)
+    paid_order_count = Column(Integer, nullable=False)
+    cancelled_order_count = Column(Integer, nullable=False)
+    gross_sales = Column(Float, nullable=False)  # orders paid in the period, after discounts, without tips
+    discount_total = Column(Float, nullable=False)
+    tip_total = Column(Float, nullable=False)
+    delivery_fee_total = Column(Float, nullable=False)
+    refund_count = Column(Integer, nullable=False)
+    refund_total = Column(Float, nullable=False)
+    # {"cash": {"count": 3, "amount": 120.5}, "card": {...}, ...}; split payments are allocated by part
+    payment_totals = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<DayClosure {self.business_date}>"
+
+
+@event.listens_for(DayClosure, "before_update")
+@event.listens_for(DayClosure, "before_delete")
+def _reject_changes(mapper, connection, target):
+    raise ValueError("Day closures are immutable")
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, DateTime, Float
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class HourlyLaborSales(Base):
+    """Precomputed labor hours and sales of one UTC hour (filled nightly by the worker)"""
+    __tablename__ = "hourly_labor_sales"
+
+    id = Column(Integer, primary_key=True, index=True)
+    slot_start = Column(DateTime, unique=True, nullable=False, index=True)
+    labor_hours = Column(Float, nullable=False)
+    sales = Column(Float, nullable=False)
+    orders = Column(Integer, nullable=False)
+    computed_at = Column(DateTime(timezone=True), server_default=func.now())
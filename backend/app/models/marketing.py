@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey, Index, UniqueConstraint, extract, Enum as SQLEnum
 from sqlalchemy.sql import func
 from app.core.database import Base
 import enum
@@ -88,6 +88,10 @@ class MarketingMessage(Base):
     # Error handling
     error_message = Column(String, nullable=True)
 
+    # Dzierżawa wysyłki: dispatcher, który pobrał wiadomość, i do kiedy ją trzyma
+    claimed_by = Column(String, nullable=True)
+    claimed_until = Column(DateTime(timezone=True), nullable=True)
+
     def __repr__(self):
         return f"<MarketingMessage {self.id} to {self.customer_phone}>"
 
@@ -98,6 +102,7 @@ class LoyaltyProgram(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     customer_phone = Column(String, index=True, nullable=False, unique=True)
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="SET NULL"), nullable=True, unique=True, index=True)
     customer_name = Column(String, nullable=True)
     points = Column(Integer, default=0)
     tier = Column(String, default="bronze")  # bronze, silver, gold, platinum
@@ -112,3 +117,109 @@ class LoyaltyProgram(Base):
 
     def __repr__(self):
         return f"<LoyaltyProgram {self.customer_phone} - {self.tier}>"
+
+
+class LoyaltyTransactionType(str, enum.Enum):
+    EARN = "earn"
+    REDEEM = "redeem"
+    ADJUST = "adjust"
+    EXPIRE = "expire"
+
+
+class LoyaltyTransaction(Base):
+    """Księga punktów lojalnościowych (tylko dopisywanie); saldo = suma points"""
+    __tablename__ = "loyalty_transactions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    loyalty_id = Column(Integer, ForeignKey("loyalty_programs.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(SQLEnum(LoyaltyTransactionType), nullable=False)
+    points = Column(Integer, nullable=False)  # dodatnie: naliczenie, ujemne: wykorzystanie/wygaśnięcie
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="SET NULL"), nullable=True, index=True)
+    idempotency_key = Column(String, unique=True, nullable=True)
+    batch_id = Column(String, nullable=True, index=True)  # przebieg zadania wsadowego
+    description = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_loyalty_transactions_loyalty_created", "loyalty_id", "created_at"),
+    )
+
+    def __repr__(self):
+        return f"<LoyaltyTransaction {self.kind} {self.points} loyalty={self.loyalty_id}>"
+
+
+def birthday_month_day(dialect_name: str):
+    """(miesiąc, dzień) urodzin; na PostgreSQL w UTC, by wyrażenie dało się zaindeksować"""
+    birthday = LoyaltyProgram.birthday
+    if dialect_name == "postgresql":
+        birthday = func.timezone("UTC", birthday)
+    return extract("month", birthday), extract("day", birthday)
+
+
+# Urodziny wyszukiwane po wyrażeniu (miesiąc, dzień) - indeks funkcyjny
+Index(
+    "ix_loyalty_programs_birthday_month_day",
+    *birthday_month_day("postgresql")
+).ddl_if(dialect="postgresql")
+
+
+class CustomerSegment(Base):
+    """Przynależność klienta do segmentu RFM (przeliczana zadaniem marketing.segments)"""
+    __tablename__ = "customer_segments"
+
+    customer_phone = Column(String, primary_key=True)
+    segment = Column(String, nullable=False)  # vip, loyal, new, promising, at_risk, inactive, regular
+    recency_score = Column(Integer, nullable=False)  # 1-5, 5 = najświeższe zamówienie
+    frequency_score = Column(Integer, nullable=False)
+    monetary_score = Column(Integer, nullable=False)
+    computed_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_customer_segments_segment_phone", "segment", "customer_phone"),
+    )
+
+    def __repr__(self):
+        return f"<CustomerSegment {self.customer_phone} {self.segment}>"
+
+
+class MarketingTriggerSend(Base):
+    """Rejestr wysłanych triggerów: jeden na klienta, trigger i okres"""
+    __tablename__ = "marketing_trigger_sends"
+
+    id = Column(Integer, primary_key=True, index=True)
+    customer_phone = Column(String, nullable=False)
+    trigger_type = Column(SQLEnum(TriggerType), nullable=False)
+    period = Column(String, nullable=False)  # np. rok urodzin lub data ostatniego zamówienia
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("customer_phone", "trigger_type", "period", name="uq_marketing_trigger_sends_customer_trigger_period"),
+    )
+
+    def __repr__(self):
+        return f"<MarketingTriggerSend {self.customer_phone} {self.trigger_type} {self.period}>"
+
+
+class SendJobStatus(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class CampaignSendJob(Base):
+    """Zadanie wysyłki kampanii wykonywane w tle"""
+    __tablename__ = "campaign_send_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    campaign_id = Column(Integer, ForeignKey("marketing_campaigns.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(SQLEnum(SendJobStatus), default=SendJobStatus.PENDING, nullable=False)
+    total = Column(Integer, default=0)  # liczba odbiorców w segmencie
+    processed = Column(Integer, default=0)  # zapisane wiadomości
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<CampaignSendJob {self.id} campaign={self.campaign_id} {self.status}>"
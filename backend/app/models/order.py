@@ -36,7 +36,8 @@ class Order(Base):
     notes = Column(String)
     # Delivery fields
     customer_name = Column(String, nullable=True)
-    customer_phone = Column(String, nullable=True)
+    customer_phone = Column(String, nullable=True)  # E.164, same as customers.phone
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="SET NULL"), nullable=True, index=True)
     delivery_address = Column(String, nullable=True)
     delivery_fee = Column(Float, default=0.0)
     # Coupon fields
@@ -48,7 +49,10 @@ class Order(Base):
     # Tips and split
     tip_amount = Column(Float, nullable=True)
     split_count = Column(Integer, nullable=True)
-    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    # When the order was paid / refunded; Z-reports count takings and refunds by these
+    paid_at = Column(DateTime, nullable=True, index=True)
+    refunded_at = Column(DateTime, nullable=True, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
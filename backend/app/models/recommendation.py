@@ -26,13 +26,14 @@ class CustomerPreference(Base):
     __tablename__ = "customer_preferences"
 
     id = Column(Integer, primary_key=True, index=True)
-    customer_phone = Column(String, index=True, nullable=False)  # identyfikator klienta
+    customer_phone = Column(String, index=True, nullable=False)  # E.164, patrz customers.phone
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="SET NULL"), nullable=True, unique=True, index=True)
     customer_name = Column(String, nullable=True)
     favorite_items = Column(String, nullable=True)  # JSON lista ulubionych produktów
     order_frequency = Column(Integer, default=0)  # ile razy zamawiał
     total_spent = Column(Float, default=0.0)  # łącznie wydane pieniądze
     average_order_value = Column(Float, default=0.0)  # średnia wartość zamówienia
-    last_order_date = Column(DateTime(timezone=True), nullable=True)
+    last_order_date = Column(DateTime(timezone=True), nullable=True, index=True)
     preferred_order_type = Column(String, nullable=True)  # dine_in, takeaway, delivery
     notes = Column(String, nullable=True)  # notatki o kliencie
     created_at = Column(DateTime(timezone=True), server_default=func.now())
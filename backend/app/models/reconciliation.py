@@ -0,0 +1,63 @@
+from sqlalchemy import Column, Integer, String, Date, DateTime, Float, Text, ForeignKey, Index, Enum as SQLEnum
+from sqlalchemy.sql import func
+from app.core.database import Base
+import enum
+
+
+class ReconciliationStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class DiscrepancyType(str, enum.Enum):
+    MISSING_IN_DB = "missing_in_db"  # in the provider export, no payment recorded
+    MISSING_IN_EXPORT = "missing_in_export"  # payment recorded, not in the export
+    DUPLICATE = "duplicate"  # transaction id appears more than once
+    AMOUNT_MISMATCH = "amount_mismatch"
+
+
+class ReconciliationRun(Base):
+    """One comparison of a provider settlement export with the payments table"""
+    __tablename__ = "reconciliation_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String, nullable=False)  # payment_method of the compared payments, e.g. "stripe"
+    source_name = Column(String, nullable=False)  # uploaded file name
+    file_path = Column(String, nullable=False)
+    file_format = Column(String, nullable=False)  # "csv" or "json"
+    date_from = Column(Date, nullable=True)  # payments compared; whole history when empty
+    date_to = Column(Date, nullable=True)
+    status = Column(SQLEnum(ReconciliationStatus), default=ReconciliationStatus.QUEUED, nullable=False)
+    rows_read = Column(Integer, default=0, nullable=False)
+    matched = Column(Integer, default=0, nullable=False)
+    missing_in_db = Column(Integer, default=0, nullable=False)
+    missing_in_export = Column(Integer, default=0, nullable=False)
+    duplicates = Column(Integer, default=0, nullable=False)
+    amount_mismatches = Column(Integer, default=0, nullable=False)
+    error_message = Column(Text, nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<ReconciliationRun {self.id} {self.provider} {self.status}>"
+
+
+class ReconciliationItem(Base):
+    """A discrepancy found by a run (matching rows are only counted)"""
+    __tablename__ = "reconciliation_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("reconciliation_runs.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(SQLEnum(DiscrepancyType), nullable=False)
+    transaction_id = Column(String, nullable=True)
+    payment_id = Column(Integer, nullable=True)
+    expected_amount = Column(Float, nullable=True)  # payments table
+    actual_amount = Column(Float, nullable=True)  # provider export
+    line_number = Column(Integer, nullable=True)  # record number in the export
+
+    __table_args__ = (
+        Index("ix_reconciliation_items_run_kind", "run_id", "kind"),
+    )
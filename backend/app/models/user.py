@@ -17,7 +17,8 @@ class User(Base):
     role = Column(SQLEnum(UserRole), default=UserRole.STAFF, nullable=False)
     
     # Staff profile fields
-    pin_code = Column(String(4), nullable=True)  # 4-digit PIN for quick login
+    pin_code = Column(String(4), nullable=True)  # legacy plaintext PIN, hashed into pin_hash at startup
+    pin_hash = Column(String(64), nullable=True)  # HMAC-SHA256 of the 4-digit quick-login PIN
     avatar_url = Column(String, nullable=True)  # Avatar image URL
     full_name = Column(String, nullable=True)  # Display name
     position = Column(String, nullable=True)  # Job position (e.g., "Cashier", "Cook")
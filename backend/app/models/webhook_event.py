@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class WebhookEvent(Base):
+    """Verified provider webhook, stored on receipt and processed asynchronously"""
+    __tablename__ = "webhook_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String, nullable=False)  # "stripe"
+    event_id = Column(String, nullable=False)  # provider's event id; replays hit the unique key
+    event_type = Column(String, nullable=False)  # e.g. "payment_intent.succeeded"
+    payload = Column(JSON, nullable=False)
+    event_created_at = Column(DateTime, nullable=True)  # provider timestamp, processing order
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("provider", "event_id", name="uq_webhook_events_provider_event"),
+        Index("ix_webhook_events_pending", "processed_at", "event_created_at"),
+    )
+
+    def __repr__(self):
+        return f"<WebhookEvent {self.provider} {self.event_id} {self.event_type}>"
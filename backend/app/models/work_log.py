@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, DateTime, ForeignKey, String
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, String, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.core.database import Base
@@ -14,3 +14,15 @@ class WorkLog(Base):
     
     # Relationships
     user = relationship("User", back_populates="work_logs")
+
+    __table_args__ = (
+        Index("ix_work_logs_user_clock_in", "user_id", "clock_in"),
+        # At most one open shift per user; also serves the clock-in/clock-out lookup
+        Index(
+            "uq_work_logs_open_shift",
+            "user_id",
+            unique=True,
+            postgresql_where=text("clock_out IS NULL"),
+            sqlite_where=text("clock_out IS NULL")
+        ),
+    )
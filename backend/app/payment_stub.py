@@ -0,0 +1,112 @@
+"""Local stand-in for the Stripe and PayPal APIs, for offline and load testing.
+
+Run with ``python -m app.payment_stub --port 12111`` and start the API with
+``STRIPE_API_BASE=http://localhost:12111 PAYPAL_API_BASE=http://localhost:12111``
+(any STRIPE_API_KEY / PAYPAL_CLIENT_ID / PAYPAL_CLIENT_SECRET). Responses to
+a repeated idempotency key are replayed like the real providers do.
+``--latency-ms`` and ``--failure-rate`` simulate a slow or flaky provider to
+exercise the timeouts, retries and circuit breaker.
+"""
+import argparse
+import asyncio
+import random
+import secrets
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse
+
+
+class StubOptions:
+    latency: float = 0.0  # seconds
+    failure_rate: float = 0.0
+
+
+options = StubOptions()
+app = FastAPI(title="Payment provider stub")
+
+# (endpoint, idempotency key) -> stored response
+_responses: Dict[tuple, dict] = {}
+
+
+async def simulate_conditions() -> Optional[JSONResponse]:
+    if options.latency:
+        await asyncio.sleep(options.latency)
+    if options.failure_rate and random.random() < options.failure_rate:
+        return JSONResponse({"error": {"message": "Simulated provider failure"}}, status_code=503)
+    return None
+
+
+@app.post("/v1/payment_intents")
+async def create_payment_intent(request: Request, idempotency_key: Optional[str] = Header(None)):
+    failure = await simulate_conditions()
+    if failure:
+        return failure
+    if idempotency_key and ("stripe", idempotency_key) in _responses:
+        return _responses[("stripe", idempotency_key)]
+    form = await request.form()
+    if not form.get("amount") or int(form["amount"]) <= 0:
+        return JSONResponse({"error": {"message": "Invalid amount"}}, status_code=400)
+    intent_id = f"pi_{secrets.token_hex(12)}"
+    response = {
+        "id": intent_id,
+        "object": "payment_intent",
+        "amount": int(form["amount"]),
+        "currency": form.get("currency", "usd"),
+        "metadata": {"order_id": form.get("metadata[order_id]")},
+        "client_secret": f"{intent_id}_secret_{secrets.token_hex(12)}",
+        "status": "requires_payment_method",
+    }
+    if idempotency_key:
+        _responses[("stripe", idempotency_key)] = response
+    return response
+
+
+@app.post("/v1/oauth2/token")
+async def paypal_token():
+    failure = await simulate_conditions()
+    if failure:
+        return failure
+    return {"access_token": secrets.token_urlsafe(24), "token_type": "Bearer", "expires_in": 32400}
+
+
+@app.post("/v1/payments/payment", status_code=201)
+async def create_paypal_payment(request: Request, paypal_request_id: Optional[str] = Header(None)):
+    failure = await simulate_conditions()
+    if failure:
+        return failure
+    if paypal_request_id and ("paypal", paypal_request_id) in _responses:
+        return _responses[("paypal", paypal_request_id)]
+    body = await request.json()
+    payment_id = f"PAYID-{secrets.token_hex(10).upper()}"
+    response = {
+        "id": payment_id,
+        "intent": body.get("intent"),
+        "state": "created",
+        "transactions": body.get("transactions", []),
+        "links": [
+            {"href": f"http://localhost/v1/payments/payment/{payment_id}", "rel": "self", "method": "GET"},
+            {"href": f"http://localhost/checkoutnow?token={payment_id}", "rel": "approval_url", "method": "REDIRECT"},
+        ],
+    }
+    if paypal_request_id:
+        _responses[("paypal", paypal_request_id)] = response
+    return response
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local Stripe/PayPal API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every response")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    args = parser.parse_args()
+    options.latency = args.latency_ms / 1000
+    options.failure_rate = args.failure_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
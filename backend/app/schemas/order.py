@@ -1,13 +1,14 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 from app.models.order import OrderStatus, PaymentStatus, OrderType
 
 class OrderItem(BaseModel):
     item_id: int
-    name: str
-    quantity: int
-    price: float
+    quantity: int = Field(..., gt=0)
+    # Informational only; the server charges current menu names and prices
+    name: Optional[str] = None
+    price: Optional[float] = None
 
 class OrderBase(BaseModel):
     order_type: OrderType = OrderType.DINE_IN
@@ -18,9 +19,57 @@ class OrderBase(BaseModel):
     customer_phone: Optional[str] = None
     delivery_address: Optional[str] = None
 
-class OrderCreate(OrderBase):
+class OrderPricingOptions(BaseModel):
+    coupon_code: Optional[str] = None
+    coupon_codes: List[str] = []
+    loyalty_points: int = Field(0, ge=0)
+    tip_amount: Optional[float] = Field(None, ge=0)
+    tip_percent: Optional[float] = Field(None, ge=0, le=100)
+    split_count: Optional[int] = Field(None, ge=1, le=50)
+
+class OrderCreate(OrderBase, OrderPricingOptions):
     pass
 
+class OrderQuoteItem(BaseModel):
+    item_id: int
+    quantity: int = Field(..., gt=0)
+
+class OrderQuoteRequest(OrderPricingOptions):
+    order_type: OrderType = OrderType.DINE_IN
+    items: List[OrderQuoteItem]
+    customer_phone: Optional[str] = None
+
+class OrderQuoteLine(BaseModel):
+    item_id: Optional[int]
+    name: Optional[str]
+    quantity: int
+    unit_price: float
+    line_total: float
+    discount: float
+    final_total: float
+    applied_codes: List[str] = []
+
+    class Config:
+        from_attributes = True
+
+class OrderQuoteResponse(BaseModel):
+    subtotal: float
+    coupon_discounts: dict = {}
+    coupon_discount: float
+    loyalty_points: int
+    loyalty_discount: float
+    discount_amount: float
+    delivery_fee: float
+    total: float
+    tip_amount: float
+    total_with_tip: float
+    split_count: int
+    split_amounts: List[float]
+    lines: List[OrderQuoteLine]
+
+    class Config:
+        from_attributes = True
+
 class OrderUpdate(BaseModel):
     order_type: Optional[OrderType] = None
     table_id: Optional[int] = None
@@ -48,6 +97,10 @@ class OrderResponse(BaseModel):
     customer_phone: Optional[str]
     delivery_address: Optional[str]
     delivery_fee: float
+    coupon_code: Optional[str] = None
+    discount_amount: Optional[float] = 0.0
+    tip_amount: Optional[float] = None
+    split_count: Optional[int] = None
     timestamp: datetime
     updated_at: datetime
 
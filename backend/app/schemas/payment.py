@@ -1,6 +1,7 @@
 from pydantic import BaseModel
 from typing import Optional
-from datetime import datetime
+from datetime import date, datetime
+from app.models.reconciliation import DiscrepancyType, ReconciliationStatus
 
 class PaymentBase(BaseModel):
     order_id: int
@@ -23,8 +24,43 @@ class StripePaymentIntent(BaseModel):
     amount: int  # Amount in cents
     currency: str = "usd"
     order_id: int
+    idempotency_key: Optional[str] = None  # defaults to one key per order, amount and currency
 
 class PayPalPaymentCreate(BaseModel):
     order_id: int
     amount: float
     currency: str = "USD"
+    idempotency_key: Optional[str] = None
+
+class ReconciliationRunResponse(BaseModel):
+    id: int
+    provider: str
+    source_name: str
+    file_format: str
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    status: ReconciliationStatus
+    rows_read: int
+    matched: int
+    missing_in_db: int
+    missing_in_export: int
+    duplicates: int
+    amount_mismatches: int
+    error_message: Optional[str] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class ReconciliationItemResponse(BaseModel):
+    id: int
+    kind: DiscrepancyType
+    transaction_id: Optional[str]
+    payment_id: Optional[int]
+    expected_amount: Optional[float]
+    actual_amount: Optional[float]
+    line_number: Optional[int]
+
+    class Config:
+        from_attributes = True
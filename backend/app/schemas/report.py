@@ -0,0 +1,48 @@
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+from datetime import date, datetime
+
+class PaymentMethodTotal(BaseModel):
+    count: int
+    amount: float
+
+class DayClosureResponse(BaseModel):
+    id: int
+    business_date: date
+    period_start: datetime
+    period_end: datetime
+    closed_by: Optional[int] = None
+    order_count: int
+    paid_order_count: int
+    cancelled_order_count: int
+    gross_sales: float
+    discount_total: float
+    tip_total: float
+    delivery_fee_total: float
+    refund_count: int
+    refund_total: float
+    payment_totals: Dict[str, PaymentMethodTotal]
+
+    class Config:
+        from_attributes = True
+
+class LaborSalesSlotResponse(BaseModel):
+    slot_start: datetime
+    labor_hours: float
+    sales: float
+    orders: int
+    sales_per_labor_hour: Optional[float] = None  # empty when nobody was clocked in
+    labor_cost: Optional[float] = None  # with hourly_wage
+    labor_cost_percent: Optional[float] = None
+
+class LaborSalesReport(BaseModel):
+    date_from: date
+    date_to: date
+    hourly_wage: Optional[float] = None
+    labor_hours: float
+    sales: float
+    orders: int
+    sales_per_labor_hour: Optional[float] = None
+    labor_cost: Optional[float] = None
+    labor_cost_percent: Optional[float] = None
+    slots: List[LaborSalesSlotResponse]
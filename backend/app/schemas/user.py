@@ -1,5 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field
 from typing import Optional
+from datetime import datetime
 from app.models.user import UserRole
 
 class UserBase(BaseModel):
@@ -51,10 +52,28 @@ class StaffProfileResponse(BaseModel):
 class PINLoginRequest(BaseModel):
     user_id: int
     pin_code: str = Field(..., min_length=4, max_length=4, pattern=r'^\d{4}$')
+    device_id: Optional[str] = None  # terminal identifier for attempt limiting
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # access token lifetime in seconds
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+    device_id: Optional[str] = None
+
+class AuthSessionResponse(BaseModel):
+    id: int
+    device_id: Optional[str] = None
+    device_name: Optional[str] = None
+    created_at: Optional[datetime] = None
+    last_used_at: Optional[datetime] = None
+    expires_at: datetime
+
+    class Config:
+        from_attributes = True
 
 class TokenData(BaseModel):
     user_id: Optional[int] = None
@@ -22,3 +22,13 @@ class WorkLogResponse(BaseModel):
     
     class Config:
         from_attributes = True
+
+class PayrollEntry(BaseModel):
+    user_id: int
+    user_name: str
+    full_name: Optional[str] = None
+    position: Optional[str] = None
+    shifts: int
+    hours: float
+    first_clock_in: Optional[datetime] = None
+    last_clock_out: Optional[datetime] = None
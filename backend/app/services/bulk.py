@@ -0,0 +1,68 @@
+"""Chunked bulk inserts: COPY on PostgreSQL, multi-row INSERT elsewhere"""
+import csv
+import enum
+import io
+from typing import List, Sequence
+
+from sqlalchemy import Table, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+
+def _copy_rows(db: Session, table: Table, rows: List[dict]) -> None:
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # SQLAlchemy stores Python enums by member name
+        writer.writerow([
+            value.name if isinstance(value, enum.Enum) else value
+            for value in (row[column] for column in columns)
+        ])
+    buffer.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def bulk_insert(db: Session, table: Table, rows: List[dict]) -> int:
+    """Insert one chunk of rows (all with the same keys) without committing"""
+    if not rows:
+        return 0
+    if db.get_bind().dialect.name == "postgresql":
+        _copy_rows(db, table, rows)
+    else:
+        db.execute(insert(table), rows)
+    return len(rows)
+
+
+def insert_ignore(db: Session, table: Table, rows: List[dict], conflict_columns: Sequence[str], returning) -> list:
+    """Insert rows, skipping those that hit the unique key; return `returning` of inserted rows"""
+    if not rows:
+        return []
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = (
+            dialect_insert(table)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=list(conflict_columns))
+            .returning(returning)
+        )
+        return list(db.execute(stmt).scalars())
+
+    inserted = []
+    for row in rows:
+        try:
+            with db.begin_nested():
+                inserted.append(db.execute(insert(table).values(row).returning(returning)).scalar_one())
+        except IntegrityError:
+            pass
+    return inserted
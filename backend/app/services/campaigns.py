@@ -0,0 +1,207 @@
+"""Wysyłka kampanii marketingowych w tle"""
+import logging
+from datetime import datetime
+from itertools import islice
+from typing import FrozenSet, Iterator, List
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.marketing import (
+    MarketingCampaign,
+    MarketingMessage,
+    LoyaltyProgram,
+    CampaignType,
+    CampaignStatus,
+    CampaignSendJob,
+    CustomerSegment,
+    SendJobStatus
+)
+from app.models.recommendation import CustomerPreference
+from app.services.bulk import bulk_insert
+from app.services.jobs import enqueue
+from app.services.messaging import deliver_pending_messages
+from app.services.templates import CompiledTemplate, campaign_template, fit_sms, template_context, to_gsm7
+
+logger = logging.getLogger(__name__)
+
+SEND_CHUNK_SIZE = 1000
+
+
+class CampaignSendError(Exception):
+    """Wysyłka nie może zostać rozpoczęta (komunikat trafia do klienta)"""
+
+
+def segment_query(db: Session, campaign: MarketingCampaign, fields: FrozenSet[str] = frozenset()):
+    """Odbiorcy kampanii: segment RFM (target_segment) oraz progi zamówień i wydanej kwoty.
+
+    fields - pola szablonu; potrzebne dane klienta są pobierane tym samym zapytaniem.
+    """
+    columns = [
+        CustomerPreference.id,
+        CustomerPreference.customer_phone,
+        CustomerPreference.customer_name
+    ]
+    if "favorite_item" in fields:
+        columns.append(CustomerPreference.favorite_items)
+    loyalty = bool(fields & {"points", "tier"})
+    if loyalty:
+        columns += [LoyaltyProgram.points, LoyaltyProgram.tier]
+
+    query = db.query(*columns).filter(
+        CustomerPreference.order_frequency >= (campaign.min_order_count or 0),
+        CustomerPreference.total_spent >= (campaign.min_total_spent or 0.0)
+    )
+    if loyalty:
+        query = query.outerjoin(LoyaltyProgram, LoyaltyProgram.customer_phone == CustomerPreference.customer_phone)
+    if campaign.target_segment and campaign.target_segment != "all":
+        query = query.join(
+            CustomerSegment,
+            CustomerSegment.customer_phone == CustomerPreference.customer_phone
+        ).filter(CustomerSegment.segment == campaign.target_segment)
+    return query
+
+
+def render_chunk(campaign: MarketingCampaign, template: CompiledTemplate, customers: List) -> List[str]:
+    """Renderuje treści dla paczki odbiorców; SMS-y przycinane do budżetu segmentów"""
+    fields = template.fields
+    contents = template.render_many(
+        template_context(
+            name=customer.customer_name,
+            points=customer.points if "points" in fields else None,
+            tier=customer.tier if "tier" in fields else None,
+            coupon=campaign.coupon_code,
+            favorite_items=customer.favorite_items if "favorite_item" in fields else None
+        )
+        for customer in customers
+    )
+    if campaign.campaign_type == CampaignType.SMS:
+        if settings.SMS_TRANSLITERATE:
+            contents = [to_gsm7(content) for content in contents]
+        contents = [fit_sms(content, settings.SMS_MAX_SEGMENTS) for content in contents]
+    return contents
+
+
+def start_campaign_send(db: Session, campaign: MarketingCampaign) -> CampaignSendJob:
+    """Tworzy zadanie wysyłki i kolejkuje je dla workera (run_campaign_send)"""
+    active = db.query(CampaignSendJob).filter(
+        CampaignSendJob.campaign_id == campaign.id,
+        CampaignSendJob.status.in_([SendJobStatus.PENDING, SendJobStatus.RUNNING])
+    ).first()
+    if active:
+        raise CampaignSendError(f"Kampania jest już wysyłana (zadanie {active.id})")
+
+    job = CampaignSendJob(campaign_id=campaign.id, status=SendJobStatus.PENDING)
+    db.add(job)
+    db.flush()
+    # Jedna próba: ponowienie zapisałoby wiadomości drugi raz
+    enqueue(db, "campaign.send", {"send_job_id": job.id}, max_attempts=1)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def queue_scheduled_campaigns(db: Session) -> int:
+    """Uruchamia kampanie zaplanowane na teraz lub wcześniej"""
+    due = db.query(MarketingCampaign).filter(
+        MarketingCampaign.status == CampaignStatus.SCHEDULED,
+        MarketingCampaign.scheduled_date <= datetime.utcnow()
+    ).all()
+    started = 0
+    for campaign in due:
+        campaign.status = CampaignStatus.ACTIVE
+        try:
+            start_campaign_send(db, campaign)
+            started += 1
+        except CampaignSendError:
+            db.commit()
+    return started
+
+
+def _flush_chunk(db: Session, job: CampaignSendJob, rows: List[dict]) -> None:
+    """Zapisuje paczkę wiadomości i aktualizuje postęp"""
+    bulk_insert(db, MarketingMessage.__table__, rows)
+    job.processed += len(rows)
+    db.commit()
+
+
+def iter_segment_chunks(campaign: MarketingCampaign, fields: FrozenSet[str]) -> Iterator[List]:
+    """Strumieniuje odbiorców kampanii paczkami bez ładowania całego segmentu do pamięci.
+
+    Odczyt idzie osobną sesją, bo zatwierdzanie postępu zamknęłoby kursor
+    w sesji zapisującej.
+    """
+    reader = SessionLocal()
+    try:
+        query = segment_query(reader, campaign, fields).order_by(CustomerPreference.id)
+        if reader.get_bind().dialect.name == "postgresql":
+            # Kursor po stronie serwera (stream_results)
+            rows = iter(query.yield_per(SEND_CHUNK_SIZE))
+            while chunk := list(islice(rows, SEND_CHUNK_SIZE)):
+                yield chunk
+            return
+
+        # SQLite blokuje zapis przy otwartym kursorze - stronicowanie po id
+        last_id = 0
+        while True:
+            page = query.filter(CustomerPreference.id > last_id).limit(SEND_CHUNK_SIZE).all()
+            if not page:
+                return
+            yield page
+            last_id = page[-1].id
+    finally:
+        reader.close()
+
+
+def run_campaign_send(job_id: int) -> None:
+    """Wykonuje zadanie wysyłki: zapisuje wiadomości paczkami, potem je doręcza"""
+    writer = SessionLocal()
+    try:
+        job = writer.get(CampaignSendJob, job_id)
+        campaign = writer.get(MarketingCampaign, job.campaign_id)
+
+        job.status = SendJobStatus.RUNNING
+        job.started_at = datetime.utcnow()
+        job.processed = 0
+        job.total = segment_query(writer, campaign).count()
+        writer.commit()
+
+        template = campaign_template(campaign.message_template, campaign.coupon_code)
+        for customers in iter_segment_chunks(campaign, template.fields):
+            contents = render_chunk(campaign, template, customers)
+            _flush_chunk(writer, job, [
+                {
+                    "campaign_id": campaign.id,
+                    "customer_phone": customer.customer_phone,
+                    "customer_email": None,
+                    "message_type": campaign.campaign_type,
+                    "subject": campaign.subject,
+                    "message_content": content,
+                    "delivered": False,
+                    "opened": False,
+                    "clicked": False,
+                    "converted": False
+                }
+                for customer, content in zip(customers, contents)
+            ])
+
+        # Doręczenie przez dispatcher; statusy trafiają do marketing_messages
+        deliver_pending_messages(campaign.id)
+
+        campaign.sent_count = (campaign.sent_count or 0) + job.processed
+        campaign.status = CampaignStatus.ACTIVE
+        job.status = SendJobStatus.COMPLETED
+        job.finished_at = datetime.utcnow()
+        writer.commit()
+    except Exception as e:
+        logger.exception("Campaign send job %s failed", job_id)
+        writer.rollback()
+        job = writer.get(CampaignSendJob, job_id)
+        if job:
+            job.status = SendJobStatus.FAILED
+            job.error_message = str(e)
+            job.finished_at = datetime.utcnow()
+            writer.commit()
+    finally:
+        writer.close()
@@ -0,0 +1,180 @@
+"""Logika kuponów współdzielona przez API kuponów i zamówień"""
+import secrets
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.coupon import Coupon, CouponRedemption
+from app.services.bulk import bulk_insert
+
+# Bez znaków łatwych do pomylenia (0/O, 1/I/L)
+DEFAULT_CODE_ALPHABET = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+BULK_INSERT_CHUNK_SIZE = 10000
+
+
+class CouponError(Exception):
+    """Kupon nie może zostać użyty (komunikat trafia do klienta)"""
+
+
+def check_coupon(coupon: Optional[Coupon], order_total: float) -> Coupon:
+    """Sprawdza czy kupon można zastosować do zamówienia o podanej wartości"""
+    if not coupon:
+        raise CouponError("Kod kuponu nie istnieje")
+
+    if not coupon.is_active:
+        raise CouponError("Kupon jest nieaktywny")
+
+    # Sprawdź datę ważności
+    now = datetime.utcnow()
+    if coupon.valid_from and coupon.valid_from > now:
+        raise CouponError("Kupon jeszcze nie jest aktywny")
+
+    if coupon.valid_until and coupon.valid_until < now:
+        raise CouponError("Kupon wygasł")
+
+    # Sprawdź limit użyć
+    if coupon.usage_limit and coupon.usage_count >= coupon.usage_limit:
+        raise CouponError("Limit użyć kuponu został wyczerpany")
+
+    # Sprawdź minimalną kwotę zamówienia
+    if order_total < coupon.min_order_amount:
+        raise CouponError(f"Minimalna kwota zamówienia: {coupon.min_order_amount} zł")
+
+    return coupon
+
+
+def get_valid_coupons(db: Session, codes: Sequence[str], order_total: float) -> List[Coupon]:
+    """Pobiera kupony jednym zapytaniem i sprawdza każdy z nich"""
+    codes = [code.upper() for code in codes]
+    found = {coupon.code: coupon for coupon in db.query(Coupon).filter(Coupon.code.in_(codes))}
+    return [check_coupon(found.get(code), order_total) for code in codes]
+
+
+def redeem_coupon(
+    db: Session,
+    coupon_id: int,
+    amount: float = 0.0,
+    order_id: Optional[int] = None
+) -> CouponRedemption:
+    """Atomowo zużywa kupon i zapisuje wpis w rejestrze użyć.
+
+    Licznik jest zwiększany warunkowym UPDATE ... WHERE usage_count < usage_limit
+    (usage_limit puste lub 0 - bez limitu), więc równoległe terminale nie przekroczą limitu. Funkcja nie wykonuje commit -
+    wywołujący zatwierdza ją w tej samej transakcji co zamówienie. Ponowne
+    wywołanie dla tego samego zamówienia zwraca istniejący wpis.
+    """
+    if order_id is not None:
+        existing = db.query(CouponRedemption).filter(
+            CouponRedemption.order_id == order_id,
+            CouponRedemption.coupon_id == coupon_id
+        ).first()
+        if existing:
+            return existing
+
+    try:
+        with db.begin_nested():
+            redemption = CouponRedemption(coupon_id=coupon_id, order_id=order_id, amount=round(amount, 2))
+            db.add(redemption)
+            db.flush()
+
+            usage_count = db.execute(
+                update(Coupon)
+                .where(
+                    Coupon.id == coupon_id,
+                    Coupon.is_active == True,
+                    # 0 oznacza brak limitu, tak jak w check_coupon
+                    or_(Coupon.usage_limit == None, Coupon.usage_limit == 0, Coupon.usage_count < Coupon.usage_limit)
+                )
+                .values(usage_count=Coupon.usage_count + 1)
+                .returning(Coupon.usage_count)
+                .execution_options(synchronize_session="fetch")
+            ).scalar_one_or_none()
+
+            if usage_count is None:
+                raise CouponError("Limit użyć kuponu został wyczerpany")
+    except IntegrityError:
+        # Inny terminal zdążył zapisać użycie dla tego zamówienia
+        if order_id is None:
+            raise
+        return db.query(CouponRedemption).filter(
+            CouponRedemption.order_id == order_id,
+            CouponRedemption.coupon_id == coupon_id
+        ).one()
+
+    return redemption
+
+
+def _random_chars(count: int, alphabet: str) -> str:
+    """Zwraca count losowych znaków z alfabetu (bez przesunięcia modulo)"""
+    limit = 256 - 256 % len(alphabet)
+    table = bytes(ord(alphabet[i % len(alphabet)]) for i in range(256))
+    rejected = bytes(range(limit, 256))
+
+    chunks = []
+    total = 0
+    while total < count:
+        chunk = secrets.token_bytes(count - total + 64).translate(table, rejected)
+        chunks.append(chunk)
+        total += len(chunk)
+    return b"".join(chunks)[:count].decode("ascii")
+
+
+def generate_coupon_codes(
+    count: int,
+    length: int = 8,
+    alphabet: str = DEFAULT_CODE_ALPHABET,
+    prefix: str = "",
+    exclude: Iterable[str] = ()
+) -> List[str]:
+    """Generuje count unikalnych kodów; kolizje rozwiązywane są w pamięci"""
+    if len(alphabet) ** length < count * 4:
+        raise CouponError("Zbyt mało kombinacji dla podanej długości i alfabetu")
+
+    taken = set(exclude)
+    codes = []
+    seen = set()
+    while len(codes) < count:
+        missing = count - len(codes)
+        chars = _random_chars(missing * length, alphabet)
+        for i in range(0, len(chars), length):
+            code = prefix + chars[i:i + length]
+            if code not in seen and code not in taken:
+                seen.add(code)
+                codes.append(code)
+    return codes
+
+
+def bulk_create_coupons(db: Session, codes: List[str], **fields) -> int:
+    """Zapisuje kody partiami (COPY w PostgreSQL, wielowierszowy INSERT w pozostałych).
+
+    Pola wspólne (rodzaj zniżki, limity, batch_id...) przekazywane są jako
+    argumenty nazwane. Funkcja nie wykonuje commit.
+    """
+    fields.setdefault("usage_count", 0)
+    fields.setdefault("valid_from", datetime.utcnow())
+
+    for start in range(0, len(codes), BULK_INSERT_CHUNK_SIZE):
+        bulk_insert(db, Coupon.__table__, [dict(fields, code=code) for code in codes[start:start + BULK_INSERT_CHUNK_SIZE]])
+    return len(codes)
+
+
+def iter_batch_codes_csv(db: Session, batch_id: str) -> Iterator[str]:
+    """Strumieniuje kody z partii jako CSV bez ładowania całej partii do pamięci"""
+    yield "code\n"
+    lines = []
+    query = (
+        db.query(Coupon.code)
+        .filter(Coupon.batch_id == batch_id)
+        .order_by(Coupon.id)
+        .yield_per(BULK_INSERT_CHUNK_SIZE)
+    )
+    for (code,) in query:
+        lines.append(code)
+        if len(lines) >= BULK_INSERT_CHUNK_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
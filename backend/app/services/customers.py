@@ -0,0 +1,65 @@
+"""Tożsamość klienta: numer telefonu w formacie E.164 jako jedyny klucz.
+
+Zamówienia, preferencje i program lojalnościowy przechowują ten sam
+znormalizowany numer oraz customer_id, więc "+48 600 100 200" i
+"600100200" to jeden klient.
+"""
+import re
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session, joinedload
+
+from app.core.config import settings
+from app.models.customer import Customer
+from app.services.bulk import insert_ignore
+
+PHONE_SEPARATORS = re.compile(r"[\s\-().]")
+
+
+def normalize_phone(raw: Optional[str]) -> Optional[str]:
+    """Numer w formacie E.164 (+48600100200) albo None, gdy to nie jest numer telefonu"""
+    if not raw:
+        return None
+    phone = PHONE_SEPARATORS.sub("", raw)
+    if phone.startswith("00"):
+        phone = "+" + phone[2:]
+
+    country_code = settings.PHONE_COUNTRY_CODE
+    if phone.startswith("+"):
+        digits = phone[1:]
+    elif len(phone) == settings.PHONE_NATIONAL_DIGITS:
+        digits = country_code + phone
+    elif phone.startswith(country_code) and len(phone) == len(country_code) + settings.PHONE_NATIONAL_DIGITS:
+        digits = phone
+    else:
+        return None
+
+    if not (digits.isascii() and digits.isdigit()) or not 8 <= len(digits) <= 15:
+        return None
+    return "+" + digits
+
+
+def ensure_customer(db: Session, phone: str, name: Optional[str] = None) -> int:
+    """Id klienta o znormalizowanym numerze; zakłada go, jeśli nie istnieje (bez commit)"""
+    insert_ignore(db, Customer.__table__, [{"phone": phone, "name": name}], ("phone",), Customer.id)
+    customer_id = db.query(Customer.id).filter(Customer.phone == phone).scalar()
+    if name:
+        db.execute(
+            update(Customer)
+            .where(Customer.id == customer_id, Customer.name == None)
+            .values(name=name)
+            .execution_options(synchronize_session=False)
+        )
+    return customer_id
+
+
+def find_customer(db: Session, phone: Optional[str]) -> Optional[Customer]:
+    """Klient wraz z kontem lojalnościowym i preferencjami - jedno zapytanie po indeksie"""
+    phone = normalize_phone(phone)
+    if phone is None:
+        return None
+    return db.query(Customer).options(
+        joinedload(Customer.loyalty),
+        joinedload(Customer.preference)
+    ).filter(Customer.phone == phone).first()
@@ -0,0 +1,220 @@
+"""Silnik rabatów: reguły kuponów stosowane do poszczególnych pozycji koszyka"""
+import json
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models.coupon import Coupon, DiscountType
+from app.services.coupons import CouponError, get_valid_coupons
+from app.services.menu_cache import MenuEntry, get_menu_snapshot
+
+# Najpierw darmowe produkty, potem procenty, na końcu kwoty stałe
+_RULE_ORDER = {DiscountType.FREE_ITEM: 0, DiscountType.PERCENTAGE: 1, DiscountType.FIXED: 2}
+
+
+@lru_cache(maxsize=1024)
+def parse_categories(raw: Optional[str]) -> Optional[FrozenSet[str]]:
+    """Zamienia applicable_categories (lista JSON lub tekst po przecinku) na zbiór"""
+    if not raw:
+        return None
+    try:
+        values = json.loads(raw)
+    except ValueError:
+        values = raw.split(",")
+    if isinstance(values, str):
+        values = [values]
+    categories = frozenset(str(value).strip().lower() for value in values if str(value).strip())
+    return categories or None
+
+
+@dataclass(frozen=True)
+class DiscountRule:
+    """Reguła rabatowa skompilowana z kuponu"""
+    coupon_id: int
+    code: str
+    discount_type: DiscountType
+    value: float
+    max_discount: Optional[float] = None
+    categories: Optional[FrozenSet[str]] = None
+    free_item_id: Optional[int] = None
+    stackable: bool = False
+
+    @classmethod
+    def from_coupon(cls, coupon: Coupon) -> "DiscountRule":
+        return cls(
+            coupon_id=coupon.id,
+            code=coupon.code,
+            discount_type=coupon.discount_type,
+            value=coupon.discount_value or 0.0,
+            max_discount=coupon.max_discount_amount,
+            categories=parse_categories(coupon.applicable_categories),
+            free_item_id=coupon.free_item_id,
+            stackable=bool(coupon.is_stackable)
+        )
+
+
+@dataclass
+class CartLine:
+    item_id: Optional[int]
+    name: Optional[str]
+    quantity: int
+    unit_price: float
+    category: Optional[str] = None
+
+
+@dataclass
+class LineBreakdown:
+    item_id: Optional[int]
+    name: Optional[str]
+    quantity: int
+    unit_price: float
+    line_total: float
+    discount: float
+    final_total: float
+    applied_codes: List[str] = field(default_factory=list)
+
+
+@dataclass
+class DiscountResult:
+    subtotal: float
+    discount_amount: float
+    total: float
+    lines: List[LineBreakdown]
+    applied: Dict[str, float]  # kod kuponu -> udzielona zniżka
+
+
+def build_cart_lines(items: Iterable, menu: Dict[int, MenuEntry]) -> List[CartLine]:
+    """Buduje pozycje koszyka; kategorie i brakujące ceny pochodzą z migawki menu"""
+    lines = []
+    for item in items:
+        data = item if isinstance(item, dict) else item.model_dump()
+        item_id = data.get("item_id") or data.get("id")
+        entry = menu.get(item_id) if item_id is not None else None
+        price = data.get("price")
+        if price is None:
+            price = entry.price if entry else 0.0
+        lines.append(CartLine(
+            item_id=item_id,
+            name=data.get("name") or (entry.name if entry else None),
+            quantity=int(data.get("quantity", 1)),
+            unit_price=float(price),
+            category=entry.category if entry else None
+        ))
+    return lines
+
+
+def _rule_shares(rule: DiscountRule, lines: Sequence[CartLine], remaining: List[float]) -> Dict[int, float]:
+    """Zwraca zniżkę reguły rozłożoną na indeksy pozycji"""
+    if rule.discount_type == DiscountType.FREE_ITEM:
+        for i, line in enumerate(lines):
+            if line.item_id == rule.free_item_id and remaining[i] > 0:
+                return {i: min(line.unit_price, remaining[i])}
+        return {}
+
+    categories = rule.categories
+    eligible = [
+        i for i, line in enumerate(lines)
+        if remaining[i] > 0 and (
+            categories is None or (line.category is not None and line.category.lower() in categories)
+        )
+    ]
+    base = sum(remaining[i] for i in eligible)
+    if base <= 0:
+        return {}
+
+    if rule.discount_type == DiscountType.PERCENTAGE:
+        total = base * rule.value / 100
+        if rule.max_discount:
+            total = min(total, rule.max_discount)
+    else:
+        total = min(rule.value, base)
+
+    # Rozkład proporcjonalny, zaokrąglenie do groszy, reszta na ostatnią pozycję
+    total = round(total, 2)
+    shares = {i: min(remaining[i], round(total * remaining[i] / base, 2)) for i in eligible}
+    last = eligible[-1]
+    shares[last] = min(remaining[last], round(shares[last] + total - sum(shares.values()), 2))
+    return shares
+
+
+def check_stacking(rules: Sequence[DiscountRule]) -> None:
+    """Kupony niełączliwe muszą być użyte samodzielnie"""
+    if len(rules) > 1:
+        for rule in rules:
+            if not rule.stackable:
+                raise CouponError(f"Kupon {rule.code} nie łączy się z innymi kuponami")
+
+
+def evaluate_discounts(lines: Sequence[CartLine], rules: Sequence[DiscountRule]) -> DiscountResult:
+    """Stosuje reguły do pozycji koszyka i zwraca rozbicie zniżek na pozycje.
+
+    Kupon, który nie obniża żadnej pozycji, jest odrzucany (CouponError).
+    """
+    check_stacking(rules)
+
+    line_totals = [line.quantity * line.unit_price for line in lines]
+    remaining = list(line_totals)
+    codes: List[List[str]] = [[] for _ in lines]
+    applied: Dict[str, float] = {}
+
+    for rule in sorted(rules, key=lambda r: _RULE_ORDER[r.discount_type]):
+        amount = 0.0
+        for i, share in _rule_shares(rule, lines, remaining).items():
+            if share > 0:
+                remaining[i] -= share
+                codes[i].append(rule.code)
+                amount += share
+        # Kupon, który nic nie obniża, nie może zostać zużyty przy zamówieniu
+        if amount <= 0:
+            if rule.discount_type == DiscountType.FREE_ITEM:
+                raise CouponError(f"Kupon {rule.code}: w koszyku nie ma produktu gratis")
+            raise CouponError(f"Kupon {rule.code} nie obejmuje żadnej pozycji koszyka")
+        applied[rule.code] = round(amount, 2)
+
+    breakdown = [
+        LineBreakdown(
+            item_id=line.item_id,
+            name=line.name,
+            quantity=line.quantity,
+            unit_price=line.unit_price,
+            line_total=round(line_totals[i], 2),
+            discount=round(line_totals[i] - remaining[i], 2),
+            final_total=round(remaining[i], 2),
+            applied_codes=codes[i]
+        )
+        for i, line in enumerate(lines)
+    ]
+    subtotal = round(sum(line_totals), 2)
+    discount_amount = round(sum(applied.values()), 2)
+    return DiscountResult(
+        subtotal=subtotal,
+        discount_amount=discount_amount,
+        total=round(max(0.0, subtotal - discount_amount), 2),
+        lines=breakdown,
+        applied=applied
+    )
+
+
+def apply_coupons(
+    db: Session,
+    codes: Sequence[str],
+    lines: List[CartLine]
+) -> Tuple[List[Coupon], DiscountResult]:
+    """Waliduje kupony (jedno zapytanie) i wylicza zniżki dla koszyka"""
+    coupons = get_valid_coupons(db, codes, sum(line.quantity * line.unit_price for line in lines)) if codes else []
+    result = evaluate_discounts(lines, [DiscountRule.from_coupon(coupon) for coupon in coupons])
+    return coupons, result
+
+
+def requested_coupon_codes(coupon_code: Optional[str], coupon_codes: Optional[Sequence[str]] = None) -> List[str]:
+    """Łączy pojedynczy kod i listę kodów w listę bez duplikatów"""
+    codes = [coupon_code] if coupon_code else []
+    codes.extend(coupon_codes or [])
+    return list(dict.fromkeys(code.strip().upper() for code in codes if code and code.strip()))
+
+
+def cart_lines_for(db: Session, items: Iterable) -> List[CartLine]:
+    """Pozycje koszyka z kategoriami z buforowanej migawki menu"""
+    return build_cart_lines(items, get_menu_snapshot(db))
@@ -0,0 +1,175 @@
+"""Durable job queue on the jobs table (see app/worker.py for the consumer)"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.job import Job, JobStatus
+
+RETRY_BASE_DELAY_SECONDS = 10
+RETRY_MAX_DELAY_SECONDS = 3600
+PURGE_BATCH_SIZE = 5000
+
+
+@dataclass
+class ClaimedJob:
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+    max_attempts: int
+
+
+def enqueue(
+    db: Session,
+    kind: str,
+    payload: Optional[Dict[str, Any]] = None,
+    run_at: Optional[datetime] = None,
+    max_attempts: int = 5,
+    dedupe_key: Optional[str] = None
+) -> Job:
+    """Add a job without committing; with dedupe_key an existing job is returned instead"""
+    if dedupe_key is not None:
+        existing = db.query(Job).filter(Job.dedupe_key == dedupe_key).first()
+        if existing:
+            return existing
+
+    job = Job(
+        kind=kind,
+        payload=payload or {},
+        status=JobStatus.QUEUED,
+        run_at=run_at or datetime.utcnow(),
+        attempts=0,
+        max_attempts=max_attempts,
+        dedupe_key=dedupe_key
+    )
+    try:
+        with db.begin_nested():
+            db.add(job)
+    except IntegrityError:
+        # Another process enqueued the same key concurrently
+        return db.query(Job).filter(Job.dedupe_key == dedupe_key).one()
+    return job
+
+
+def claim_jobs(db: Session, worker_id: str, limit: int, visibility_timeout: int) -> List[ClaimedJob]:
+    """Atomically lease up to `limit` due jobs and commit the lease.
+
+    Jobs whose lease expired (the worker died) are claimable again while they
+    have attempts left. Rows locked by another worker are skipped, so any
+    number of workers can poll the same table.
+    """
+    now = datetime.utcnow()
+    claimable = or_(
+        and_(Job.status == JobStatus.QUEUED, Job.run_at <= now),
+        and_(Job.status == JobStatus.RUNNING, Job.locked_until < now, Job.attempts < Job.max_attempts)
+    )
+    candidates = (
+        select(Job.id)
+        .where(claimable)
+        .order_by(Job.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    rows = db.execute(
+        update(Job)
+        .where(Job.id.in_(candidates))
+        .values(
+            status=JobStatus.RUNNING,
+            attempts=Job.attempts + 1,
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=visibility_timeout)
+        )
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return [ClaimedJob(row.id, row.kind, row.payload or {}, row.attempts, row.max_attempts) for row in rows]
+
+
+def extend_lease(db: Session, job_id: int, worker_id: str, visibility_timeout: int) -> bool:
+    """Push the lease of a running job forward; False when the job is no longer held by worker_id"""
+    result = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.locked_by == worker_id, Job.status == JobStatus.RUNNING)
+        .values(locked_until=datetime.utcnow() + timedelta(seconds=visibility_timeout))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return bool(result.rowcount)
+
+
+def fail_expired_jobs(db: Session) -> int:
+    """Give up on leased jobs that timed out with no attempts left"""
+    now = datetime.utcnow()
+    result = db.execute(
+        update(Job)
+        .where(
+            Job.status == JobStatus.RUNNING,
+            Job.locked_until < now,
+            Job.attempts >= Job.max_attempts
+        )
+        .values(status=JobStatus.FAILED, last_error="Visibility timeout expired", finished_at=now, locked_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def complete_job(db: Session, job: ClaimedJob, worker_id: str) -> None:
+    """Mark a job done, unless its lease was taken over by another worker"""
+    db.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.locked_by == worker_id, Job.status == JobStatus.RUNNING)
+        .values(status=JobStatus.COMPLETED, finished_at=datetime.utcnow(), locked_until=None, last_error=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def retry_delay(attempts: int) -> int:
+    """Exponential backoff in seconds after the given number of attempts"""
+    return min(RETRY_BASE_DELAY_SECONDS * 2 ** (attempts - 1), RETRY_MAX_DELAY_SECONDS)
+
+
+def fail_job(db: Session, job: ClaimedJob, worker_id: str, error: str) -> None:
+    """Requeue a failed job with backoff, or fail it for good when out of attempts"""
+    now = datetime.utcnow()
+    if job.attempts < job.max_attempts:
+        values = {
+            "status": JobStatus.QUEUED,
+            "run_at": now + timedelta(seconds=retry_delay(job.attempts)),
+        }
+    else:
+        values = {"status": JobStatus.FAILED, "finished_at": now}
+    db.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.locked_by == worker_id, Job.status == JobStatus.RUNNING)
+        .values(locked_until=None, last_error=error[:2000], **values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def purge_finished_jobs(db: Session, older_than_days: int) -> int:
+    """Delete completed and failed jobs finished more than older_than_days ago, in batches"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    total = 0
+    while True:
+        batch = (
+            select(Job.id)
+            .where(Job.status.in_([JobStatus.COMPLETED, JobStatus.FAILED]), Job.finished_at < cutoff)
+            .limit(PURGE_BATCH_SIZE)
+            .scalar_subquery()
+        )
+        deleted = db.execute(
+            delete(Job).where(Job.id.in_(batch)).execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        total += deleted
+        if deleted < PURGE_BATCH_SIZE:
+            return total
@@ -0,0 +1,160 @@
+"""Labor vs sales per UTC hour: labor hours, paid sales, orders, sales per labor hour.
+
+Shift coverage and sales are bucketed into hourly slots. PostgreSQL does it
+in one statement over generate_series; other databases (SQLite) load the
+shifts and orders once and bucket them with NumPy. Closed days are
+precomputed nightly into hourly_labor_sales, so a historical view reads
+stored slots and only the period after the last precomputed slot is
+computed live.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import delete, func, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.labor_analytics import HourlyLaborSales
+from app.models.order import Order, PaymentStatus
+from app.models.work_log import WorkLog
+from app.services.bulk import bulk_insert
+
+HOUR = timedelta(hours=1)
+
+LABOR_SALES_SQL = text("""
+WITH slots AS (
+    SELECT generate_series(CAST(:start AS timestamp), CAST(:end AS timestamp) - interval '1 hour', interval '1 hour') AS slot_start
+),
+labor AS (
+    SELECT s.slot_start,
+           SUM(EXTRACT(EPOCH FROM
+               LEAST(COALESCE(w.clock_out, CAST(:now AS timestamp)), s.slot_start + interval '1 hour')
+               - GREATEST(w.clock_in, s.slot_start)
+           )) / 3600 AS labor_hours
+    FROM slots s
+    JOIN work_logs w
+      ON w.clock_in < s.slot_start + interval '1 hour'
+     AND COALESCE(w.clock_out, CAST(:now AS timestamp)) > s.slot_start
+    GROUP BY s.slot_start
+),
+sales AS (
+    SELECT date_trunc('hour', o.timestamp) AS slot_start, SUM(o.total_price) AS sales, COUNT(*) AS orders
+    FROM orders o
+    WHERE o.timestamp >= :start AND o.timestamp < :end AND o.payment_status = :paid
+    GROUP BY 1
+)
+SELECT s.slot_start, COALESCE(l.labor_hours, 0), COALESCE(sa.sales, 0), COALESCE(sa.orders, 0)
+FROM slots s
+LEFT JOIN labor l ON l.slot_start = s.slot_start
+LEFT JOIN sales sa ON sa.slot_start = s.slot_start
+ORDER BY s.slot_start
+""")
+
+
+@dataclass
+class LaborSalesSlot:
+    slot_start: datetime
+    labor_hours: float
+    sales: float
+    orders: int
+
+
+def _compute_postgresql(db: Session, start: datetime, end: datetime, now: datetime) -> List[LaborSalesSlot]:
+    rows = db.execute(
+        LABOR_SALES_SQL, {"start": start, "end": end, "now": now, "paid": PaymentStatus.PAID.name}
+    ).all()
+    return [LaborSalesSlot(row[0], float(row[1]), float(row[2]), int(row[3])) for row in rows]
+
+
+def _hours_since(values, start: datetime) -> np.ndarray:
+    return np.fromiter(((value - start).total_seconds() / 3600 for value in values), dtype=float)
+
+
+def _compute_numpy(db: Session, start: datetime, end: datetime, now: datetime) -> List[LaborSalesSlot]:
+    slot_count = int((end - start) / HOUR)
+    shifts = (
+        db.query(WorkLog.clock_in, WorkLog.clock_out)
+        .filter(WorkLog.clock_in < end, func.coalesce(WorkLog.clock_out, now) > start)
+        .all()
+    )
+    orders = (
+        db.query(Order.timestamp, Order.total_price)
+        .filter(Order.timestamp >= start, Order.timestamp < end, Order.payment_status == PaymentStatus.PAID)
+        .all()
+    )
+
+    # Worked hours up to time t is sum(clip(t, in, out) - in); a slot gets the difference between its edges
+    clock_in = np.sort(_hours_since((shift.clock_in for shift in shifts), start))
+    clock_out = np.sort(_hours_since((shift.clock_out or now for shift in shifts), start))
+    edges = np.arange(slot_count + 1, dtype=float)
+
+    def worked_until(points: np.ndarray) -> np.ndarray:
+        counts = np.searchsorted(points, edges, side="left")
+        prefix = np.concatenate(([0.0], np.cumsum(points)))
+        return edges * counts - prefix[counts]
+
+    labor = np.diff(worked_until(clock_in) - worked_until(clock_out))
+
+    order_slots = np.floor(_hours_since((order.timestamp for order in orders), start)).astype(int)
+    order_totals = np.fromiter((order.total_price for order in orders), dtype=float, count=len(orders))
+    sales = np.bincount(order_slots, weights=order_totals, minlength=slot_count)
+    counts = np.bincount(order_slots, minlength=slot_count)
+
+    return [
+        LaborSalesSlot(start + index * HOUR, float(labor[index]), float(sales[index]), int(counts[index]))
+        for index in range(slot_count)
+    ]
+
+
+def compute_slots(db: Session, start: datetime, end: datetime) -> List[LaborSalesSlot]:
+    """Hourly slots of [start, end); both must be whole hours"""
+    if end <= start:
+        return []
+    now = datetime.utcnow()
+    if db.get_bind().dialect.name == "postgresql":
+        return _compute_postgresql(db, start, end, now)
+    return _compute_numpy(db, start, end, now)
+
+
+def precompute_labor_sales(db: Session, days: Optional[int] = None) -> int:
+    """Store the slots of the last `days` closed days, replacing earlier results (commits)"""
+    days = settings.LABOR_ANALYTICS_RECOMPUTE_DAYS if days is None else days
+    end = datetime.combine(datetime.utcnow().date(), time.min)
+    start = end - timedelta(days=days)
+    slots = compute_slots(db, start, end)
+
+    db.execute(delete(HourlyLaborSales).where(HourlyLaborSales.slot_start >= start, HourlyLaborSales.slot_start < end))
+    bulk_insert(db, HourlyLaborSales.__table__, [
+        {
+            "slot_start": slot.slot_start,
+            "labor_hours": round(slot.labor_hours, 4),
+            "sales": round(slot.sales, 2),
+            "orders": slot.orders,
+            "computed_at": datetime.utcnow(),
+        }
+        for slot in slots
+    ])
+    db.commit()
+    return len(slots)
+
+
+def labor_vs_sales(db: Session, date_from: date, date_to: date) -> List[LaborSalesSlot]:
+    """Slots of date_from..date_to (inclusive days): stored where precomputed, computed live after that"""
+    start = datetime.combine(date_from, time.min)
+    end = datetime.combine(date_to + timedelta(days=1), time.min)
+
+    stored = (
+        db.query(HourlyLaborSales)
+        .filter(HourlyLaborSales.slot_start >= start, HourlyLaborSales.slot_start < end)
+        .order_by(HourlyLaborSales.slot_start)
+        .all()
+    )
+    # Stored slots are used when they cover an unbroken prefix of the range; otherwise all is computed live
+    if stored and stored[0].slot_start == start and stored[-1].slot_start - start == (len(stored) - 1) * HOUR:
+        slots = [LaborSalesSlot(row.slot_start, row.labor_hours, row.sales, row.orders) for row in stored]
+        live_start = stored[-1].slot_start + HOUR
+    else:
+        slots, live_start = [], start
+    return slots + compute_slots(db, live_start, end)
@@ -0,0 +1,267 @@
+"""Operacje na punktach programu lojalnościowego.
+
+Każda zmiana salda to wpis w księdze loyalty_transactions oraz warunkowy
+UPDATE salda w tej samej transakcji. Funkcje nie wykonują commit -
+wywołujący zatwierdza zmianę razem z resztą operacji (np. zamówieniem).
+"""
+import math
+import random
+import string
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import String, case, cast, exists, func, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.marketing import LoyaltyProgram, LoyaltyTransaction, LoyaltyTransactionType
+from app.services.bulk import insert_ignore
+from app.services.customers import ensure_customer, normalize_phone
+
+POINT_VALUE = 0.10  # 1 punkt = 0.10 zł zniżki
+
+# Próg wydanej kwoty dla poziomów, od najwyższego
+TIER_THRESHOLDS = (("platinum", 5000), ("gold", 2000), ("silver", 500))
+DEFAULT_TIER = "bronze"
+
+
+class LoyaltyError(Exception):
+    """Operacja na punktach nie może zostać wykonana (komunikat trafia do klienta)"""
+
+
+class LoyaltyAccountNotFound(LoyaltyError):
+    """Brak konta lojalnościowego dla numeru telefonu"""
+
+
+def points_discount(points: int) -> float:
+    """Wartość zniżki za podaną liczbę punktów"""
+    return round(points * POINT_VALUE, 2)
+
+
+def points_for_discount(amount: float) -> int:
+    """Najmniejsza liczba punktów pokrywająca zniżkę o podanej wartości"""
+    return math.ceil(round(amount / POINT_VALUE, 6))
+
+
+def generate_referral_code(length=8):
+    """Generuje unikalny kod polecający"""
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+def tier_expression(total_spent):
+    """Poziom programu jako wyrażenie SQL (CASE) dla podanej kwoty wydanej"""
+    return case(
+        *((total_spent >= threshold, tier) for tier, threshold in TIER_THRESHOLDS),
+        else_=DEFAULT_TIER
+    )
+
+
+def ensure_account(db: Session, phone: str) -> int:
+    """Id konta klienta (numer już znormalizowany); konto jest zakładane automatycznie"""
+    insert_ignore(db, LoyaltyProgram.__table__, [{
+        "customer_phone": phone,
+        "customer_id": ensure_customer(db, phone),
+        "points": 0,
+        "tier": DEFAULT_TIER,
+        "total_visits": 0,
+        "total_spent": 0.0,
+        "referral_code": generate_referral_code()
+    }], ("customer_phone",), LoyaltyProgram.id)
+    return db.query(LoyaltyProgram.id).filter(LoyaltyProgram.customer_phone == phone).scalar()
+
+
+def _balance(db: Session, loyalty_id: int) -> int:
+    return db.query(LoyaltyProgram.points).filter(LoyaltyProgram.id == loyalty_id).scalar()
+
+
+def _apply_transaction(
+    db: Session,
+    phone: str,
+    kind: LoyaltyTransactionType,
+    points: int,
+    order_id: Optional[int] = None,
+    idempotency_key: Optional[str] = None,
+    description: Optional[str] = None,
+    account_values: Optional[dict] = None,
+    create_account: bool = False
+) -> int:
+    """Dopisuje wpis do księgi i zmienia saldo; zwraca nowe saldo.
+
+    Ujemna zmiana przechodzi tylko, gdy saldo jej wystarcza (UPDATE ...
+    WHERE points >= :n), więc równoległe wykorzystania nie zejdą poniżej
+    zera. Powtórzenie z tym samym idempotency_key zwraca bieżące saldo bez
+    ponownej zmiany.
+    """
+    phone = normalize_phone(phone)
+    if phone is None:
+        raise LoyaltyError("Nieprawidłowy numer telefonu")
+
+    if idempotency_key:
+        replay = db.query(LoyaltyTransaction.loyalty_id).filter(
+            LoyaltyTransaction.idempotency_key == idempotency_key
+        ).scalar()
+        if replay is not None:
+            return _balance(db, replay)
+
+    if create_account:
+        loyalty_id = ensure_account(db, phone)
+    else:
+        loyalty_id = db.query(LoyaltyProgram.id).filter(LoyaltyProgram.customer_phone == phone).scalar()
+    if loyalty_id is None:
+        raise LoyaltyAccountNotFound("Konto lojalnościowe nie znalezione")
+
+    statement = update(LoyaltyProgram).where(LoyaltyProgram.id == loyalty_id)
+    if points < 0:
+        statement = statement.where(LoyaltyProgram.points >= -points)
+
+    try:
+        with db.begin_nested():
+            db.add(LoyaltyTransaction(
+                loyalty_id=loyalty_id,
+                kind=kind,
+                points=points,
+                order_id=order_id,
+                idempotency_key=idempotency_key,
+                description=description
+            ))
+            db.flush()
+            balance = db.execute(
+                statement
+                .values(points=LoyaltyProgram.points + points, **(account_values or {}))
+                .returning(LoyaltyProgram.points)
+                .execution_options(synchronize_session="fetch")
+            ).scalar_one_or_none()
+            if balance is None:
+                raise LoyaltyError("Niewystarczająca ilość punktów")
+    except IntegrityError:
+        # Ten sam klucz idempotencji zapisany równolegle - inne naruszenia przekazujemy dalej
+        if not idempotency_key or not db.query(LoyaltyTransaction.id).filter(
+            LoyaltyTransaction.idempotency_key == idempotency_key
+        ).first():
+            raise
+        return _balance(db, loyalty_id)
+    return balance
+
+
+def earn_points(
+    db: Session,
+    phone: str,
+    points: int,
+    order_total: float = 0.0,
+    order_id: Optional[int] = None,
+    idempotency_key: Optional[str] = None
+) -> int:
+    """Nalicza punkty za wizytę i aktualizuje poziom (konto zakładane automatycznie)"""
+    total_spent = LoyaltyProgram.total_spent + order_total
+    return _apply_transaction(
+        db, phone, LoyaltyTransactionType.EARN, points,
+        order_id=order_id,
+        idempotency_key=idempotency_key,
+        account_values={
+            "total_visits": LoyaltyProgram.total_visits + 1,
+            "total_spent": total_spent,
+            "last_visit": datetime.utcnow(),
+            "tier": tier_expression(total_spent)
+        },
+        create_account=True
+    )
+
+
+def deduct_points(
+    db: Session,
+    phone: str,
+    points: int,
+    order_id: Optional[int] = None,
+    idempotency_key: Optional[str] = None
+) -> int:
+    """Atomowo odejmuje punkty; zwraca pozostałe saldo"""
+    return _apply_transaction(
+        db, phone, LoyaltyTransactionType.REDEEM, -points,
+        order_id=order_id,
+        idempotency_key=idempotency_key
+    )
+
+
+def adjust_points(
+    db: Session,
+    phone: str,
+    points: int,
+    description: Optional[str] = None,
+    idempotency_key: Optional[str] = None
+) -> int:
+    """Ręczna korekta salda (dodatnia lub ujemna)"""
+    return _apply_transaction(
+        db, phone, LoyaltyTransactionType.ADJUST, points,
+        idempotency_key=idempotency_key,
+        description=description
+    )
+
+
+def expire_points(db: Session, now: Optional[datetime] = None) -> int:
+    """Wygasza saldo kont bez wizyty od LOYALTY_POINTS_EXPIRE_DAYS - dwoma zapytaniami.
+
+    INSERT ... SELECT zapisuje wpisy EXPIRE (klucz expire:<dzień>:<konto>
+    chroni przed podwójnym uruchomieniem), a UPDATE odejmuje od salda
+    dokładnie kwoty z tych wpisów.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=settings.LOYALTY_POINTS_EXPIRE_DAYS)
+    batch_id = uuid.uuid4().hex[:12]
+    idempotency_key = literal(f"expire:{now.date().isoformat()}:") + cast(LoyaltyProgram.id, String)
+
+    expiring = select(
+        LoyaltyProgram.id,
+        cast(literal(LoyaltyTransactionType.EXPIRE, type_=LoyaltyTransaction.kind.type), LoyaltyTransaction.kind.type),
+        -LoyaltyProgram.points,
+        idempotency_key,
+        literal(batch_id),
+        literal("Wygaśnięcie punktów")
+    ).where(
+        LoyaltyProgram.points > 0,
+        or_(
+            LoyaltyProgram.last_visit < cutoff,
+            (LoyaltyProgram.last_visit == None) & (LoyaltyProgram.created_at < cutoff)
+        ),
+        ~exists().where(LoyaltyTransaction.idempotency_key == idempotency_key)
+    ).with_for_update()
+
+    db.execute(insert(LoyaltyTransaction).from_select(
+        ["loyalty_id", "kind", "points", "idempotency_key", "batch_id", "description"],
+        expiring
+    ))
+
+    expired_points = select(func.sum(LoyaltyTransaction.points)).where(
+        LoyaltyTransaction.batch_id == batch_id,
+        LoyaltyTransaction.loyalty_id == LoyaltyProgram.id
+    ).scalar_subquery()
+    result = db.execute(
+        update(LoyaltyProgram)
+        .where(LoyaltyProgram.id.in_(
+            select(LoyaltyTransaction.loyalty_id).where(LoyaltyTransaction.batch_id == batch_id)
+        ))
+        .values(points=LoyaltyProgram.points + expired_points)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def recompute_tiers(db: Session) -> int:
+    """Przelicza poziomy wszystkich kont jednym UPDATE; zwraca liczbę zmienionych"""
+    tier = tier_expression(func.coalesce(LoyaltyProgram.total_spent, 0.0))
+    result = db.execute(
+        update(LoyaltyProgram)
+        .where(or_(LoyaltyProgram.tier == None, LoyaltyProgram.tier != tier))
+        .values(tier=tier)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def run_loyalty_maintenance(db: Session) -> Dict[str, int]:
+    """Zadanie nocne: wygaśnięcie punktów i przeliczenie poziomów w jednej transakcji"""
+    expired = expire_points(db)
+    tiers_changed = recompute_tiers(db)
+    db.commit()
+    return {"expired_accounts": expired, "tiers_changed": tiers_changed}
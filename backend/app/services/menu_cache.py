@@ -0,0 +1,58 @@
+"""Cached, read-only snapshot of the menu used for pricing"""
+import threading
+import time
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models.menu_item import MenuItem
+
+# Other API workers only see menu edits after the TTL expires
+MENU_CACHE_TTL_SECONDS = 30.0
+
+
+class MenuEntry(NamedTuple):
+    id: int
+    name: str
+    price: float
+    category: str
+    available: bool
+
+
+def load_menu_entries(db: Session, item_ids: Optional[Iterable[int]] = None) -> Dict[int, MenuEntry]:
+    """Load menu entries in one query, optionally restricted to item_ids"""
+    query = db.query(MenuItem.id, MenuItem.name, MenuItem.price, MenuItem.category, MenuItem.available)
+    if item_ids is not None:
+        query = query.filter(MenuItem.id.in_(list(item_ids)))
+    return {
+        row.id: MenuEntry(row.id, row.name, row.price, row.category, bool(row.available))
+        for row in query
+    }
+
+
+_lock = threading.Lock()
+_snapshot: Optional[Dict[int, MenuEntry]] = None
+_loaded_at = 0.0
+
+
+def get_menu_snapshot(db: Session) -> Dict[int, MenuEntry]:
+    """Return {item_id: MenuEntry}, reloading with one query when stale"""
+    global _snapshot, _loaded_at
+
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _loaded_at < MENU_CACHE_TTL_SECONDS:
+        return snapshot
+
+    with _lock:
+        if _snapshot is not None and time.monotonic() - _loaded_at < MENU_CACHE_TTL_SECONDS:
+            return _snapshot
+        _snapshot = load_menu_entries(db)
+        _loaded_at = time.monotonic()
+        return _snapshot
+
+
+def invalidate_menu_cache() -> None:
+    """Drop the snapshot after a menu change in this process"""
+    global _snapshot
+    with _lock:
+        _snapshot = None
@@ -0,0 +1,351 @@
+"""Wysyłka wiadomości marketingowych: dostawcy, limity i ponowienia.
+
+Limit wywołań dostawcy jest wspólny dla wszystkich dispatcherów w procesie
+(wątki workera, wyzwalacze obok kampanii). Paczka wiadomości jest przed
+wysyłką dzierżawiona (claimed_by / claimed_until), więc dwa dispatchery nie
+wyślą tej samej wiadomości, a status zapisuje tylko właściciel dzierżawy.
+"""
+import asyncio
+import html
+import logging
+import random
+import smtplib
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, or_, select, update
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.marketing import MarketingMessage, CampaignType
+from app.services.tracking import expand_tracking_links, open_pixel_url
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_BATCH_SIZE = 500
+
+
+@dataclass
+class OutboundMessage:
+    id: int
+    channel: CampaignType
+    phone: Optional[str]
+    email: Optional[str]
+    subject: Optional[str]
+    content: str
+
+
+@dataclass
+class DeliveryResult:
+    id: int
+    delivered: bool
+    error_message: Optional[str] = None
+
+
+class DeliveryError(Exception):
+    """Błąd dostawcy; retryable=False oznacza, że ponowienie nic nie da"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class TokenBucket:
+    """Limit wywołań na sekundę z dopuszczalną serią; bezpieczny dla wielu wątków i pętli zdarzeń"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Pobiera żeton; zwraca, ile sekund trzeba odczekać przed wywołaniem"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Rezerwacja: saldo może zejść poniżej zera, czekamy na jego spłatę
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+_shared_buckets: Dict[Tuple[CampaignType, str], TokenBucket] = {}
+_shared_buckets_lock = threading.Lock()
+
+
+def shared_bucket(channel: CampaignType, provider: "MessageProvider") -> TokenBucket:
+    """Jeden limit na dostawcę i kanał dla całego procesu"""
+    key = (channel, type(provider).__name__)
+    with _shared_buckets_lock:
+        bucket = _shared_buckets.get(key)
+        if bucket is None:
+            bucket = _shared_buckets[key] = TokenBucket(provider.rate_per_second)
+        return bucket
+
+
+class MessageProvider:
+    """Bazowa klasa dostawcy; podklasy implementują send()"""
+    rate_per_second: float = 10.0
+
+    async def send(self, message: OutboundMessage) -> None:
+        raise NotImplementedError
+
+
+class ConsoleSmsProvider(MessageProvider):
+    """Wypisuje SMS-y na konsolę (integracja z Twilio, MessageBird, etc.)"""
+
+    def __init__(self, rate_per_second: float):
+        self.rate_per_second = rate_per_second
+
+    async def send(self, message: OutboundMessage) -> None:
+        if not message.phone:
+            raise DeliveryError("Brak numeru telefonu", retryable=False)
+        print(f"[SMS] Wysyłanie do {message.phone}: {message.content}")
+
+
+class ConsoleEmailProvider(MessageProvider):
+    """Wypisuje emaile na konsolę (integracja z SendGrid, Mailgun, etc.)"""
+
+    def __init__(self, rate_per_second: float):
+        self.rate_per_second = rate_per_second
+
+    async def send(self, message: OutboundMessage) -> None:
+        if not message.email:
+            raise DeliveryError("Brak adresu email", retryable=False)
+        print(f"[EMAIL] Wysyłanie do {message.email}: {message.subject}")
+
+
+class SmtpEmailProvider(MessageProvider):
+    """Email przez SMTP, np. lokalny serwer testowy (MailHog, python -m aiosmtpd -n)"""
+
+    def __init__(self, rate_per_second: float, host: str, port: int, sender: str):
+        self.rate_per_second = rate_per_second
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def _send_sync(self, message: OutboundMessage) -> None:
+        email = EmailMessage()
+        email["From"] = self.sender
+        email["To"] = message.email
+        email["Subject"] = message.subject or ""
+        email.set_content(message.content)
+        # Wersja HTML z pikselem śledzącym otwarcia
+        body = html.escape(message.content).replace("\n", "<br>")
+        email.add_alternative(
+            f'<html><body>{body}<img src="{open_pixel_url(message.id)}" width="1" height="1" alt=""></body></html>',
+            subtype="html"
+        )
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(email)
+
+    async def send(self, message: OutboundMessage) -> None:
+        if not message.email:
+            raise DeliveryError("Brak adresu email", retryable=False)
+        try:
+            await asyncio.to_thread(self._send_sync, message)
+        except smtplib.SMTPRecipientsRefused as e:
+            raise DeliveryError(str(e), retryable=False)
+        except (smtplib.SMTPException, OSError) as e:
+            raise DeliveryError(str(e))
+
+
+class SinkProvider(MessageProvider):
+    """Lokalny odbiornik do testów: zapisuje wiadomości w pamięci zamiast je wysyłać"""
+
+    def __init__(self, rate_per_second: float = 1000.0, fail_every: int = 0):
+        self.rate_per_second = rate_per_second
+        self.fail_every = fail_every  # co n-ta próba kończy się błędem (test ponowień)
+        self.attempts = 0
+        self.sent: List[OutboundMessage] = []
+
+    async def send(self, message: OutboundMessage) -> None:
+        self.attempts += 1
+        if self.fail_every and self.attempts % self.fail_every == 0:
+            raise DeliveryError("Symulowany błąd dostawcy")
+        self.sent.append(message)
+
+
+# Fabryki dostawców według nazwy z konfiguracji (SMS_PROVIDER / EMAIL_PROVIDER)
+PROVIDER_FACTORIES: Dict[str, Callable[[CampaignType], MessageProvider]] = {
+    "console": lambda channel: (
+        ConsoleSmsProvider(settings.SMS_RATE_PER_SECOND) if channel == CampaignType.SMS
+        else ConsoleEmailProvider(settings.EMAIL_RATE_PER_SECOND)
+    ),
+    "smtp": lambda channel: SmtpEmailProvider(
+        settings.EMAIL_RATE_PER_SECOND, settings.SMTP_HOST, settings.SMTP_PORT, settings.SMTP_FROM
+    ),
+    "sink": lambda channel: SinkProvider(),
+}
+
+
+def register_provider(name: str, factory: Callable[[CampaignType], MessageProvider]) -> None:
+    """Rejestruje własnego dostawcę (np. Twilio) pod nazwą używaną w konfiguracji"""
+    PROVIDER_FACTORIES[name] = factory
+
+
+def configured_providers() -> Dict[CampaignType, MessageProvider]:
+    """Dostawcy dla kanałów według ustawień"""
+    return {
+        CampaignType.SMS: PROVIDER_FACTORIES[settings.SMS_PROVIDER](CampaignType.SMS),
+        CampaignType.EMAIL: PROVIDER_FACTORIES[settings.EMAIL_PROVIDER](CampaignType.EMAIL),
+    }
+
+
+@dataclass
+class MessageDispatcher:
+    """Ograniczona pula asynchronicznych workerów wysyłających wiadomości"""
+    providers: Dict[CampaignType, MessageProvider]
+    concurrency: int = 20
+    max_retries: int = 3
+    base_delay: float = 0.5
+    buckets: Dict[CampaignType, TokenBucket] = field(default_factory=dict)
+
+    def __post_init__(self):
+        for channel, provider in self.providers.items():
+            self.buckets.setdefault(channel, shared_bucket(channel, provider))
+
+    async def deliver(self, message: OutboundMessage) -> DeliveryResult:
+        """Wysyła jedną wiadomość z ponowieniami (wykładnicze opóźnienie z losowym rozrzutem)"""
+        provider = self.providers.get(message.channel)
+        if provider is None:
+            return DeliveryResult(message.id, False, f"Brak dostawcy dla kanału {message.channel.value}")
+
+        for attempt in range(self.max_retries + 1):
+            await self.buckets[message.channel].acquire()
+            try:
+                await provider.send(message)
+                return DeliveryResult(message.id, True)
+            except DeliveryError as e:
+                if not e.retryable or attempt == self.max_retries:
+                    return DeliveryResult(message.id, False, str(e)[:255])
+            except Exception as e:
+                logger.exception("Provider error for message %s", message.id)
+                if attempt == self.max_retries:
+                    return DeliveryResult(message.id, False, str(e)[:255])
+            await asyncio.sleep(self.base_delay * 2 ** attempt * (1 + random.random()))
+
+    async def dispatch(self, messages: Sequence[OutboundMessage]) -> List[DeliveryResult]:
+        """Wysyła paczkę wiadomości przez co najwyżej `concurrency` równoległych workerów"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for message in messages:
+            queue.put_nowait(message)
+        results: List[DeliveryResult] = []
+
+        async def worker():
+            while True:
+                try:
+                    message = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results.append(await self.deliver(message))
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(messages)) or 1)))
+        return results
+
+
+def claim_pending_messages(claim_token: str, campaign_id: Optional[int] = None, limit: int = DISPATCH_BATCH_SIZE) -> List[OutboundMessage]:
+    """Dzierżawi kolejną paczkę niewysłanych wiadomości i zatwierdza dzierżawę.
+
+    Wiadomości trzymane przez inny dispatcher są pomijane (FOR UPDATE SKIP
+    LOCKED, a potem claimed_until), dopóki jego dzierżawa nie wygaśnie.
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        candidates = select(MarketingMessage.id).where(
+            MarketingMessage.delivered == False,
+            MarketingMessage.error_message == None,
+            or_(MarketingMessage.claimed_until == None, MarketingMessage.claimed_until < now)
+        )
+        if campaign_id is not None:
+            candidates = candidates.where(MarketingMessage.campaign_id == campaign_id)
+        candidates = candidates.order_by(MarketingMessage.id).limit(limit).with_for_update(skip_locked=True)
+        rows = db.execute(
+            update(MarketingMessage)
+            .where(MarketingMessage.id.in_(candidates.scalar_subquery()))
+            .values(claimed_by=claim_token, claimed_until=now + timedelta(seconds=settings.MESSAGE_CLAIM_SECONDS))
+            .returning(
+                MarketingMessage.id,
+                MarketingMessage.message_type,
+                MarketingMessage.customer_phone,
+                MarketingMessage.customer_email,
+                MarketingMessage.subject,
+                MarketingMessage.message_content
+            )
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.commit()
+        return [
+            OutboundMessage(
+                row.id,
+                row.message_type,
+                row.customer_phone,
+                row.customer_email,
+                row.subject,
+                expand_tracking_links(row.id, row.message_content)
+            )
+            for row in sorted(rows, key=lambda row: row.id)
+        ]
+    finally:
+        db.close()
+
+
+def record_delivery_results(claim_token: str, results: Sequence[DeliveryResult]) -> int:
+    """Zapisuje statusy jednym UPDATE wykonywanym paczką, tylko dla wiadomości wciąż dzierżawionych"""
+    if not results:
+        return 0
+    table = MarketingMessage.__table__
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(table)
+            .where(table.c.id == bindparam("message_id"), table.c.claimed_by == bindparam("claim_token"))
+            .values(delivered=bindparam("is_delivered"), error_message=bindparam("error"), claimed_until=None),
+            [
+                {"message_id": r.id, "claim_token": claim_token, "is_delivered": r.delivered, "error": r.error_message}
+                for r in results
+            ]
+        )
+        db.commit()
+        recorded = result.rowcount
+    finally:
+        db.close()
+    if 0 <= recorded < len(results):
+        logger.warning("Lost the claim on %s of %s sent messages", len(results) - recorded, len(results))
+    return recorded
+
+
+async def deliver_pending_async(campaign_id: Optional[int] = None, dispatcher: Optional[MessageDispatcher] = None) -> int:
+    """Wysyła wszystkie oczekujące wiadomości dzierżawionymi paczkami i zapisuje statusy"""
+    dispatcher = dispatcher or MessageDispatcher(
+        configured_providers(),
+        concurrency=settings.DISPATCH_CONCURRENCY,
+        max_retries=settings.DISPATCH_MAX_RETRIES
+    )
+    claim_token = uuid.uuid4().hex
+    total = 0
+    while True:
+        batch = await asyncio.to_thread(claim_pending_messages, claim_token, campaign_id)
+        if not batch:
+            return total
+        results = await dispatcher.dispatch(batch)
+        await asyncio.to_thread(record_delivery_results, claim_token, results)
+        total += len(batch)
+
+
+def deliver_pending_messages(campaign_id: Optional[int] = None) -> int:
+    """Synchroniczny punkt wejścia (zadania w tle, worker)"""
+    return asyncio.run(deliver_pending_async(campaign_id))
@@ -0,0 +1,333 @@
+"""Payment provider clients (Stripe, PayPal) on a pooled async HTTP client.
+
+Providers are called over their REST APIs with httpx instead of the blocking
+SDKs, so a slow provider only suspends the awaiting request and never holds
+a worker thread. Each provider keeps one client with keep-alive connections
+and strict timeouts. Failed calls are retried with the same idempotency key,
+so a retry after a lost response never creates a second charge. A circuit
+breaker fails fast while a provider keeps failing.
+
+Point STRIPE_API_BASE / PAYPAL_API_BASE at ``python -m app.payment_stub`` to
+run the payment flows offline.
+"""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {409, 429, 500, 502, 503, 504}
+
+
+class PaymentProviderError(Exception):
+    """The provider rejected the call or could not be reached"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ProviderUnavailableError(PaymentProviderError):
+    """The circuit is open: the provider failed repeatedly and is not called for a while"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message, retryable=True)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures, lets one trial call through after `reset_timeout`
+
+    Used from a single event loop, so no locking is needed.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self, name: str) -> None:
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial_running):
+            retry_after = self.reset_timeout - (time.monotonic() - self.opened_at)
+            raise ProviderUnavailableError(f"{name} is temporarily unavailable", max(retry_after, 1.0))
+        if state == "half-open":
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def after_call(self) -> None:
+        """Always called when a call ends; a trial that ended without a verdict lets the next call try"""
+        self._trial_running = False
+
+
+@dataclass
+class PaymentIntentResult:
+    payment_intent_id: str
+    client_secret: str
+
+
+@dataclass
+class PayPalPaymentResult:
+    payment_id: str
+    approval_url: Optional[str]
+
+
+class PaymentProvider:
+    """Base class: pooled client, timeouts, retries and circuit breaking"""
+    name = "provider"
+
+    def __init__(self, base_url: str, max_retries: Optional[int] = None):
+        self.base_url = base_url
+        self.max_retries = settings.PAYMENT_MAX_RETRIES if max_retries is None else max_retries
+        self.base_delay = 0.2
+        self.breaker = CircuitBreaker(settings.PAYMENT_CIRCUIT_FAILURES, settings.PAYMENT_CIRCUIT_RESET_SECONDS)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(
+                    settings.PAYMENT_TIMEOUT_SECONDS,
+                    connect=settings.PAYMENT_CONNECT_TIMEOUT_SECONDS,
+                    pool=settings.PAYMENT_CONNECT_TIMEOUT_SECONDS
+                ),
+                limits=httpx.Limits(
+                    max_connections=settings.PAYMENT_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.PAYMENT_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _auth_headers(self) -> Dict[str, str]:
+        return {}
+
+    def _idempotency_headers(self, key: str) -> Dict[str, str]:
+        return {"Idempotency-Key": key}
+
+    def _error_message(self, response: httpx.Response) -> str:
+        return f"{self.name} returned HTTP {response.status_code}"
+
+    async def _send(
+        self, method: str, path: str, headers: Dict[str, str], required: Sequence[str] = (), **kwargs
+    ) -> dict:
+        """One attempt returning the JSON body; raises PaymentProviderError(retryable=...) on failure.
+
+        A body that is not a JSON object or lacks a `required` field is
+        treated like a failed call, so it is retried and counted by the breaker.
+        """
+        try:
+            response = await self.client.request(method, path, headers=headers, **kwargs)
+        except httpx.TimeoutException:
+            raise PaymentProviderError(f"{self.name} timed out", retryable=True)
+        except httpx.TransportError as e:
+            raise PaymentProviderError(f"{self.name} connection failed: {e}", retryable=True)
+        if response.status_code >= 400:
+            raise PaymentProviderError(
+                self._error_message(response), retryable=response.status_code in RETRYABLE_STATUS
+            )
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or any(field not in data for field in required):
+            raise PaymentProviderError(f"{self.name} returned an unexpected response", retryable=True)
+        return data
+
+    async def request(
+        self, method: str, path: str, idempotency_key: str, required: Sequence[str] = (), **kwargs
+    ) -> dict:
+        """Call the provider with retries; every attempt carries the same idempotency key"""
+        self.breaker.before_call(self.name)
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    headers = {**await self._auth_headers(), **self._idempotency_headers(idempotency_key)}
+                    data = await self._send(method, path, headers, required, **kwargs)
+                except PaymentProviderError as e:
+                    if not e.retryable:
+                        # The provider answered; a rejected payment says nothing about its health
+                        self.breaker.record_success()
+                        raise
+                    if attempt == self.max_retries:
+                        self.breaker.record_failure()
+                        logger.warning("%s %s failed after %d attempts: %s", self.name, path, attempt + 1, e)
+                        raise
+                    await asyncio.sleep(self.base_delay * 2 ** attempt * (1 + random.random()))
+                    continue
+                self.breaker.record_success()
+                return data
+        finally:
+            # Cancelled or failed unexpectedly: do not leave a half-open breaker waiting for this trial
+            self.breaker.after_call()
+
+
+class StripeProvider(PaymentProvider):
+    name = "Stripe"
+
+    def __init__(self, api_key: str, base_url: str, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.api_key = api_key
+
+    async def _auth_headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _error_message(self, response: httpx.Response) -> str:
+        try:
+            return response.json()["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            return super()._error_message(response)
+
+    async def create_payment_intent(
+        self, amount: int, currency: str, order_id: int, idempotency_key: str
+    ) -> PaymentIntentResult:
+        data = await self.request(
+            "POST",
+            "/v1/payment_intents",
+            idempotency_key,
+            required=("id", "client_secret"),
+            data={"amount": amount, "currency": currency, "metadata[order_id]": order_id}
+        )
+        return PaymentIntentResult(data["id"], data["client_secret"])
+
+
+class PayPalProvider(PaymentProvider):
+    name = "PayPal"
+
+    def __init__(self, client_id: str, client_secret: str, base_url: str, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+
+    async def _auth_headers(self) -> Dict[str, str]:
+        if self._token is None or time.monotonic() >= self._token_expires_at:
+            async with self._token_lock:
+                if self._token is None or time.monotonic() >= self._token_expires_at:
+                    data = await self._send(
+                        "POST",
+                        "/v1/oauth2/token",
+                        {},
+                        required=("access_token",),
+                        data={"grant_type": "client_credentials"},
+                        auth=(self.client_id, self.client_secret)
+                    )
+                    try:
+                        expires_in = float(data.get("expires_in") or 0)
+                    except (TypeError, ValueError):
+                        expires_in = 0.0
+                    self._token = data["access_token"]
+                    # Renew a minute early so a token never expires mid-request
+                    self._token_expires_at = time.monotonic() + max(expires_in - 60, 0)
+        return {"Authorization": f"Bearer {self._token}"}
+
+    def _idempotency_headers(self, key: str) -> Dict[str, str]:
+        return {"PayPal-Request-Id": key}
+
+    def _error_message(self, response: httpx.Response) -> str:
+        try:
+            return response.json()["message"]
+        except (ValueError, KeyError, TypeError):
+            return super()._error_message(response)
+
+    async def create_payment(
+        self, amount: float, currency: str, order_id: int, idempotency_key: str
+    ) -> PayPalPaymentResult:
+        data = await self.request(
+            "POST",
+            "/v1/payments/payment",
+            idempotency_key,
+            required=("id",),
+            json={
+                "intent": "sale",
+                "payer": {"payment_method": "paypal"},
+                "transactions": [{
+                    "amount": {"total": str(amount), "currency": currency},
+                    "description": f"Order #{order_id}"
+                }],
+                "redirect_urls": {
+                    "return_url": "http://localhost:3000/payment/success",
+                    "cancel_url": "http://localhost:3000/payment/cancel"
+                }
+            }
+        )
+        approval_url = next(
+            (
+                link.get("href") for link in data.get("links") or []
+                if isinstance(link, dict) and link.get("rel") == "approval_url"
+            ),
+            None
+        )
+        return PayPalPaymentResult(data["id"], approval_url)
+
+
+_providers: Dict[str, PaymentProvider] = {}
+
+
+def paypal_api_base() -> str:
+    if settings.PAYPAL_API_BASE:
+        return settings.PAYPAL_API_BASE
+    if settings.PAYPAL_MODE == "live":
+        return "https://api-m.paypal.com"
+    return "https://api-m.sandbox.paypal.com"
+
+
+def stripe_provider() -> Optional[StripeProvider]:
+    """The configured Stripe client, or None when Stripe is not configured"""
+    if not settings.STRIPE_API_KEY:
+        return None
+    if "stripe" not in _providers:
+        _providers["stripe"] = StripeProvider(settings.STRIPE_API_KEY, settings.STRIPE_API_BASE)
+    return _providers["stripe"]
+
+
+def paypal_provider() -> Optional[PayPalProvider]:
+    """The configured PayPal client, or None when PayPal is not configured"""
+    if not (settings.PAYPAL_CLIENT_ID and settings.PAYPAL_CLIENT_SECRET):
+        return None
+    if "paypal" not in _providers:
+        _providers["paypal"] = PayPalProvider(
+            settings.PAYPAL_CLIENT_ID, settings.PAYPAL_CLIENT_SECRET, paypal_api_base()
+        )
+    return _providers["paypal"]
+
+
+async def close_payment_providers() -> None:
+    for provider in _providers.values():
+        await provider.close()
+    _providers.clear()
@@ -0,0 +1,99 @@
+"""Staff quick-login PINs and failed-attempt lockout.
+
+Staff switch users at a terminal dozens of times an hour, so PINs use a
+keyed HMAC-SHA256 instead of bcrypt: verifying costs microseconds, and a
+leaked users table is useless without PIN_PEPPER. The hash is bound to the
+user id, so equal PINs of different users do not produce equal hashes.
+
+A 4-digit PIN only has 10 000 values, so the real protection against
+guessing is the lockout: failures are counted per user and per terminal,
+and from PIN_MAX_ATTEMPTS on each further failure doubles the lockout. The
+counters live in process memory; with several API workers an attacker gets
+at most PIN_MAX_ATTEMPTS tries per worker before being locked out.
+"""
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.user import User
+
+MAX_TRACKED_KEYS = 10000
+
+
+def hash_pin(user_id: int, pin: str) -> str:
+    message = f"{user_id}:{pin}".encode()
+    return hmac.new(settings.PIN_PEPPER.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_pin(user_id: int, pin: str, pin_hash: Optional[str]) -> bool:
+    if not pin_hash:
+        return False
+    return hmac.compare_digest(hash_pin(user_id, pin), pin_hash)
+
+
+def upgrade_legacy_pins(db: Session) -> int:
+    """Hash plaintext PINs left from before pin_hash existed and clear them (commits)"""
+    users = db.query(User).filter(User.pin_code != None).all()
+    for user in users:
+        user.pin_hash = hash_pin(user.id, user.pin_code)
+        user.pin_code = None
+    db.commit()
+    return len(users)
+
+
+class PinAttemptTracker:
+    """Failed PIN attempts per key with exponential lockout"""
+
+    def __init__(self, max_attempts: int, lockout: float, max_lockout: float):
+        self.max_attempts = max_attempts
+        self.lockout = lockout
+        self.max_lockout = max_lockout
+        self._lock = threading.Lock()
+        # key -> (failures, last failure, locked until)
+        self._entries: "OrderedDict[str, Tuple[int, float, float]]" = OrderedDict()
+
+    def retry_after(self, keys: Iterable[str]) -> float:
+        """Seconds until all keys may try again (0 when none is locked)"""
+        now = time.monotonic()
+        with self._lock:
+            locked_until = max((self._entries.get(key, (0, 0.0, 0.0))[2] for key in keys), default=0.0)
+        return max(0.0, locked_until - now)
+
+    def record_failure(self, keys: Iterable[str]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                failures, last_failure, locked_until = self._entries.pop(key, (0, 0.0, 0.0))
+                # Failures are forgotten after a quiet period as long as the longest lockout
+                if now - last_failure > self.max_lockout:
+                    failures = 0
+                failures += 1
+                if failures >= self.max_attempts:
+                    delay = min(self.lockout * 2 ** (failures - self.max_attempts), self.max_lockout)
+                    locked_until = now + delay
+                self._entries[key] = (failures, now, locked_until)
+            while len(self._entries) > MAX_TRACKED_KEYS:
+                self._entries.popitem(last=False)
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+pin_attempts = PinAttemptTracker(
+    settings.PIN_MAX_ATTEMPTS, settings.PIN_LOCKOUT_SECONDS, settings.PIN_LOCKOUT_MAX_SECONDS
+)
+
+
+def user_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def terminal_key(terminal: str) -> str:
+    return f"terminal:{terminal}"
@@ -0,0 +1,180 @@
+"""Order pricing engine shared by the quote endpoint and order creation"""
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy.orm import Session
+
+from app.models.coupon import Coupon
+from app.models.marketing import LoyaltyProgram
+from app.models.order import OrderType
+from app.models.settings import DeliverySettings
+from app.services.coupons import CouponError
+from app.services.discounts import CartLine, LineBreakdown, apply_coupons
+from app.services.loyalty import points_discount, points_for_discount
+from app.services.menu_cache import MenuEntry, load_menu_entries
+
+DELIVERY_SETTINGS_TTL_SECONDS = 30.0
+
+
+class PricingError(Exception):
+    """The order cannot be priced as requested (message is shown to the client)"""
+
+
+@dataclass(frozen=True)
+class DeliveryPricing:
+    enabled: bool
+    fee: float
+    free_threshold: float
+
+
+@dataclass
+class PriceQuote:
+    subtotal: float
+    lines: List[LineBreakdown]
+    coupons: List[Coupon] = field(default_factory=list)
+    coupon_discounts: Dict[str, float] = field(default_factory=dict)
+    coupon_discount: float = 0.0
+    loyalty_points: int = 0
+    loyalty_discount: float = 0.0
+    delivery_fee: float = 0.0
+    total: float = 0.0
+    tip_amount: float = 0.0
+    total_with_tip: float = 0.0
+    split_count: int = 1
+    split_amounts: List[float] = field(default_factory=list)
+
+    @property
+    def discount_amount(self) -> float:
+        return round(self.coupon_discount + self.loyalty_discount, 2)
+
+
+_delivery_lock = threading.Lock()
+_delivery_pricing: Optional[DeliveryPricing] = None
+_delivery_loaded_at = 0.0
+
+
+def get_delivery_pricing(db: Session) -> DeliveryPricing:
+    """Delivery settings, cached for DELIVERY_SETTINGS_TTL_SECONDS"""
+    global _delivery_pricing, _delivery_loaded_at
+
+    with _delivery_lock:
+        if _delivery_pricing is None or time.monotonic() - _delivery_loaded_at >= DELIVERY_SETTINGS_TTL_SECONDS:
+            settings = db.query(DeliverySettings).first()
+            if settings:
+                _delivery_pricing = DeliveryPricing(
+                    enabled=settings.delivery_enabled,
+                    fee=settings.delivery_fee,
+                    free_threshold=settings.free_delivery_threshold
+                )
+            else:
+                _delivery_pricing = DeliveryPricing(enabled=False, fee=0.0, free_threshold=0.0)
+            _delivery_loaded_at = time.monotonic()
+        return _delivery_pricing
+
+
+def invalidate_delivery_pricing() -> None:
+    """Drop cached delivery settings after they change in this process"""
+    global _delivery_pricing
+    with _delivery_lock:
+        _delivery_pricing = None
+
+
+def menu_cart_lines(items: Iterable, menu: Dict[int, MenuEntry]) -> List[CartLine]:
+    """Build cart lines at current menu prices, rejecting unknown or unavailable items"""
+    lines = []
+    for item in items:
+        entry = menu.get(item.item_id)
+        if entry is None:
+            raise PricingError(f"Menu item {item.item_id} not found")
+        if not entry.available:
+            raise PricingError(f"{entry.name} is not available")
+        lines.append(CartLine(
+            item_id=entry.id,
+            name=entry.name,
+            quantity=item.quantity,
+            unit_price=entry.price,
+            category=entry.category
+        ))
+    return lines
+
+
+def resolve_order_lines(db: Session, items: Sequence) -> List[CartLine]:
+    """Authoritative cart lines for an order, loaded with a single IN query"""
+    item_ids = {item.item_id for item in items}
+    menu = load_menu_entries(db, item_ids) if item_ids else {}
+    return menu_cart_lines(items, menu)
+
+
+def order_items_snapshot(lines: Iterable[CartLine]) -> List[dict]:
+    """Line items as stored in Order.items, with the names and prices charged"""
+    return [
+        {"item_id": line.item_id, "name": line.name, "quantity": line.quantity, "price": line.unit_price}
+        for line in lines
+    ]
+
+
+def split_amount(total: float, count: int) -> List[float]:
+    """Split a total into count shares that add up to the cent"""
+    cents = int(round(total * 100))
+    share, remainder = divmod(cents, count)
+    return [(share + (1 if i < remainder else 0)) / 100 for i in range(count)]
+
+
+def quote_order(
+    db: Session,
+    lines: List[CartLine],
+    order_type: OrderType = OrderType.DINE_IN,
+    coupon_codes: Sequence[str] = (),
+    customer_phone: Optional[str] = None,
+    loyalty_points: int = 0,
+    tip_amount: Optional[float] = None,
+    tip_percent: Optional[float] = None,
+    split_count: Optional[int] = None
+) -> PriceQuote:
+    """Price an order in one pass: subtotal, coupons, delivery, loyalty, tip and split"""
+    try:
+        coupons, discounts = apply_coupons(db, coupon_codes, lines)
+    except CouponError as e:
+        raise PricingError(str(e))
+
+    quote = PriceQuote(
+        subtotal=discounts.subtotal,
+        lines=discounts.lines,
+        coupons=coupons,
+        coupon_discounts=discounts.applied,
+        coupon_discount=discounts.discount_amount
+    )
+
+    # Delivery fee (the free-delivery threshold uses the undiscounted subtotal)
+    if order_type == OrderType.DELIVERY:
+        delivery = get_delivery_pricing(db)
+        if delivery.enabled and quote.subtotal < delivery.free_threshold:
+            quote.delivery_fee = delivery.fee
+
+    # Loyalty redemption, capped at what is left after coupons; only the points used are charged
+    if loyalty_points:
+        if not customer_phone:
+            raise PricingError("customer_phone is required to redeem loyalty points")
+        balance = db.query(LoyaltyProgram.points).filter(
+            LoyaltyProgram.customer_phone == customer_phone
+        ).scalar()
+        if balance is None:
+            raise PricingError("Loyalty account not found")
+        if balance < loyalty_points:
+            raise PricingError("Not enough loyalty points")
+        quote.loyalty_discount = min(points_discount(loyalty_points), discounts.total)
+        quote.loyalty_points = min(loyalty_points, points_for_discount(quote.loyalty_discount))
+
+    quote.total = round(max(0.0, quote.subtotal - quote.discount_amount) + quote.delivery_fee, 2)
+
+    if tip_amount is not None:
+        quote.tip_amount = round(tip_amount, 2)
+    elif tip_percent is not None:
+        quote.tip_amount = round(quote.total * tip_percent / 100, 2)
+    quote.total_with_tip = round(quote.total + quote.tip_amount, 2)
+
+    quote.split_count = split_count or 1
+    quote.split_amounts = split_amount(quote.total_with_tip, quote.split_count)
+    return quote
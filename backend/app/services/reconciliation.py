@@ -0,0 +1,280 @@
+"""Reconciliation of provider settlement exports against the payments table.
+
+The payments of the provider (and date range) are loaded once into a dict
+keyed by transaction id: the build side of a hash join. The export is then
+streamed record by record, CSV or JSON, and probed against it, so the file
+is never held in memory whatever its size. Memory grows with the number of
+payments compared, not with the export. Only discrepancies are stored;
+they are written in chunks while the file is read. With a date range, an
+export record with no payment in the range is looked up again without the
+range (in chunks) and only flagged as missing when the payment does not
+exist at all, since exports often cover a wider period than the run. The
+uploaded export is deleted once the run has completed or failed.
+"""
+import csv
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime, time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, TextIO, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models.payment import Payment
+from app.models.reconciliation import (
+    DiscrepancyType,
+    ReconciliationItem,
+    ReconciliationRun,
+    ReconciliationStatus
+)
+from app.services.bulk import bulk_insert
+
+logger = logging.getLogger(__name__)
+
+ITEM_CHUNK_SIZE = 1000
+JSON_READ_SIZE = 64 * 1024
+
+# Column / key names tried in order; Stripe exports name the payment intent column "PaymentIntent ID"
+TRANSACTION_ID_FIELDS = ("transaction_id", "PaymentIntent ID", "payment_intent", "Source", "source", "id")
+AMOUNT_FIELDS = ("amount", "Amount", "gross", "Gross")
+
+
+class ReconciliationError(Exception):
+    """The export cannot be read"""
+
+
+@dataclass
+class SettlementRecord:
+    line_number: int
+    transaction_id: str
+    amount_cents: int
+
+
+def iter_csv_records(stream: TextIO) -> Iterator[dict]:
+    yield from csv.DictReader(stream)
+
+
+def iter_json_records(stream: TextIO) -> Iterator[dict]:
+    """Objects of a JSON array, or JSON Lines, decoded incrementally from the stream"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    while True:
+        # Skip separators between records (and the array brackets)
+        while position < len(buffer) and buffer[position] in " \t\r\n,[]":
+            position += 1
+        if position == len(buffer):
+            if eof:
+                return
+            buffer, position = stream.read(JSON_READ_SIZE), 0
+            eof = not buffer
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise ReconciliationError(f"Invalid JSON near: {buffer[position:position + 80]!r}")
+            # The record continues in the next chunk
+            chunk = stream.read(JSON_READ_SIZE)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        if not isinstance(record, dict):
+            raise ReconciliationError("Export records must be JSON objects")
+        yield record
+        position = end
+
+
+def _field(record: dict, names: Tuple[str, ...]):
+    for name in names:
+        value = record.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def iter_settlement_records(stream: TextIO, file_format: str) -> Iterator[SettlementRecord]:
+    """Normalized records; JSON amounts are in cents (provider API objects), CSV amounts in units"""
+    if file_format == "csv":
+        records, amounts_in_cents = iter_csv_records(stream), False
+    elif file_format == "json":
+        records, amounts_in_cents = iter_json_records(stream), True
+    else:
+        raise ReconciliationError(f"Unsupported export format: {file_format}")
+
+    for line_number, record in enumerate(records, start=1):
+        transaction_id = _field(record, TRANSACTION_ID_FIELDS)
+        amount = _field(record, AMOUNT_FIELDS)
+        if transaction_id is None or amount is None:
+            raise ReconciliationError(f"Record {line_number} has no transaction id or amount")
+        try:
+            if amounts_in_cents:
+                amount_cents = int(amount)
+            else:
+                amount_cents = round(float(str(amount).replace(",", "")) * 100)
+        except ValueError:
+            raise ReconciliationError(f"Record {line_number} has an invalid amount: {amount!r}")
+        yield SettlementRecord(line_number, str(transaction_id), amount_cents)
+
+
+def load_payments(db: Session, run: ReconciliationRun) -> Tuple[Dict[str, list], List[dict]]:
+    """Build side: transaction_id -> [payment_id, amount_cents, matched]; duplicates in the table are returned as items"""
+    query = db.query(Payment.id, Payment.transaction_id, Payment.amount).filter(
+        Payment.payment_method == run.provider,
+        Payment.transaction_id != None
+    )
+    if run.date_from:
+        query = query.filter(Payment.timestamp >= datetime.combine(run.date_from, time.min))
+    if run.date_to:
+        query = query.filter(Payment.timestamp <= datetime.combine(run.date_to, time.max))
+
+    payments: Dict[str, list] = {}
+    duplicates: List[dict] = []
+    for row in query.yield_per(5000):
+        amount_cents = round(row.amount * 100)
+        if row.transaction_id in payments:
+            duplicates.append(_item(run.id, DiscrepancyType.DUPLICATE, row.transaction_id, row.id, expected=amount_cents))
+            continue
+        payments[row.transaction_id] = [row.id, amount_cents, False]
+    return payments, duplicates
+
+
+def find_known_transactions(db: Session, run: ReconciliationRun, transaction_ids: Set[str]) -> Set[str]:
+    """Transaction ids of the provider's payments, whatever their date"""
+    return {
+        transaction_id for (transaction_id,) in db.query(Payment.transaction_id).filter(
+            Payment.payment_method == run.provider,
+            Payment.transaction_id.in_(transaction_ids)
+        )
+    }
+
+
+def _item(
+    run_id: int,
+    kind: DiscrepancyType,
+    transaction_id: str,
+    payment_id: Optional[int] = None,
+    expected: Optional[int] = None,
+    actual: Optional[int] = None,
+    line_number: Optional[int] = None
+) -> dict:
+    return {
+        "run_id": run_id,
+        "kind": kind,
+        "transaction_id": transaction_id,
+        "payment_id": payment_id,
+        "expected_amount": expected / 100 if expected is not None else None,
+        "actual_amount": actual / 100 if actual is not None else None,
+        "line_number": line_number,
+    }
+
+
+def discard_export(run: ReconciliationRun) -> None:
+    """Delete the uploaded export of a finished run"""
+    try:
+        Path(run.file_path).unlink(missing_ok=True)
+    except OSError:
+        logger.warning("Could not delete settlement export %s", run.file_path, exc_info=True)
+
+
+def reconcile(db: Session, run_id: int) -> ReconciliationRun:
+    """Run a queued reconciliation and commit its results"""
+    run = db.query(ReconciliationRun).filter(ReconciliationRun.id == run_id).one()
+    if run.status in (ReconciliationStatus.COMPLETED, ReconciliationStatus.FAILED):
+        discard_export(run)
+        return run
+    # A retried job starts over
+    db.query(ReconciliationItem).filter(ReconciliationItem.run_id == run.id).delete(synchronize_session=False)
+    run.status = ReconciliationStatus.RUNNING
+    db.commit()
+
+    counts = {kind: 0 for kind in DiscrepancyType}
+    pending: List[dict] = []
+
+    def flag(item: dict) -> None:
+        counts[item["kind"]] += 1
+        pending.append(item)
+        if len(pending) >= ITEM_CHUNK_SIZE:
+            bulk_insert(db, ReconciliationItem.__table__, pending)
+            pending.clear()
+
+    try:
+        payments, table_duplicates = load_payments(db, run)
+        for item in table_duplicates:
+            flag(item)
+
+        rows_read = matched = outside_range = 0
+        unknown_seen: Set[str] = set()
+        known_outside: Set[str] = set()
+        unmatched: List[SettlementRecord] = []
+        windowed = run.date_from is not None or run.date_to is not None
+
+        def flag_unmatched() -> None:
+            nonlocal outside_range
+            if windowed:
+                known_outside.update(find_known_transactions(
+                    db, run, {r.transaction_id for r in unmatched} - known_outside - unknown_seen
+                ))
+            for r in unmatched:
+                if r.transaction_id in known_outside:
+                    outside_range += 1
+                    continue
+                kind = DiscrepancyType.DUPLICATE if r.transaction_id in unknown_seen else DiscrepancyType.MISSING_IN_DB
+                unknown_seen.add(r.transaction_id)
+                flag(_item(run.id, kind, r.transaction_id, actual=r.amount_cents, line_number=r.line_number))
+            unmatched.clear()
+
+        with open(run.file_path, encoding="utf-8-sig", newline="") as stream:
+            for record in iter_settlement_records(stream, run.file_format):
+                rows_read += 1
+                payment = payments.get(record.transaction_id)
+                if payment is None:
+                    # Resolved in chunks: with a date range the payment may exist outside it
+                    unmatched.append(record)
+                    if len(unmatched) >= ITEM_CHUNK_SIZE:
+                        flag_unmatched()
+                elif payment[2]:
+                    flag(_item(
+                        run.id, DiscrepancyType.DUPLICATE, record.transaction_id, payment[0],
+                        payment[1], record.amount_cents, record.line_number
+                    ))
+                else:
+                    payment[2] = True
+                    if payment[1] != record.amount_cents:
+                        flag(_item(
+                            run.id, DiscrepancyType.AMOUNT_MISMATCH, record.transaction_id, payment[0],
+                            payment[1], record.amount_cents, record.line_number
+                        ))
+                    else:
+                        matched += 1
+        flag_unmatched()
+        if outside_range:
+            logger.info("Reconciliation %s: %s export records are outside the date range", run.id, outside_range)
+
+        for transaction_id, (payment_id, amount_cents, seen) in payments.items():
+            if not seen:
+                flag(_item(run.id, DiscrepancyType.MISSING_IN_EXPORT, transaction_id, payment_id, expected=amount_cents))
+        bulk_insert(db, ReconciliationItem.__table__, pending)
+    except (ReconciliationError, OSError, csv.Error) as e:
+        db.rollback()
+        run.status = ReconciliationStatus.FAILED
+        run.error_message = str(e)
+        run.finished_at = datetime.utcnow()
+        db.commit()
+        discard_export(run)
+        logger.warning("Reconciliation %s failed: %s", run.id, e)
+        return run
+
+    run.rows_read = rows_read
+    run.matched = matched
+    run.missing_in_db = counts[DiscrepancyType.MISSING_IN_DB]
+    run.missing_in_export = counts[DiscrepancyType.MISSING_IN_EXPORT]
+    run.duplicates = counts[DiscrepancyType.DUPLICATE]
+    run.amount_mismatches = counts[DiscrepancyType.AMOUNT_MISMATCH]
+    run.status = ReconciliationStatus.COMPLETED
+    run.finished_at = datetime.utcnow()
+    db.commit()
+    discard_export(run)
+    return run
@@ -0,0 +1,108 @@
+"""Segmentacja klientów RFM (recency, frequency, monetary) liczona w NumPy"""
+import time
+from datetime import datetime
+from typing import Dict
+
+import numpy as np
+from sqlalchemy import delete, extract, func, select
+from sqlalchemy.orm import Session
+
+from app.models.marketing import CustomerSegment
+from app.models.recommendation import CustomerPreference
+from app.services.bulk import bulk_insert
+
+SEGMENTS = ("vip", "loyal", "new", "promising", "at_risk", "inactive", "regular")
+NEW_CUSTOMER_DAYS = 30
+SEGMENT_INSERT_CHUNK_SIZE = 10000
+
+
+def load_rfm_columns(db: Session):
+    """Jedno zapytanie agregujące; wynik jako kolumny NumPy (telefony jako lista)"""
+    # Kolumny tabeli zamiast atrybutów ORM - bez narzutu przetwarzania wierszy ORM
+    table = CustomerPreference.__table__
+    rows = db.execute(
+        select(
+            table.c.customer_phone,
+            func.max(extract("epoch", table.c.last_order_date)),
+            func.sum(table.c.order_frequency),
+            func.sum(table.c.total_spent)
+        ).group_by(table.c.customer_phone)
+    ).all()
+    count = len(rows)
+    if not count:
+        return [], np.empty(0), np.empty(0), np.empty(0)
+
+    phones, last_order, frequency, monetary = zip(*rows)
+    last_order = np.fromiter((np.nan if v is None else v for v in last_order), dtype=float, count=count)
+    frequency = np.fromiter((v or 0 for v in frequency), dtype=float, count=count)
+    monetary = np.fromiter((v or 0.0 for v in monetary), dtype=float, count=count)
+
+    recency_days = (time.time() - last_order) / 86400
+    # Klienci bez zamówień są traktowani jak najdawniej kupujący
+    if np.isnan(recency_days).all():
+        recency_days[:] = 0.0
+    else:
+        recency_days[np.isnan(recency_days)] = np.nanmax(recency_days) + 1
+    return list(phones), recency_days, frequency, monetary
+
+
+def quintile_scores(values: np.ndarray) -> np.ndarray:
+    """Ocena 1-5 według kwintyli; remisy trafiają do niższego przedziału"""
+    edges = np.quantile(values, [0.2, 0.4, 0.6, 0.8])
+    return np.searchsorted(edges, values, side="left") + 1
+
+
+def assign_segments(recency_days: np.ndarray, frequency: np.ndarray, monetary: np.ndarray):
+    """Zwraca (segmenty, r, f, m); reguły sprawdzane w kolejności, pierwsza pasująca wygrywa"""
+    r = 6 - quintile_scores(recency_days)  # im świeżej, tym wyżej
+    f = quintile_scores(frequency)
+    m = quintile_scores(monetary)
+
+    segments = np.select(
+        [
+            (frequency <= 1) & (recency_days <= NEW_CUSTOMER_DAYS),
+            (r >= 4) & (f >= 4) & (m >= 4),
+            (f >= 4) & (r >= 3),
+            (r <= 2) & (f >= 3),
+            r <= 2,
+            (r >= 4) & (f <= 2),
+        ],
+        ["new", "vip", "loyal", "at_risk", "inactive", "promising"],
+        default="regular"
+    )
+    return segments, r, f, m
+
+
+def recompute_segments(db: Session) -> Dict[str, int]:
+    """Przelicza segmenty wszystkich klientów i podmienia tabelę w jednej transakcji"""
+    phones, recency_days, frequency, monetary = load_rfm_columns(db)
+    computed_at = datetime.utcnow()
+
+    db.execute(delete(CustomerSegment))
+    if phones:
+        segments, r, f, m = assign_segments(recency_days, frequency, monetary)
+        for start in range(0, len(phones), SEGMENT_INSERT_CHUNK_SIZE):
+            end = start + SEGMENT_INSERT_CHUNK_SIZE
+            bulk_insert(db, CustomerSegment.__table__, [
+                {
+                    "customer_phone": phone,
+                    "segment": segment,
+                    "recency_score": r_score,
+                    "frequency_score": f_score,
+                    "monetary_score": m_score,
+                    "computed_at": computed_at
+                }
+                for phone, segment, r_score, f_score, m_score in zip(
+                    phones[start:end],
+                    segments[start:end].tolist(),
+                    r[start:end].tolist(),
+                    f[start:end].tolist(),
+                    m[start:end].tolist()
+                )
+            ])
+    db.commit()
+
+    if not phones:
+        return {}
+    names, counts = np.unique(segments, return_counts=True)
+    return dict(zip(names.tolist(), counts.tolist()))
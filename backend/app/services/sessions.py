@@ -0,0 +1,138 @@
+"""Rotating refresh-token sessions.
+
+Refresh tokens are random 256-bit strings, so a plain SHA-256 is enough to
+store them safely and checking one costs microseconds - bcrypt only runs
+when a user actually types a password. Every refresh swaps the token in a
+single conditional UPDATE; presenting an already rotated token again
+revokes the whole session (the token was copied).
+
+The next token is an HMAC of the previous one, so rotating the same token
+twice yields the same result. Within REFRESH_REUSE_GRACE_SECONDS of a
+rotation, the previous token gets the current one back instead of revoking
+the session: two refreshes from a tablet in flight at once, or a retry
+after a lost response, do not log the terminal out.
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import case, or_, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.auth_session import AuthSession
+
+
+class SessionError(Exception):
+    """The refresh token cannot be used (expired, revoked, reused or wrong device)"""
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def next_token(token: str) -> str:
+    """The token that replaces `token` on rotation"""
+    digest = hmac.new(settings.SECRET_KEY.encode(), b"refresh:" + token.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def create_session(
+    db: Session,
+    user_id: int,
+    device_id: Optional[str] = None,
+    device_name: Optional[str] = None
+) -> Tuple[AuthSession, str]:
+    """Start a session and return it with its first refresh token (no commit)"""
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    session = AuthSession(
+        user_id=user_id,
+        token_hash=hash_token(token),
+        device_id=device_id,
+        device_name=device_name,
+        last_used_at=now,
+        expires_at=now + timedelta(
+            days=settings.TERMINAL_SESSION_EXPIRE_DAYS if device_id else settings.REFRESH_TOKEN_EXPIRE_DAYS
+        )
+    )
+    db.add(session)
+    db.flush()
+    return session, token
+
+
+def rotate_session(db: Session, token: str, device_id: Optional[str] = None) -> Tuple[int, str]:
+    """Exchange a refresh token for a new one; returns (user_id, new token). No commit."""
+    old_hash = hash_token(token)
+    new_token = next_token(token)
+    now = datetime.utcnow()
+    usable = (
+        AuthSession.revoked_at == None,
+        AuthSession.expires_at > now,
+        # A device-bound session only refreshes from its own device
+        or_(AuthSession.device_id == None, AuthSession.device_id == device_id)
+    )
+
+    # Concurrent refreshes with the same token: exactly one UPDATE matches
+    user_id = db.execute(
+        update(AuthSession)
+        .where(AuthSession.token_hash == old_hash, *usable)
+        .values(
+            token_hash=hash_token(new_token),
+            previous_token_hash=old_hash,
+            last_used_at=now,
+            expires_at=case(
+                (AuthSession.device_id != None, now + timedelta(days=settings.TERMINAL_SESSION_EXPIRE_DAYS)),
+                else_=now + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+            )
+        )
+        .returning(AuthSession.user_id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+    if user_id is None:
+        # The token was just rotated and its successor is still current: hand the successor out again
+        user_id = db.query(AuthSession.user_id).filter(
+            AuthSession.previous_token_hash == old_hash,
+            AuthSession.token_hash == hash_token(new_token),
+            AuthSession.last_used_at > now - timedelta(seconds=settings.REFRESH_REUSE_GRACE_SECONDS),
+            *usable
+        ).scalar()
+        if user_id is not None:
+            return user_id, new_token
+
+        reused = db.execute(
+            update(AuthSession)
+            .where(AuthSession.previous_token_hash == old_hash, AuthSession.revoked_at == None)
+            .values(revoked_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if reused.rowcount:
+            db.commit()
+            raise SessionError("Refresh token reuse detected, session revoked")
+        raise SessionError("Invalid or expired refresh token")
+    return user_id, new_token
+
+
+def revoke_session(db: Session, token: str) -> bool:
+    result = db.execute(
+        update(AuthSession)
+        .where(AuthSession.token_hash == hash_token(token), AuthSession.revoked_at == None)
+        .values(revoked_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return bool(result.rowcount)
+
+
+def revoke_user_sessions(db: Session, user_id: int, session_id: Optional[int] = None) -> int:
+    """Revoke all sessions of a user, or one of them (no commit)"""
+    statement = update(AuthSession).where(AuthSession.user_id == user_id, AuthSession.revoked_at == None)
+    if session_id is not None:
+        statement = statement.where(AuthSession.id == session_id)
+    result = db.execute(
+        statement.values(revoked_at=datetime.utcnow()).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
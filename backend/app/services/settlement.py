@@ -0,0 +1,153 @@
+"""End-of-day settlement (Z-report).
+
+Closing a day aggregates the period since the previous closure in a few
+grouped queries and freezes the result in day_closures. Takings are counted
+when an order is paid (orders.paid_at) and refunds when they happen
+(orders.refunded_at), so an order placed before a closure and paid after it,
+or refunded after its day was closed, lands in the next report. Reading a
+closed day afterwards is a single-row lookup that never touches orders again.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.day_closure import DayClosure
+from app.models.order import Order, OrderStatus, PaymentStatus
+
+
+class SettlementError(Exception):
+    """The day cannot be closed"""
+
+
+class DayAlreadyClosedError(SettlementError):
+    """The business date already has a Z-report"""
+
+
+def _money(value) -> float:
+    return round(float(value or 0), 2)
+
+
+def set_payment_status(order: Order, payment_status: PaymentStatus, now: Optional[datetime] = None) -> None:
+    """Change an order's payment status and record when it was paid or refunded"""
+    if order.payment_status == payment_status:
+        return
+    now = now or datetime.utcnow()
+    if payment_status == PaymentStatus.PAID:
+        order.paid_at, order.refunded_at = now, None
+    elif payment_status == PaymentStatus.REFUNDED:
+        order.paid_at, order.refunded_at = order.paid_at or now, now
+    else:
+        order.paid_at = order.refunded_at = None
+    order.payment_status = payment_status
+
+
+def compute_day_totals(db: Session, period_start: datetime, period_end: datetime) -> dict:
+    """Orders placed, takings paid and refunds made in [period_start, period_end)"""
+    placed = db.query(
+        func.count(Order.id).label("order_count"),
+        func.coalesce(func.sum(case((Order.status == OrderStatus.CANCELLED, 1), else_=0)), 0).label("cancelled"),
+    ).filter(Order.timestamp >= period_start, Order.timestamp < period_end).one()
+
+    # Orders refunded later still count as takings of the period they were paid in
+    paid_in_period = (Order.paid_at >= period_start, Order.paid_at < period_end)
+    takings = db.query(
+        func.count(Order.id).label("paid_order_count"),
+        func.coalesce(func.sum(Order.total_price), 0).label("gross_sales"),
+        func.coalesce(func.sum(func.coalesce(Order.discount_amount, 0)), 0).label("discounts"),
+        func.coalesce(func.sum(func.coalesce(Order.tip_amount, 0)), 0).label("tips"),
+        func.coalesce(func.sum(func.coalesce(Order.delivery_fee, 0)), 0).label("delivery_fees"),
+    ).filter(*paid_in_period).one()
+
+    refunds = db.query(
+        func.count(Order.id).label("refunds"),
+        func.coalesce(func.sum(Order.total_price), 0).label("refund_total"),
+    ).filter(Order.refunded_at >= period_start, Order.refunded_at < period_end).one()
+
+    # Takings per payment method; tips are paid the same way as the order
+    by_method = db.query(
+        func.coalesce(Order.payment_method, "unknown").label("method"),
+        func.count(Order.id).label("count"),
+        func.sum(Order.total_price + func.coalesce(Order.tip_amount, 0)).label("amount"),
+        func.sum(func.coalesce(Order.card_amount, 0)).label("card_part"),
+        func.sum(func.coalesce(Order.cash_amount, 0)).label("cash_part"),
+    ).filter(*paid_in_period).group_by(func.coalesce(Order.payment_method, "unknown")).all()
+
+    payment_totals: Dict[str, dict] = {}
+
+    def add(method: str, count: int, amount: float) -> None:
+        entry = payment_totals.setdefault(method, {"count": 0, "amount": 0.0})
+        entry["count"] += count
+        entry["amount"] = _money(entry["amount"] + amount)
+
+    for row in by_method:
+        if row.method == "split":
+            # Split bills count towards card and cash by their parts; anything not covered stays "split"
+            card_part, cash_part = float(row.card_part or 0), float(row.cash_part or 0)
+            if card_part:
+                add("card", 0, card_part)
+            if cash_part:
+                add("cash", 0, cash_part)
+            add("split", row.count, float(row.amount or 0) - card_part - cash_part)
+        else:
+            add(row.method, row.count, float(row.amount or 0))
+
+    return {
+        "order_count": placed.order_count,
+        "paid_order_count": takings.paid_order_count,
+        "cancelled_order_count": int(placed.cancelled),
+        "gross_sales": _money(takings.gross_sales),
+        "discount_total": _money(takings.discounts),
+        "tip_total": _money(takings.tips),
+        "delivery_fee_total": _money(takings.delivery_fees),
+        "refund_count": refunds.refunds,
+        "refund_total": _money(refunds.refund_total),
+        "payment_totals": payment_totals,
+    }
+
+
+def close_day(db: Session, business_date: date, closed_by: Optional[int] = None) -> DayClosure:
+    """Freeze the Z-report of business_date and commit it.
+
+    The period runs from the end of the previous closure (or midnight of
+    business_date for the first one) until now, or until the end of
+    business_date when closing a past day. No payment or refund falls
+    between two reports or into both.
+    """
+    if business_date > datetime.utcnow().date():
+        raise SettlementError("Cannot close a future day")
+    if db.query(DayClosure.id).filter(DayClosure.business_date == business_date).first():
+        raise DayAlreadyClosedError(f"{business_date} is already closed")
+    if db.query(DayClosure.id).filter(DayClosure.business_date > business_date).first():
+        raise SettlementError("A later day is already closed; days are closed in order")
+
+    previous_end = (
+        db.query(DayClosure.period_end)
+        .filter(DayClosure.business_date < business_date)
+        .order_by(DayClosure.business_date.desc())
+        .limit(1)
+        .scalar()
+    )
+    period_start = previous_end or datetime.combine(business_date, time.min)
+    period_end = min(datetime.utcnow(), datetime.combine(business_date + timedelta(days=1), time.min))
+    if period_end <= period_start:
+        raise SettlementError("The previous closure already covers this day")
+
+    closure = DayClosure(
+        business_date=business_date,
+        period_start=period_start,
+        period_end=period_end,
+        closed_by=closed_by,
+        **compute_day_totals(db, period_start, period_end)
+    )
+    db.add(closure)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Closed concurrently by another request
+        db.rollback()
+        raise DayAlreadyClosedError(f"{business_date} is already closed")
+    db.refresh(closure)
+    return closure
@@ -0,0 +1,46 @@
+"""Cached list of active staff profiles for the terminal's selection screen"""
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models.user import User
+from app.schemas.user import StaffProfileResponse
+
+# Other API workers only see profile edits after the TTL expires
+STAFF_CACHE_TTL_SECONDS = 30.0
+
+_lock = threading.Lock()
+_profiles: Optional[List[StaffProfileResponse]] = None
+_loaded_at = 0.0
+
+
+def load_staff_profiles(db: Session) -> List[StaffProfileResponse]:
+    query = db.query(
+        User.id, User.name, User.full_name, User.position, User.avatar_url, User.role, User.is_active
+    ).filter(User.is_active == 1).order_by(User.id)
+    return [StaffProfileResponse.model_validate(row) for row in query]
+
+
+def get_staff_profiles(db: Session) -> List[StaffProfileResponse]:
+    """Return the active staff profiles, reloading with one query when stale"""
+    global _profiles, _loaded_at
+
+    profiles = _profiles
+    if profiles is not None and time.monotonic() - _loaded_at < STAFF_CACHE_TTL_SECONDS:
+        return profiles
+
+    with _lock:
+        if _profiles is not None and time.monotonic() - _loaded_at < STAFF_CACHE_TTL_SECONDS:
+            return _profiles
+        _profiles = load_staff_profiles(db)
+        _loaded_at = time.monotonic()
+        return _profiles
+
+
+def invalidate_staff_profiles() -> None:
+    """Drop the list after a user change in this process"""
+    global _profiles
+    with _lock:
+        _profiles = None
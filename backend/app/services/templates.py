@@ -0,0 +1,226 @@
+"""Kompilowane szablony wiadomości kampanii.
+
+Składnia: pola {name}, {points}, {tier}, {coupon}, {favorite_item} oraz
+warunki {if pole}...{else}...{end} / {if not pole}...{end}. Pozostałe
+nawiasy, np. {link:https://...}, zostają bez zmian. Szablon jest
+kompilowany raz na kampanię do planu renderowania opartego na
+str.format_map, a potem renderowany paczkami odbiorców.
+"""
+import json
+import math
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+FIELDS = ("name", "points", "tier", "coupon", "favorite_item")
+NAME_FALLBACK = "Kliencie"
+COUPON_SUFFIX = "\n\nTwój kod rabatowy: {coupon}"
+
+TAG_PATTERN = re.compile(r"\{(?:(if not|if) (\w+)|(else|end)|(\w+))\}")
+
+
+class TemplateError(Exception):
+    """Błąd składni szablonu (komunikat trafia do klienta)"""
+
+
+@dataclass(frozen=True)
+class Condition:
+    field: str
+    negate: bool
+    then: Tuple["Segment", ...]
+    otherwise: Tuple["Segment", ...]
+
+
+# Segment planu: gotowy format string (tylko pola) albo warunek
+Segment = Union[str, Condition]
+
+
+def _escape(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def _parse(source: str) -> Tuple[Tuple[Segment, ...], FrozenSet[str]]:
+    """Buduje plan: sąsiednie literały i pola są sklejane w jeden format string"""
+    fields: Set[str] = set()
+    # Stos otwartych bloków: (plan, bieżący format string, warunek, czy w gałęzi else)
+    stack: List[list] = [[[], "", None, False]]
+    position = 0
+
+    for match in TAG_PATTERN.finditer(source):
+        frame = stack[-1]
+        frame[1] += _escape(source[position:match.start()])
+        position = match.end()
+        condition, condition_field, keyword, field = match.groups()
+
+        if field is not None:
+            if field not in FIELDS:
+                raise TemplateError(f"Nieznane pole {{{field}}} - dostępne: {', '.join(FIELDS)}")
+            fields.add(field)
+            frame[1] += "{" + field + "}"
+        elif condition is not None:
+            if condition_field not in FIELDS:
+                raise TemplateError(f"Nieznane pole w warunku: {condition_field}")
+            fields.add(condition_field)
+            stack.append([[], "", (condition_field, condition == "if not"), False])
+        elif keyword == "else":
+            if frame[2] is None or frame[3]:
+                raise TemplateError("{else} poza blokiem {if}")
+            if frame[1]:
+                frame[0].append(frame[1])
+            frame[2] = (*frame[2], tuple(frame[0]))
+            frame[0], frame[1], frame[3] = [], "", True
+        else:  # end
+            if frame[2] is None:
+                raise TemplateError("{end} bez otwierającego {if}")
+            if frame[1]:
+                frame[0].append(frame[1])
+            stack.pop()
+            if frame[3]:
+                condition_field, negate, then = frame[2]
+                otherwise = tuple(frame[0])
+            else:
+                condition_field, negate = frame[2]
+                then, otherwise = tuple(frame[0]), ()
+            parent = stack[-1]
+            if parent[1]:
+                parent[0].append(parent[1])
+                parent[1] = ""
+            parent[0].append(Condition(condition_field, negate, then, otherwise))
+
+    if len(stack) > 1:
+        raise TemplateError("Brak {end} zamykającego {if}")
+    frame = stack[0]
+    frame[1] += _escape(source[position:])
+    if frame[1]:
+        frame[0].append(frame[1])
+    return tuple(frame[0]), frozenset(fields)
+
+
+def _render(plan: Sequence[Segment], values: Dict[str, str], present: Set[str]) -> str:
+    parts = []
+    for segment in plan:
+        if isinstance(segment, str):
+            parts.append(segment.format_map(values))
+        else:
+            branch = segment.then if (segment.field in present) != segment.negate else segment.otherwise
+            parts.append(_render(branch, values, present))
+    return "".join(parts)
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    plan: Tuple[Segment, ...]
+    fields: FrozenSet[str]
+
+    def render(self, values: Dict[str, str], present: Set[str]) -> str:
+        # Najczęstszy przypadek - szablon bez warunków to jeden format string
+        if len(self.plan) == 1 and isinstance(self.plan[0], str):
+            return self.plan[0].format_map(values)
+        return _render(self.plan, values, present)
+
+    def render_many(self, contexts: Iterable[Tuple[Dict[str, str], Set[str]]]) -> List[str]:
+        return [self.render(values, present) for values, present in contexts]
+
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> CompiledTemplate:
+    plan, fields = _parse(source)
+    return CompiledTemplate(plan, fields)
+
+
+def campaign_template(message_template: str, coupon_code: Optional[str]) -> CompiledTemplate:
+    """Szablon kampanii; kod kuponu jest dopisywany, gdy szablon go nie używa"""
+    compiled = compile_template(message_template)
+    if coupon_code and "coupon" not in compiled.fields:
+        compiled = compile_template(message_template + COUPON_SUFFIX)
+    return compiled
+
+
+def favorite_item(favorite_items: Optional[str]) -> str:
+    """Pierwszy ulubiony produkt z listy JSON (lub oddzielonej przecinkami)"""
+    if not favorite_items:
+        return ""
+    try:
+        items = json.loads(favorite_items)
+    except ValueError:
+        items = favorite_items.split(",")
+    if not isinstance(items, list) or not items:
+        return ""
+    first = items[0]
+    if isinstance(first, dict):
+        first = first.get("name", "")
+    return str(first).strip()
+
+
+def template_context(
+    name: Optional[str] = None,
+    points: Optional[int] = None,
+    tier: Optional[str] = None,
+    coupon: Optional[str] = None,
+    favorite_items: Optional[str] = None
+) -> Tuple[Dict[str, str], Set[str]]:
+    """Wartości pól do wstawienia oraz zbiór pól niepustych (dla warunków)"""
+    values = {
+        "name": name or NAME_FALLBACK,
+        "points": str(points or 0),
+        "tier": tier or "",
+        "coupon": coupon or "",
+        "favorite_item": favorite_item(favorite_items),
+    }
+    present = {field for field, raw in (("name", name), ("points", points), ("tier", tier), ("coupon", coupon)) if raw}
+    if values["favorite_item"]:
+        present.add("favorite_item")
+    return values, present
+
+
+# --- Długość SMS: GSM-7 (160/153 znaki) albo UCS-2 (70/67) ---
+
+GSM7_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = frozenset("^{}\\[~]|€\f")  # zajmują dwa septety
+POLISH_TRANSLITERATION = str.maketrans("ąćęłńóśźżĄĆĘŁŃÓŚŹŻ", "acelnoszzACELNOSZZ")
+
+
+@dataclass(frozen=True)
+class SmsLength:
+    encoding: str  # "GSM-7" albo "UCS-2"
+    units: int  # septety lub jednostki UTF-16
+    segments: int
+
+
+def is_gsm7(text: str) -> bool:
+    return all(char in GSM7_BASIC or char in GSM7_EXTENDED for char in text)
+
+
+def sms_length(text: str) -> SmsLength:
+    if is_gsm7(text):
+        units = len(text) + sum(1 for char in text if char in GSM7_EXTENDED)
+        return SmsLength("GSM-7", units, 1 if units <= 160 else math.ceil(units / 153))
+    units = len(text.encode("utf-16-le")) // 2
+    return SmsLength("UCS-2", units, 1 if units <= 70 else math.ceil(units / 67))
+
+
+def to_gsm7(text: str) -> str:
+    """Usuwa polskie znaki diakrytyczne, żeby SMS mieścił się w GSM-7"""
+    return text.translate(POLISH_TRANSLITERATION)
+
+
+def fit_sms(text: str, max_segments: int) -> str:
+    """Skraca SMS (na granicy słowa, z "...") tak, by zmieścił się w max_segments"""
+    if sms_length(text).segments <= max_segments:
+        return text
+    # Wyszukiwanie binarne najdłuższego prefiksu mieszczącego się w budżecie
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if sms_length(text[:middle].rstrip() + "...").segments <= max_segments:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text[:low]
+    if " " in cut.strip():
+        cut = cut[:cut.rstrip().rfind(" ")]
+    return cut.rstrip() + "..."
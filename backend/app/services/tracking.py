@@ -0,0 +1,204 @@
+"""Śledzenie otwarć, kliknięć i konwersji kampanii.
+
+Zdarzenia trafiają do bufora w pamięci i są zapisywane okresowo paczkami:
+flagi w marketing_messages zmieniane jednym UPDATE na paczkę, a liczniki
+kampanii zwiększane raz na kampanię, zamiast UPDATE wiersza kampanii
+przy każdym zdarzeniu.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+from sqlalchemy import bindparam, func, or_, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.marketing import MarketingCampaign, MarketingMessage
+
+logger = logging.getLogger(__name__)
+
+TRACKING_PIXEL = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+LINK_PATTERN = re.compile(r"\{link:(https?://[^}\s]+)\}")
+FLUSH_CHUNK_SIZE = 1000
+
+
+def _signature(message_id: int, url: str = "") -> str:
+    digest = hmac.new(settings.SECRET_KEY.encode(), f"{message_id}|{url}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).rstrip(b"=").decode()
+
+
+def sign_message_token(message_id: int, url: str = "") -> str:
+    """Token wiadomości; dla linków podpis obejmuje też adres docelowy"""
+    return f"{message_id}.{_signature(message_id, url)}"
+
+
+def verify_message_token(token: str, url: str = "") -> Optional[int]:
+    """Zwraca id wiadomości albo None, gdy token jest nieprawidłowy"""
+    message_id, _, signature = token.partition(".")
+    if not message_id.isdigit():
+        return None
+    if not hmac.compare_digest(signature, _signature(int(message_id), url)):
+        return None
+    return int(message_id)
+
+
+def open_pixel_url(message_id: int) -> str:
+    return f"{settings.PUBLIC_API_URL}/api/v1/marketing/track/open/{sign_message_token(message_id)}"
+
+
+def click_url(message_id: int, url: str) -> str:
+    token = sign_message_token(message_id, url)
+    return f"{settings.PUBLIC_API_URL}/api/v1/marketing/track/click/{token}?url={quote(url, safe='')}"
+
+
+def expand_tracking_links(message_id: int, content: str) -> str:
+    """Zamienia {link:https://...} w treści na śledzone linki tej wiadomości"""
+    return LINK_PATTERN.sub(lambda match: click_url(message_id, match.group(1)), content)
+
+
+@dataclass
+class TrackingEvents:
+    opened: Set[int] = field(default_factory=set)
+    clicked: Set[int] = field(default_factory=set)
+    conversions: List[Tuple[Tuple[str, ...], Optional[str]]] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.opened or self.clicked or self.conversions)
+
+
+class TrackingBuffer:
+    """Bufor zdarzeń współdzielony przez wątki procesu API"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = TrackingEvents()
+
+    def record_open(self, message_id: int) -> None:
+        with self._lock:
+            self._events.opened.add(message_id)
+
+    def record_click(self, message_id: int) -> None:
+        # Kliknięcie oznacza też otwarcie (piksel bywa blokowany)
+        with self._lock:
+            self._events.clicked.add(message_id)
+            self._events.opened.add(message_id)
+
+    def record_conversion(self, coupon_codes: Iterable[str], customer_phone: Optional[str]) -> None:
+        codes = tuple(code.upper() for code in coupon_codes if code)
+        if codes:
+            with self._lock:
+                self._events.conversions.append((codes, customer_phone))
+
+    def drain(self) -> TrackingEvents:
+        with self._lock:
+            events, self._events = self._events, TrackingEvents()
+        return events
+
+    def restore(self, events: TrackingEvents) -> None:
+        """Oddaje zdarzenia nieudanego zapisu do bufora"""
+        with self._lock:
+            self._events.opened |= events.opened
+            self._events.clicked |= events.clicked
+            self._events.conversions[:0] = events.conversions
+
+
+tracking_buffer = TrackingBuffer()
+
+
+def _set_message_flag(db: Session, column_name: str, message_ids: Iterable[int]) -> Counter:
+    """Ustawia flagę wiadomościom, które jej jeszcze nie miały; zwraca nowe zdarzenia per kampania"""
+    table = MarketingMessage.__table__
+    column = table.c[column_name]
+    ids = sorted(message_ids)
+    per_campaign = Counter()
+    for start in range(0, len(ids), FLUSH_CHUNK_SIZE):
+        campaign_ids = db.execute(
+            update(table)
+            .where(table.c.id.in_(ids[start:start + FLUSH_CHUNK_SIZE]), or_(column == False, column == None))
+            .values({column_name: True})
+            .returning(table.c.campaign_id)
+        ).scalars()
+        per_campaign.update(campaign_id for campaign_id in campaign_ids if campaign_id is not None)
+    return per_campaign
+
+
+def _bump_campaign_counter(db: Session, column_name: str, per_campaign: Counter) -> None:
+    """Jeden UPDATE (executemany) zwiększający licznik o sumę z paczki"""
+    if not per_campaign:
+        return
+    table = MarketingCampaign.__table__
+    column = table.c[column_name]
+    db.execute(
+        update(table)
+        .where(table.c.id == bindparam("campaign_id"))
+        .values({column_name: func.coalesce(column, 0) + bindparam("increment")}),
+        [{"campaign_id": campaign_id, "increment": count} for campaign_id, count in per_campaign.items()]
+    )
+
+
+def _attribute_conversions(db: Session, conversions: List[Tuple[Tuple[str, ...], Optional[str]]]) -> Counter:
+    """Konwersja = zamówienie z kuponem kampanii; wiadomość do klienta oznaczana jako converted.
+
+    Licznik kampanii rośnie o liczbę odbiorców, których wiadomość została właśnie oznaczona.
+    """
+    codes = {code for order_codes, _ in conversions for code in order_codes}
+    campaigns_by_code = {}
+    for campaign_id, coupon_code in db.query(MarketingCampaign.id, MarketingCampaign.coupon_code).filter(
+        func.upper(MarketingCampaign.coupon_code).in_(codes)
+    ):
+        campaigns_by_code.setdefault(coupon_code.upper(), []).append(campaign_id)
+
+    table = MarketingMessage.__table__
+    per_campaign = Counter()
+    for order_codes, phone in conversions:
+        campaign_ids = {cid for code in order_codes for cid in campaigns_by_code.get(code, ())}
+        if not campaign_ids or not phone:
+            continue
+        # Liczone są oznaczone wiadomości, więc kolejne zamówienie tego samego odbiorcy nie podbija licznika
+        converted = db.execute(
+            update(table)
+            .where(
+                table.c.campaign_id.in_(campaign_ids),
+                table.c.customer_phone == phone,
+                or_(table.c.converted == False, table.c.converted == None)
+            )
+            .values(converted=True)
+            .returning(table.c.campaign_id)
+        ).scalars()
+        per_campaign.update(converted)
+    return per_campaign
+
+
+def flush_tracking_events(buffer: TrackingBuffer = tracking_buffer) -> None:
+    """Zapisuje zebrane zdarzenia w jednej transakcji"""
+    events = buffer.drain()
+    if not events:
+        return
+    db = SessionLocal()
+    try:
+        _bump_campaign_counter(db, "opened_count", _set_message_flag(db, "opened", events.opened))
+        _bump_campaign_counter(db, "clicked_count", _set_message_flag(db, "clicked", events.clicked))
+        _bump_campaign_counter(db, "converted_count", _attribute_conversions(db, events.conversions))
+        db.commit()
+    except Exception:
+        logger.exception("Flushing tracking events failed")
+        db.rollback()
+        buffer.restore(events)
+    finally:
+        db.close()
+
+
+async def run_tracking_flusher() -> None:
+    """Pętla zapisu bufora uruchamiana w procesie API"""
+    while True:
+        await asyncio.sleep(settings.TRACKING_FLUSH_SECONDS)
+        await asyncio.to_thread(flush_tracking_events)
@@ -0,0 +1,150 @@
+"""Automatyczne triggery marketingowe (urodziny, nieaktywni klienci).
+
+Kandydaci są wybierani w SQL po indeksach i przetwarzani paczkami.
+Rejestr marketing_trigger_sends (klient, trigger, okres) sprawia, że
+ponowne uruchomienie tego samego dnia nie wysyła niczego drugi raz.
+"""
+import calendar
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterable, List
+
+from sqlalchemy import and_, exists, or_
+from sqlalchemy.orm import Query, Session
+
+from app.models.marketing import (
+    MarketingMessage,
+    MarketingTriggerSend,
+    LoyaltyProgram,
+    CampaignType,
+    TriggerType,
+    birthday_month_day
+)
+from app.models.recommendation import CustomerPreference
+from app.services.bulk import bulk_insert, insert_ignore
+
+TRIGGER_CHUNK_SIZE = 1000
+INACTIVE_AFTER_DAYS = 30
+INACTIVE_MIN_ORDERS = 3
+
+
+def _not_sent(phone_column, trigger: TriggerType, period):
+    """Warunek: klient nie dostał jeszcze tego triggera w danym okresie"""
+    return ~exists().where(
+        MarketingTriggerSend.customer_phone == phone_column,
+        MarketingTriggerSend.trigger_type == trigger,
+        MarketingTriggerSend.period == period
+    )
+
+
+def _send_chunk(db: Session, trigger: TriggerType, candidates: List[tuple], render: Callable[[str | None], str]) -> int:
+    """Rezerwuje (klient, trigger, okres) i zapisuje wiadomości tylko dla nowych wpisów.
+
+    candidates: krotki (telefon, imię, okres)
+    """
+    claimed = set(insert_ignore(
+        db,
+        MarketingTriggerSend.__table__,
+        [{"customer_phone": phone, "trigger_type": trigger, "period": period} for phone, _, period in candidates],
+        ("customer_phone", "trigger_type", "period"),
+        MarketingTriggerSend.customer_phone
+    ))
+
+    rows = []
+    for phone, name, _ in candidates:
+        if phone not in claimed:
+            continue
+        claimed.discard(phone)  # duplikaty telefonu w paczce dostają jedną wiadomość
+        rows.append({
+            "campaign_id": None,
+            "customer_phone": phone,
+            "customer_email": None,
+            "message_type": CampaignType.SMS,
+            "subject": None,
+            "message_content": render(name),
+            "delivered": False,
+            "opened": False,
+            "clicked": False,
+            "converted": False
+        })
+    bulk_insert(db, MarketingMessage.__table__, rows)
+    db.commit()
+    return len(rows)
+
+
+def _iter_chunks(query: Query, id_column) -> Iterable[list]:
+    """Stronicowanie po id, żeby nie trzymać kursora otwartego między commitami"""
+    last_id = 0
+    while True:
+        page = query.filter(id_column > last_id).order_by(id_column).limit(TRIGGER_CHUNK_SIZE).all()
+        if not page:
+            return
+        yield page
+        last_id = page[-1].id
+
+
+def birthday_days(today: date) -> List[tuple]:
+    """(miesiąc, dzień) świętowane dziś; 29 lutego obchodzi się 28-go w latach nieprzestępnych"""
+    days = [(today.month, today.day)]
+    if today.month == 2 and today.day == 28 and not calendar.isleap(today.year):
+        days.append((2, 29))
+    return days
+
+
+def run_birthday_trigger(db: Session, today: date) -> int:
+    month, day = birthday_month_day(db.get_bind().dialect.name)
+    period = str(today.year)
+    query = db.query(
+        LoyaltyProgram.id,
+        LoyaltyProgram.customer_phone,
+        LoyaltyProgram.customer_name
+    ).filter(
+        or_(*(and_(month == m, day == d) for m, d in birthday_days(today))),
+        _not_sent(LoyaltyProgram.customer_phone, TriggerType.BIRTHDAY, period)
+    )
+
+    def render(name):
+        return f"🎉 Wszystkiego najlepszego {name}! Masz 20% zniżki na dzisiejsze zamówienie. Kod: BIRTHDAY20"
+
+    queued = 0
+    for page in _iter_chunks(query, LoyaltyProgram.id):
+        candidates = [(row.customer_phone, row.customer_name, period) for row in page]
+        queued += _send_chunk(db, TriggerType.BIRTHDAY, candidates, render)
+    return queued
+
+
+def run_inactivity_trigger(db: Session, now: datetime) -> int:
+    """Jedna wiadomość na okres nieaktywności (okres = data ostatniego zamówienia)"""
+    threshold_date = now - timedelta(days=INACTIVE_AFTER_DAYS)
+    query = db.query(
+        CustomerPreference.id,
+        CustomerPreference.customer_phone,
+        CustomerPreference.customer_name,
+        CustomerPreference.last_order_date
+    ).filter(
+        CustomerPreference.last_order_date < threshold_date,
+        CustomerPreference.order_frequency >= INACTIVE_MIN_ORDERS,
+        # Pomija klientów, którym już wysłano trigger po ostatnim zamówieniu
+        ~exists().where(
+            MarketingTriggerSend.customer_phone == CustomerPreference.customer_phone,
+            MarketingTriggerSend.trigger_type == TriggerType.INACTIVE_CUSTOMER,
+            MarketingTriggerSend.created_at > CustomerPreference.last_order_date
+        )
+    )
+
+    def render(name):
+        return "Tęsknimy za Tobą! Specjalna oferta: 15% zniżki. Kod: COMEBACK15"
+
+    queued = 0
+    for page in _iter_chunks(query, CustomerPreference.id):
+        candidates = [
+            (row.customer_phone, row.customer_name, row.last_order_date.date().isoformat())
+            for row in page
+        ]
+        queued += _send_chunk(db, TriggerType.INACTIVE_CUSTOMER, candidates, render)
+    return queued
+
+
+def run_marketing_triggers(db: Session) -> int:
+    """Zapisuje wiadomości triggerów do wysłania; doręcza je dispatcher"""
+    now = datetime.utcnow()
+    return run_birthday_trigger(db, now.date()) + run_inactivity_trigger(db, now)
@@ -0,0 +1,195 @@
+"""Inbox of provider webhooks: store on receipt, process asynchronously.
+
+The webhook endpoint only verifies the signature and inserts the event keyed
+by (provider, event id), skipping replays, then answers 200. Its latency
+does not depend on what the event triggers, and a retry storm costs one
+conflicting insert per request. A background loop in each API process works
+through the inbox in batches, oldest provider timestamp first. Rows are
+claimed with FOR UPDATE SKIP LOCKED, so several API processes can share it.
+Handlers are idempotent, so an event that is processed again after a crash
+changes nothing. Providers do not guarantee delivery order: an event that
+refers to something not received yet (a refund before its payment) stays
+pending and is retried, without using up attempts for WEBHOOK_WAIT_SECONDS.
+"""
+import asyncio
+import logging
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.order import Order, PaymentStatus
+from app.models.payment import Payment
+from app.models.webhook_event import WebhookEvent
+from app.services.bulk import insert_ignore
+
+logger = logging.getLogger(__name__)
+
+
+class EventNotReady(Exception):
+    """The event depends on another event that has not been processed yet"""
+
+
+def record_event(db: Session, provider: str, event: dict) -> bool:
+    """Store a verified event (no commit); False when it was already received"""
+    created = event.get("created")
+    inserted = insert_ignore(
+        db,
+        WebhookEvent.__table__,
+        [{
+            "provider": provider,
+            "event_id": event["id"],
+            "event_type": event["type"],
+            "payload": event,
+            "event_created_at": datetime.utcfromtimestamp(created) if created else None,
+            "attempts": 0,
+        }],
+        ["provider", "event_id"],
+        WebhookEvent.id
+    )
+    return bool(inserted)
+
+
+def handle_payment_intent_succeeded(db: Session, event: dict) -> None:
+    intent = event["data"]["object"]
+    order_id = (intent.get("metadata") or {}).get("order_id")
+    if not order_id or db.query(Order.id).filter(Order.id == int(order_id)).first() is None:
+        logger.warning("Stripe payment intent %s has no known order", intent["id"])
+        return
+
+    # An order has at most one payment: a replay, or a payment taken another way, inserts nothing
+    inserted = insert_ignore(
+        db,
+        Payment.__table__,
+        [{
+            "order_id": int(order_id),
+            "amount": intent["amount"] / 100,  # Convert from cents
+            "payment_method": "stripe",
+            "transaction_id": intent["id"],
+            "status": "completed",
+            "timestamp": datetime.utcnow(),
+        }],
+        ["order_id"],
+        Payment.id
+    )
+    if inserted:
+        # An order already paid keeps its payment time (its takings may be in a closed Z-report);
+        # one refunded in the meantime stays refunded
+        db.execute(
+            update(Order)
+            .where(Order.id == int(order_id), Order.payment_status.notin_([PaymentStatus.PAID, PaymentStatus.REFUNDED]))
+            .values(
+                payment_status=PaymentStatus.PAID,
+                payment_method="stripe",
+                paid_at=func.coalesce(Order.paid_at, datetime.utcnow())
+            )
+        )
+
+
+def handle_charge_refunded(db: Session, event: dict) -> None:
+    charge = event["data"]["object"]
+    # Partial refunds leave the order paid
+    if not charge.get("refunded") or not charge.get("payment_intent"):
+        return
+    order_id = db.execute(
+        update(Payment)
+        .where(Payment.transaction_id == charge["payment_intent"], Payment.payment_method == "stripe")
+        .values(status="refunded")
+        .returning(Payment.order_id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if order_id is None:
+        raise EventNotReady(f"No Stripe payment {charge['payment_intent']} yet")
+    now = datetime.utcnow()
+    db.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.payment_status != PaymentStatus.REFUNDED)
+        .values(payment_status=PaymentStatus.REFUNDED, paid_at=func.coalesce(Order.paid_at, now), refunded_at=now)
+    )
+
+
+EVENT_HANDLERS: Dict[Tuple[str, str], Callable[[Session, dict], None]] = {
+    ("stripe", "payment_intent.succeeded"): handle_payment_intent_succeeded,
+    ("stripe", "charge.refunded"): handle_charge_refunded,
+}
+
+
+def process_webhook_events(db: Session, limit: int = 100) -> int:
+    """Process one batch of pending events in provider order and commit; returns how many succeeded"""
+    events = (
+        db.query(WebhookEvent)
+        .filter(WebhookEvent.processed_at == None, WebhookEvent.attempts < settings.WEBHOOK_MAX_ATTEMPTS)
+        .order_by(WebhookEvent.event_created_at, WebhookEvent.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    processed = 0
+    for event in events:
+        event.attempts += 1
+        handler = EVENT_HANDLERS.get((event.provider, event.event_type))
+        try:
+            with db.begin_nested():
+                if handler is not None:
+                    handler(db, event.payload)
+        except EventNotReady as e:
+            logger.info("Webhook event %s (%s) postponed: %s", event.event_id, event.event_type, e)
+            event.last_error = str(e)
+            received = event.event_created_at
+            if received is not None and datetime.utcnow() - received < timedelta(seconds=settings.WEBHOOK_WAIT_SECONDS):
+                event.attempts -= 1
+            continue
+        except Exception:
+            logger.exception("Webhook event %s (%s) failed", event.event_id, event.event_type)
+            event.last_error = traceback.format_exc()
+            continue
+        event.processed_at = datetime.utcnow()
+        event.last_error = None
+        processed += 1
+    db.commit()
+    return processed
+
+
+def process_pending_webhooks() -> int:
+    """Drain the inbox batch by batch; returns the number of events handled"""
+    db = SessionLocal()
+    total = 0
+    try:
+        while True:
+            count = process_webhook_events(db, settings.WEBHOOK_BATCH_SIZE)
+            total += count
+            # A short batch means the inbox is empty or events failed; failures wait for the next poll
+            if count < settings.WEBHOOK_BATCH_SIZE:
+                return total
+    except Exception:
+        logger.exception("Processing the webhook inbox failed")
+        db.rollback()
+        return total
+    finally:
+        db.close()
+
+
+_wakeup: Optional[asyncio.Event] = None
+
+
+def notify_webhook_processor() -> None:
+    """Wake the loop after a new event (call from the event loop)"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def run_webhook_processor() -> None:
+    """Inbox loop run in the API process; also polls for events received by other processes"""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), settings.WEBHOOK_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        await asyncio.to_thread(process_pending_webhooks)
@@ -0,0 +1,108 @@
+"""Worked-hours aggregation over work_logs, computed in SQL"""
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+
+from sqlalchemy import extract, func
+from sqlalchemy.orm import Session
+
+from app.models.user import User
+from app.models.work_log import WorkLog
+
+
+def seconds_between(dialect_name: str, start, end):
+    """SQL expression for end - start in seconds"""
+    if dialect_name == "postgresql":
+        return extract("epoch", end - start)
+    return (func.julianday(end) - func.julianday(start)) * 86400
+
+
+def later_of(dialect_name: str, a, b):
+    return func.greatest(a, b) if dialect_name == "postgresql" else func.max(a, b)
+
+
+def earlier_of(dialect_name: str, a, b):
+    return func.least(a, b) if dialect_name == "postgresql" else func.min(a, b)
+
+
+def _hours(seconds) -> float:
+    return round(float(seconds or 0) / 3600, 2)
+
+
+def work_stats(db: Session, start: datetime, user_id: Optional[int] = None) -> dict:
+    """Closed shifts started since `start`: totals, per user and per day"""
+    dialect = db.get_bind().dialect.name
+    seconds = func.sum(seconds_between(dialect, WorkLog.clock_in, WorkLog.clock_out))
+    filters = [WorkLog.clock_in >= start, WorkLog.clock_out != None]
+    if user_id:
+        filters.append(WorkLog.user_id == user_id)
+
+    by_user = (
+        db.query(WorkLog.user_id, User.name, func.count(WorkLog.id).label("shifts"), seconds.label("seconds"))
+        .join(User, User.id == WorkLog.user_id)
+        .filter(*filters)
+        .group_by(WorkLog.user_id, User.name)
+        .order_by(WorkLog.user_id)
+        .all()
+    )
+    day = func.date(WorkLog.clock_in)
+    by_day = (
+        db.query(day.label("day"), func.count(WorkLog.id).label("shifts"), seconds.label("seconds"))
+        .filter(*filters)
+        .group_by(day)
+        .order_by(day)
+        .all()
+    )
+    return {
+        "total_logs": sum(row.shifts for row in by_user),
+        "total_hours": _hours(sum(float(row.seconds or 0) for row in by_user)),
+        "by_user": [
+            {"user_id": row.user_id, "user_name": row.name, "shifts": row.shifts, "hours": _hours(row.seconds)}
+            for row in by_user
+        ],
+        "by_day": [
+            {"date": str(row.day), "shifts": row.shifts, "hours": _hours(row.seconds)}
+            for row in by_day
+        ],
+    }
+
+
+def payroll(db: Session, period_start: date, period_end: date) -> List[dict]:
+    """Hours per user in [period_start, period_end] (inclusive days); shifts crossing the edges are cut at them"""
+    dialect = db.get_bind().dialect.name
+    start = datetime.combine(period_start, time.min)
+    end = datetime.combine(period_end + timedelta(days=1), time.min)
+    worked = seconds_between(
+        dialect,
+        later_of(dialect, WorkLog.clock_in, start),
+        earlier_of(dialect, WorkLog.clock_out, end)
+    )
+    rows = (
+        db.query(
+            WorkLog.user_id,
+            User.name,
+            User.full_name,
+            User.position,
+            func.count(WorkLog.id).label("shifts"),
+            func.sum(worked).label("seconds"),
+            func.min(WorkLog.clock_in).label("first_clock_in"),
+            func.max(WorkLog.clock_out).label("last_clock_out"),
+        )
+        .join(User, User.id == WorkLog.user_id)
+        .filter(WorkLog.clock_out != None, WorkLog.clock_out > start, WorkLog.clock_in < end)
+        .group_by(WorkLog.user_id, User.name, User.full_name, User.position)
+        .order_by(User.name)
+        .all()
+    )
+    return [
+        {
+            "user_id": row.user_id,
+            "user_name": row.name,
+            "full_name": row.full_name,
+            "position": row.position,
+            "shifts": row.shifts,
+            "hours": _hours(row.seconds),
+            "first_clock_in": row.first_clock_in,
+            "last_clock_out": row.last_clock_out,
+        }
+        for row in rows
+    ]
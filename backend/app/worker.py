@@ -0,0 +1,185 @@
+"""Background job worker.
+
+Run with ``python -m app.worker``. Any number of workers can run against the
+same database: jobs are leased with FOR UPDATE SKIP LOCKED and a lease that
+outlives its visibility timeout (crashed or killed worker) is picked up again.
+While a handler runs, a heartbeat keeps extending its lease, so long jobs
+(campaign sends) are not taken over. Each claim gets its own lease owner id,
+and the final status is only written while that owner still holds the job.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import traceback
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Set
+
+from sqlalchemy.orm import Session
+
+import app.models  # noqa: F401 - registers all tables on Base.metadata
+from app.core.config import settings
+from app.core.database import Base, SessionLocal, engine
+from app.services.campaigns import queue_scheduled_campaigns, run_campaign_send
+from app.services.jobs import (
+    ClaimedJob, claim_jobs, complete_job, enqueue, extend_lease, fail_expired_jobs, fail_job, purge_finished_jobs
+)
+from app.services.labor_analytics import precompute_labor_sales
+from app.services.loyalty import run_loyalty_maintenance
+from app.services.messaging import deliver_pending_messages
+from app.services.reconciliation import reconcile
+from app.services.segments import recompute_segments
+from app.services.triggers import run_marketing_triggers
+
+logger = logging.getLogger("app.worker")
+
+SCHEDULE_CHECK_SECONDS = 30
+
+
+def _run_triggers(db: Session, payload: dict) -> None:
+    run_marketing_triggers(db)
+    deliver_pending_messages()
+
+
+HANDLERS: Dict[str, Callable[[Session, dict], None]] = {
+    "campaign.send": lambda db, payload: run_campaign_send(payload["send_job_id"]),
+    "marketing.scheduled_campaigns": lambda db, payload: queue_scheduled_campaigns(db),
+    "marketing.triggers": _run_triggers,
+    "marketing.segments": lambda db, payload: recompute_segments(db),
+    "messages.deliver": lambda db, payload: deliver_pending_messages(payload.get("campaign_id")),
+    "loyalty.maintenance": lambda db, payload: run_loyalty_maintenance(db),
+    "payments.reconcile": lambda db, payload: reconcile(db, payload["run_id"]),
+    "reports.labor_sales": lambda db, payload: precompute_labor_sales(db),
+    "jobs.purge": lambda db, payload: purge_finished_jobs(db, settings.JOB_RETENTION_DAYS),
+}
+
+
+class PeriodicJob(NamedTuple):
+    kind: str
+    interval: int  # seconds
+    offset: int = 0  # seconds after the start of each interval
+
+
+def periodic_jobs() -> List[PeriodicJob]:
+    return [
+        PeriodicJob("marketing.scheduled_campaigns", 60),
+        PeriodicJob("marketing.triggers", 86400, settings.MARKETING_TRIGGERS_HOUR * 3600),
+        PeriodicJob("marketing.segments", 86400, settings.SEGMENTS_RECOMPUTE_HOUR * 3600),
+        PeriodicJob("loyalty.maintenance", 86400, settings.LOYALTY_MAINTENANCE_HOUR * 3600),
+        PeriodicJob("reports.labor_sales", 86400, settings.LABOR_ANALYTICS_HOUR * 3600),
+        PeriodicJob("jobs.purge", 86400, settings.JOB_PURGE_HOUR * 3600),
+    ]
+
+
+def schedule_periodic_jobs(db: Session, now: datetime) -> None:
+    """Enqueue the current run of every periodic job once, however many workers call this"""
+    epoch = int((now - datetime(1970, 1, 1)).total_seconds())
+    for periodic in periodic_jobs():
+        period = epoch // periodic.interval
+        run_at = datetime(1970, 1, 1) + timedelta(seconds=period * periodic.interval + periodic.offset)
+        enqueue(db, periodic.kind, run_at=run_at, max_attempts=3, dedupe_key=f"{periodic.kind}:{period}")
+    db.commit()
+
+
+def heartbeat(job: ClaimedJob, lease_owner: str, visibility_timeout: int, done: threading.Event) -> None:
+    """Extend the job's lease every third of the visibility timeout until the handler returns"""
+    while not done.wait(visibility_timeout / 3):
+        db = SessionLocal()
+        try:
+            if not extend_lease(db, job.id, lease_owner, visibility_timeout):
+                logger.warning("Job %s (%s) lost its lease", job.id, job.kind)
+                return
+        except Exception:
+            logger.exception("Extending the lease of job %s failed", job.id)
+            db.rollback()
+        finally:
+            db.close()
+
+
+def execute_job(job: ClaimedJob, lease_owner: str, visibility_timeout: int) -> None:
+    done = threading.Event()
+    threading.Thread(
+        target=heartbeat, args=(job, lease_owner, visibility_timeout, done), name=f"job-{job.id}-heartbeat", daemon=True
+    ).start()
+    db = SessionLocal()
+    try:
+        handler = HANDLERS.get(job.kind)
+        if handler is None:
+            fail_job(db, job, lease_owner, f"Unknown job kind: {job.kind}")
+            return
+        try:
+            handler(db, job.payload)
+        except Exception:
+            logger.exception("Job %s (%s) failed on attempt %s", job.id, job.kind, job.attempts)
+            db.rollback()
+            fail_job(db, job, lease_owner, traceback.format_exc())
+            return
+        complete_job(db, job, lease_owner)
+    finally:
+        done.set()
+        db.close()
+
+
+def run_worker(concurrency: int, poll_interval: float, visibility_timeout: int, once: bool = False) -> None:
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    logger.info("Worker %s started (concurrency=%s)", worker_id, concurrency)
+    running: Set[Future] = set()
+    last_schedule = None
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while not stop.is_set():
+            now = datetime.utcnow()
+            running = {future for future in running if not future.done()}
+            claimed: List[ClaimedJob] = []
+
+            db = SessionLocal()
+            try:
+                if last_schedule is None or (now - last_schedule).total_seconds() >= SCHEDULE_CHECK_SECONDS:
+                    schedule_periodic_jobs(db, now)
+                    fail_expired_jobs(db)
+                    last_schedule = now
+                free = concurrency - len(running)
+                if free > 0:
+                    # A job leased again after its lease expired gets a different owner than the run still going
+                    lease_owner = f"{worker_id}:{uuid.uuid4().hex[:8]}"
+                    claimed = claim_jobs(db, lease_owner, free, visibility_timeout)
+            except Exception:
+                logger.exception("Polling the job queue failed")
+                db.rollback()
+            finally:
+                db.close()
+
+            for job in claimed:
+                running.add(pool.submit(execute_job, job, lease_owner, visibility_timeout))
+
+            if once and not claimed and not running:
+                break
+            if not claimed:
+                stop.wait(poll_interval)
+
+        logger.info("Worker %s stopping, waiting for %s running job(s)", worker_id, len(running))
+    logger.info("Worker %s stopped", worker_id)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run background jobs from the jobs table")
+    parser.add_argument("--concurrency", type=int, default=settings.WORKER_CONCURRENCY)
+    parser.add_argument("--poll-interval", type=float, default=settings.WORKER_POLL_INTERVAL_SECONDS)
+    parser.add_argument("--visibility-timeout", type=int, default=settings.JOB_VISIBILITY_TIMEOUT_SECONDS)
+    parser.add_argument("--once", action="store_true", help="exit when no job is due")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    Base.metadata.create_all(bind=engine)
+    run_worker(args.concurrency, args.poll_interval, args.visibility_timeout, once=args.once)
+
+
+if __name__ == "__main__":
+    main()
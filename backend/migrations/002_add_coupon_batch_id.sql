@@ -0,0 +1,5 @@
+-- Bulk-generated coupon codes are grouped by batch
+ALTER TABLE coupons
+ADD COLUMN IF NOT EXISTS batch_id VARCHAR;
+
+CREATE INDEX IF NOT EXISTS ix_coupons_batch_id ON coupons (batch_id);
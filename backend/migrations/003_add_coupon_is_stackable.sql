@@ -0,0 +1,5 @@
+-- Coupons that may be combined with other coupons on one order
+ALTER TABLE coupons
+ADD COLUMN IF NOT EXISTS is_stackable BOOLEAN DEFAULT FALSE;
+
+UPDATE coupons SET is_stackable = FALSE WHERE is_stackable IS NULL;
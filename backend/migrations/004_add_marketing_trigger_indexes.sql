@@ -0,0 +1,6 @@
+-- Indexes used by the daily birthday and inactivity triggers
+CREATE INDEX IF NOT EXISTS ix_loyalty_programs_birthday_month_day
+    ON loyalty_programs ((EXTRACT(MONTH FROM timezone('UTC', birthday))), (EXTRACT(DAY FROM timezone('UTC', birthday))));
+
+CREATE INDEX IF NOT EXISTS ix_customer_preferences_last_order_date
+    ON customer_preferences (last_order_date);
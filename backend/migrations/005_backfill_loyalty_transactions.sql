@@ -0,0 +1,8 @@
+-- Opening ledger entries for balances that existed before loyalty_transactions.
+-- The table itself is created by the application (Base.metadata.create_all),
+-- so run this after the first start of the new version.
+INSERT INTO loyalty_transactions (loyalty_id, kind, points, idempotency_key, description, created_at)
+SELECT id, 'ADJUST'::loyaltytransactiontype, points, 'opening:' || id, 'Saldo otwarcia', now()
+FROM loyalty_programs
+WHERE points <> 0
+ON CONFLICT (idempotency_key) DO NOTHING;
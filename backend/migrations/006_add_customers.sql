@@ -0,0 +1,177 @@
+-- Canonical customers keyed by E.164 phone (+48600100200).
+-- Normalizes phones in orders, customer_preferences and loyalty_programs,
+-- merges duplicate preference/loyalty rows that turn out to be the same
+-- customer and links all three tables to customers.id.
+--
+-- Order: run before starting the new version. Its models map the customer_id
+-- columns added here, so queries on orders, customer_preferences and
+-- loyalty_programs fail until this has run. loyalty_transactions and
+-- customer_segments are updated when they exist and skipped otherwise; on a
+-- deployment that has not applied 005 yet, run 005 after the first start as
+-- usual, and its opening entries use the merged balances.
+--
+-- Phones are normalized like app.services.customers.normalize_phone: set the
+-- two values below to the deployment's PHONE_COUNTRY_CODE and
+-- PHONE_NATIONAL_DIGITS before running, or the backfilled numbers will not
+-- match what the API writes.
+BEGIN;
+
+SET LOCAL app.phone_country_code = '48';
+SET LOCAL app.phone_national_digits = '9';
+
+CREATE OR REPLACE FUNCTION pg_temp.normalize_phone(raw text) RETURNS text AS $$
+DECLARE
+    phone text := regexp_replace(coalesce(raw, ''), '[\s().-]', '', 'g');
+    country_code text := current_setting('app.phone_country_code');
+    national_digits int := current_setting('app.phone_national_digits')::int;
+BEGIN
+    IF phone LIKE '00%' THEN
+        phone := '+' || substr(phone, 3);
+    END IF;
+    IF phone !~ '^\+' THEN
+        IF phone ~ ('^[0-9]{' || national_digits || '}$') THEN
+            phone := '+' || country_code || phone;
+        ELSIF phone ~ ('^' || country_code || '[0-9]{' || national_digits || '}$') THEN
+            phone := '+' || phone;
+        END IF;
+    END IF;
+    IF phone ~ '^\+[0-9]{8,15}$' THEN
+        RETURN phone;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+CREATE TABLE IF NOT EXISTS customers (
+    id SERIAL PRIMARY KEY,
+    phone VARCHAR NOT NULL,
+    name VARCHAR,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    updated_at TIMESTAMP WITH TIME ZONE
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_customers_phone ON customers (phone);
+CREATE INDEX IF NOT EXISTS ix_customers_id ON customers (id);
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS customer_id INTEGER REFERENCES customers (id) ON DELETE SET NULL;
+ALTER TABLE customer_preferences ADD COLUMN IF NOT EXISTS customer_id INTEGER REFERENCES customers (id) ON DELETE SET NULL;
+ALTER TABLE loyalty_programs ADD COLUMN IF NOT EXISTS customer_id INTEGER REFERENCES customers (id) ON DELETE SET NULL;
+
+-- Loyalty accounts: the oldest account of a customer absorbs the others
+CREATE TEMP TABLE loyalty_merge ON COMMIT DROP AS
+SELECT id, pg_temp.normalize_phone(customer_phone) AS phone,
+       min(id) OVER (PARTITION BY pg_temp.normalize_phone(customer_phone)) AS keep_id
+FROM loyalty_programs
+WHERE pg_temp.normalize_phone(customer_phone) IS NOT NULL;
+
+UPDATE loyalty_programs keeper
+SET points = merged.points,
+    total_visits = merged.total_visits,
+    total_spent = merged.total_spent,
+    last_visit = merged.last_visit,
+    birthday = coalesce(keeper.birthday, merged.birthday),
+    customer_name = coalesce(keeper.customer_name, merged.customer_name)
+FROM (
+    SELECT m.keep_id,
+           sum(coalesce(l.points, 0)) AS points,
+           sum(coalesce(l.total_visits, 0)) AS total_visits,
+           sum(coalesce(l.total_spent, 0)) AS total_spent,
+           max(l.last_visit) AS last_visit,
+           min(l.birthday) AS birthday,
+           min(l.customer_name) AS customer_name
+    FROM loyalty_merge m
+    JOIN loyalty_programs l ON l.id = m.id
+    GROUP BY m.keep_id
+    HAVING count(*) > 1
+) merged
+WHERE keeper.id = merged.keep_id;
+
+DO $$
+BEGIN
+    IF to_regclass('loyalty_transactions') IS NOT NULL THEN
+        UPDATE loyalty_transactions t
+        SET loyalty_id = m.keep_id
+        FROM loyalty_merge m
+        WHERE t.loyalty_id = m.id AND m.id <> m.keep_id;
+    END IF;
+END $$;
+
+DELETE FROM loyalty_programs l
+USING loyalty_merge m
+WHERE l.id = m.id AND m.id <> m.keep_id;
+
+UPDATE loyalty_programs l
+SET customer_phone = m.phone
+FROM loyalty_merge m
+WHERE l.id = m.id AND l.customer_phone <> m.phone;
+
+-- Customer preferences: one row per customer
+CREATE TEMP TABLE preference_merge ON COMMIT DROP AS
+SELECT id, pg_temp.normalize_phone(customer_phone) AS phone,
+       min(id) OVER (PARTITION BY pg_temp.normalize_phone(customer_phone)) AS keep_id
+FROM customer_preferences
+WHERE pg_temp.normalize_phone(customer_phone) IS NOT NULL;
+
+UPDATE customer_preferences keeper
+SET order_frequency = merged.order_frequency,
+    total_spent = merged.total_spent,
+    average_order_value = CASE WHEN merged.order_frequency > 0
+                               THEN merged.total_spent / merged.order_frequency ELSE 0 END,
+    last_order_date = merged.last_order_date,
+    customer_name = coalesce(keeper.customer_name, merged.customer_name)
+FROM (
+    SELECT m.keep_id,
+           sum(coalesce(p.order_frequency, 0)) AS order_frequency,
+           sum(coalesce(p.total_spent, 0)) AS total_spent,
+           max(p.last_order_date) AS last_order_date,
+           min(p.customer_name) AS customer_name
+    FROM preference_merge m
+    JOIN customer_preferences p ON p.id = m.id
+    GROUP BY m.keep_id
+    HAVING count(*) > 1
+) merged
+WHERE keeper.id = merged.keep_id;
+
+DELETE FROM customer_preferences p
+USING preference_merge m
+WHERE p.id = m.id AND m.id <> m.keep_id;
+
+UPDATE customer_preferences p
+SET customer_phone = m.phone
+FROM preference_merge m
+WHERE p.id = m.id AND p.customer_phone <> m.phone;
+
+UPDATE orders
+SET customer_phone = pg_temp.normalize_phone(customer_phone)
+WHERE pg_temp.normalize_phone(customer_phone) IS NOT NULL
+  AND customer_phone <> pg_temp.normalize_phone(customer_phone);
+
+-- Segments are keyed by phone and rebuilt by the nightly job
+DO $$
+BEGIN
+    IF to_regclass('customer_segments') IS NOT NULL THEN
+        DELETE FROM customer_segments;
+    END IF;
+END $$;
+
+INSERT INTO customers (phone, name)
+SELECT phone, max(name)
+FROM (
+    SELECT customer_phone AS phone, customer_name AS name FROM loyalty_programs
+    UNION ALL
+    SELECT customer_phone, customer_name FROM customer_preferences
+    UNION ALL
+    SELECT customer_phone, customer_name FROM orders
+) known
+WHERE phone LIKE '+%'
+GROUP BY phone
+ON CONFLICT (phone) DO NOTHING;
+
+UPDATE loyalty_programs l SET customer_id = c.id FROM customers c WHERE c.phone = l.customer_phone;
+UPDATE customer_preferences p SET customer_id = c.id FROM customers c WHERE c.phone = p.customer_phone;
+UPDATE orders o SET customer_id = c.id FROM customers c WHERE c.phone = o.customer_phone;
+
+CREATE INDEX IF NOT EXISTS ix_orders_customer_id ON orders (customer_id);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_customer_preferences_customer_id ON customer_preferences (customer_id);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_loyalty_programs_customer_id ON loyalty_programs (customer_id);
+
+COMMIT;
@@ -0,0 +1,4 @@
+-- Staff PINs are stored as HMAC-SHA256 (keyed with PIN_PEPPER) instead of plaintext.
+-- Existing plaintext PINs are hashed and cleared by the API on startup
+-- (app.services.pins.upgrade_legacy_pins), since the pepper is not known to the database.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS pin_hash VARCHAR(64);
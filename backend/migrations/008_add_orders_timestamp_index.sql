@@ -0,0 +1,2 @@
+-- Day closures and reports aggregate orders by time range
+CREATE INDEX IF NOT EXISTS ix_orders_timestamp ON orders (timestamp);
@@ -0,0 +1,10 @@
+-- Work-log lookups by user and time, and a single open shift per user.
+-- Older duplicate open shifts (left by concurrent clock-ins) are closed with zero length first,
+-- keeping the most recent one open.
+UPDATE work_logs SET clock_out = clock_in
+WHERE clock_out IS NULL
+  AND id NOT IN (SELECT MAX(id) FROM work_logs WHERE clock_out IS NULL GROUP BY user_id);
+
+CREATE INDEX IF NOT EXISTS ix_work_logs_user_clock_in ON work_logs (user_id, clock_in);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_work_logs_open_shift ON work_logs (user_id) WHERE clock_out IS NULL;
@@ -0,0 +1,4 @@
+-- Dispatchers lease a batch of pending messages before sending it (claimed_by / claimed_until),
+-- so two concurrent dispatchers never send the same message.
+ALTER TABLE marketing_messages ADD COLUMN IF NOT EXISTS claimed_by VARCHAR;
+ALTER TABLE marketing_messages ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP WITH TIME ZONE;
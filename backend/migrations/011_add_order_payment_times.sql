@@ -0,0 +1,15 @@
+-- When an order was paid and refunded; end-of-day reports count takings and refunds by these.
+-- Existing paid orders take the time of their payment record, or of their last update.
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS paid_at TIMESTAMP WITHOUT TIME ZONE;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS refunded_at TIMESTAMP WITHOUT TIME ZONE;
+
+UPDATE orders o
+SET paid_at = coalesce((SELECT p.timestamp FROM payments p WHERE p.order_id = o.id), o.updated_at, o.timestamp)
+WHERE o.payment_status IN ('PAID', 'REFUNDED') AND o.paid_at IS NULL;
+
+UPDATE orders
+SET refunded_at = coalesce(updated_at, timestamp)
+WHERE payment_status = 'REFUNDED' AND refunded_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_orders_paid_at ON orders (paid_at);
+CREATE INDEX IF NOT EXISTS ix_orders_refunded_at ON orders (refunded_at);
@@ -174,15 +174,6 @@ export default function CheckoutModal({ cart, total, onClose, onSuccess }) {
       const response = await orderAPI.create(orderData);
       const createdOrder = response.data;
 
-      // Mark coupon as used if applied
-      if (couponApplied && couponCode) {
-        try {
-          await couponAPI.use(couponCode);
-        } catch (err) {
-          console.error('Failed to mark coupon as used:', err);
-        }
-      }
-      
       // Dodajemy items do createdOrder do drukowania
       const orderForPrint = {
         ...createdOrder,